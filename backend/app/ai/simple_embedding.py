@@ -0,0 +1,51 @@
+"""
+A simple local embedding of texts, computed on the CPU with no model to load
+and no network: the word, word pair and character trigram features of the
+normalized text are hashed into a fixed size vector (the hashing trick).
+The normalization maps near-duplicates (differing in case or whitespace) to
+the same vector, small rewordings share most of their features.
+"""
+
+from typing import Iterator
+import re
+import unicodedata
+import zlib
+
+import numpy as np
+
+DIMENSION = 1024
+
+WORD = re.compile(r"\w+")
+
+
+def normalize(text: str) -> str:
+    """The text in a canonical form (compatibility characters), case folded
+    and with single spaces"""
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+
+def features(text: str) -> Iterator[str]:
+    words = WORD.findall(text)
+    yield from (f"w {word}" for word in words)
+    yield from (f"b {a} {b}" for a, b in zip(words, words[1:], strict=False))
+    yield from (f"c {text[i : i + 3]}" for i in range(len(text) - 2))
+
+
+def embed(text: str, dimension: int = DIMENSION) -> np.ndarray:
+    """The unit vector of a text, the dot product of two vectors is the
+    cosine similarity of the texts"""
+    vector = np.zeros(dimension, dtype=np.float32)
+    indices = []
+    signs = []
+    for feature in features(normalize(text)):
+        # A stable hash (unlike `hash`), the vectors are stored
+        digest = zlib.crc32(feature.encode())
+        indices.append(digest % dimension)
+        signs.append(1.0 if digest >> 31 else -1.0)
+    np.add.at(vector, indices, signs)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def similarity(a: str, b: str) -> float:
+    return float(embed(a) @ embed(b))
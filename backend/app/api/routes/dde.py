@@ -16,6 +16,7 @@ from app.lm.models import (
 )
 from app.services.object_store import documents
 from app.lm.handlers import ArenaHandler
+from app.ops import processes
 from app.ops.schema_converter import create_pydantic_model
 from app.models import (
     Message,
@@ -486,6 +487,8 @@ async def extract_from_file(
         extracted_data.find("{") : extracted_data.rfind("}") + 1
     ]
     token_indices=map_characters_to_token_indices(extracted_data_token)
-    extracted_data=extract_json_data(json_string, extracted_data_token, token_indices)
+    extracted_data = await processes.run_sync(
+        extract_json_data, json_string, extracted_data_token, token_indices
+    )
     return {"extracted_data": extracted_data, "identifier": identifier}
 
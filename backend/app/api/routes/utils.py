@@ -1,9 +1,15 @@
+from typing import Any
+
 from fastapi import APIRouter, Depends
 from pydantic.networks import EmailStr
 
 from app.api.deps import get_current_active_superuser
 from app.models import Message
 from app.utils import generate_test_email, send_email
+from app.ops import batching, processes, threads
+from app.services import clients, hedging, rate_limits, resilience
+from app.services.semantic_cache import semantic_cache
+import app.services.lm as slm
 
 router = APIRouter()
 
@@ -24,3 +30,26 @@ def test_email(email_to: EmailStr) -> Message:
         html_content=email_data.html_content,
     )
     return Message(message="Test email sent")
+
+
+@router.get(
+    "/metrics/",
+    dependencies=[Depends(get_current_active_superuser)],
+)
+async def metrics() -> dict[str, Any]:
+    """
+    Metrics of the computation engine.
+    """
+    return {
+        "threads": threads.stats(),
+        "processes": processes.stats(),
+        "batching": batching.stats(),
+        "http": clients.stats(),
+        "breakers": resilience.stats(),
+        "hedging": hedging.stats(),
+        "rate_limits": rate_limits.rate_limiter.stats()
+        if rate_limits.rate_limiter
+        else {},
+        "lm_cache": slm.response_cache.stats() if slm.response_cache else {},
+        "semantic_cache": semantic_cache.stats(),
+    }
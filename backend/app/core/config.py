@@ -82,6 +82,80 @@ class Settings(BaseSettings):
             path="0",
         )
 
+    # The format of the tasks sent to the workers: "json" or the compact
+    # binary "arena-msgpack" (see app.ops.binary)
+    CELERY_SERIALIZER: Literal["json", "arena-msgpack"] = "json"
+
+    # Tracing of the computations (see app.ops.tracing), the sampled traces
+    # are appended to a file and/or sent to an OTLP/HTTP collector
+    # (e.g. http://localhost:4318)
+    TRACING_SAMPLE_RATE: float = 0.0
+    TRACING_FILE: str | None = None
+    TRACING_ENDPOINT: str | None = None
+
+    # Time budgets in seconds (see app.ops.computation.Op.timeout): of the
+    # handling of a request, of a language model call and of a PII masking
+    REQUEST_TIMEOUT: float = 600.0
+    LM_TIMEOUT: float = 300.0
+    MASKING_TIMEOUT: float = 30.0
+    # Of the handling of a request with a streamed response (it goes on
+    # while the response is streamed) and of the wait for each chunk of a
+    # language model stream (see app.ops.computation.Op.stream_timeout)
+    STREAM_TIMEOUT: float = 1800.0
+    STREAM_IDLE_TIMEOUT: float = 120.0
+
+    # Pooled HTTP clients of the services (see app.services.clients), per
+    # origin and per event loop
+    HTTP2: bool = True
+    HTTP_MAX_CONNECTIONS: int = 100
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    HTTP_KEEPALIVE_EXPIRY: float = 30.0
+
+    # Retries of the failed requests to the services and circuit breakers
+    # of the upstreams (see app.services.resilience)
+    LM_RETRIES: int = 2
+    LM_RETRY_BACKOFF: float = 0.5
+    LM_RETRY_MAX_DELAY: float = 20.0
+    LM_BREAKER_THRESHOLD: int = 5
+    LM_BREAKER_RESET: float = 30.0
+
+    # Client-side rate limits of the providers per API key (see
+    # app.services.rate_limits), disabled unless in "memory" or in the broker
+    # "store" shared with the workers: the default limits per minute (the
+    # actual ones are learned from the responses) and the longest wait for a
+    # budget
+    LM_RATE_LIMIT: Literal["memory", "store"] | None = None
+    LM_RATE_LIMITS: dict[str, dict[str, float]] = {
+        "openai": {"requests": 500, "tokens": 30000},
+        "mistral": {"requests": 300, "tokens": 500000},
+        "anthropic": {"requests": 50, "tokens": 40000},
+    }
+    LM_RATE_LIMIT_MAX_WAIT: float = 30.0
+
+    # Hedged and fallback requests (see app.services.hedging): the latencies
+    # kept per model and the number needed to hedge at a percentile
+    LM_LATENCY_WINDOW: int = 1000
+    LM_HEDGE_MIN_SAMPLES: int = 20
+
+    # Aliases of the models (e.g. {"fast": "gpt-4o-mini"}) routed to the
+    # provider of the model they stand for (see app.services.routing)
+    LM_MODEL_ALIASES: dict[str, str] = {}
+
+    # Cache of the chat completion responses (see app.services.lm),
+    # disabled unless in "memory" or in the broker "store" shared with the
+    # workers
+    LM_CACHE: Literal["memory", "store"] | None = None
+    LM_CACHE_TTL: float = 3600.0
+    LM_CACHE_SIZE: int = 1024
+    # Semantic cache of the chat completion responses (see
+    # app.services.semantic_cache), in an on-disk index shared by the
+    # processes, enabled per user with a similarity threshold. A sample of
+    # the hits is audited (sent to the model) to measure their precision.
+    SEMANTIC_CACHE_PATH: str = "/tmp/arena_semantic_cache.sqlite"
+    SEMANTIC_CACHE_TTL: float = 86400.0
+    SEMANTIC_CACHE_SIZE: int = 10000
+    SEMANTIC_CACHE_AUDIT_RATE: float = 0.05
+
     # Presidio analyzer https://microsoft.github.io/presidio/analyzer/
     PRESIDIO_ANALYZER_SERVER: str = "localhost"
     PRESIDIO_ANALYZER_PORT: int = 5001
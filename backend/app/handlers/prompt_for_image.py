@@ -3,10 +3,11 @@ from app.lm.models import (
 )
 import base64
 from io import BytesIO
-from typing import TypedDict, BinaryIO
+from typing import AsyncIterable, TypedDict, BinaryIO
 from app.models import DocumentDataExtractor
-from app.ops import tup
-from app.ops.documents import as_png
+from app.ops import Op, tup
+from app.ops import processes
+from app.ops.documents import as_png_pages
 from app.services.pdf_reader import pdf_reader
 from app.services.png_reader import png_reader
 from app.models import ContentType
@@ -36,13 +37,41 @@ def fill_input_image(image_input: BytesIO | list[tuple[int, BytesIO]]) -> list[C
     else:
         raise ValueError("Invalid input type for image_input")
 
+
+class ExampleContents(
+    Op[tuple[AsyncIterable[tuple[int, BytesIO]], str], list[ContentTypes]]
+):
+    """The contents of an example, each page is added as it is rasterized"""
+
+    async def call(
+        self, pages: AsyncIterable[tuple[int, BytesIO]], output_text: str
+    ) -> list[ContentTypes]:
+        contents: list[ContentTypes] = []
+        idx = 0
+        async for _, image in pages:
+            idx += 1
+            contents.append(
+                TextContent(type="text", text=f"####\nInput of page {idx}")
+            )
+            contents.extend(fill_input_image(image))
+        contents.append(
+            TextContent(
+                type="text", text=f"Expected Output: {output_text}\n\n"
+            )
+        )
+        return contents
+
+
+example_contents = ExampleContents()
+
+
 #link to the OpenAI documentation specifying that only role 'user' is used for images:
 #https://platform.openai.com/docs/guides/vision
 async def full_prompt_from_image(file: BinaryIO, document_data_extractor: DocumentDataExtractor, upload_content_type: ContentType) -> list[ChatCompletionMessage]:
     if upload_content_type == ContentType.PDF:
-        prompt = pdf_reader.as_pngs(file)
+        prompt = await processes.run_sync(pdf_reader.as_pngs, file)
     elif upload_content_type == ContentType.PNG:
-        prompt = png_reader.as_png(file)
+        prompt = await processes.run_sync(png_reader.as_png, file)
     else:
         raise NotImplementedError(f'Content type {upload_content_type} not supported')
     
@@ -50,8 +79,8 @@ async def full_prompt_from_image(file: BinaryIO, document_data_extractor: Docume
     
     examples = tup(
             *(
-                tup(
-                    as_png(
+                example_contents(
+                    as_png_pages(
                         document_data_extractor.owner,
                         example.document_id,
                         example.start_page,
@@ -71,16 +100,8 @@ async def full_prompt_from_image(file: BinaryIO, document_data_extractor: Docume
             ]
         )
     ]
-    for input_images, output_text in await examples.evaluate():
-        for idx, image in enumerate(input_images, start=1):
-            messages[0].content.append(
-                TextContent(type="text", text=f"####\nInput of page {idx}")
-            )
-            messages[0].content.extend(fill_input_image(image))
-
-        messages[0].content.append(
-            TextContent(type="text", text=f"Expected Output: {output_text}\n\n")
-        )
+    for contents in await examples.evaluate():
+        messages[0].content.extend(contents)
 
     messages[0].content.append(
         TextContent(type="text", text="Now, please apply the same analysis to the following new image:")
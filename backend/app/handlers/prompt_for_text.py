@@ -5,6 +5,7 @@ from typing import BinaryIO
 from fastapi import HTTPException
 from app.models import DocumentDataExtractor
 from app.ops import tup
+from app.ops import processes
 from app.ops.documents import as_text
 from app.services.excel_reader import excel_reader
 from app.services.pdf_reader import pdf_reader
@@ -20,10 +21,10 @@ def validate_extracted_text(text: str):
 async def full_prompt_from_text(file: BinaryIO, document_data_extractor: DocumentDataExtractor, upload_content_type: ContentType) -> list[ChatCompletionMessage]:
     
     if upload_content_type == ContentType.PDF:
-        prompt = pdf_reader.as_text(file)
+        prompt = await processes.run_sync(pdf_reader.as_text, file)
         validate_extracted_text(prompt)
     elif upload_content_type == ContentType.XLSX or upload_content_type == ContentType.XLS: 
-        prompt = excel_reader.as_csv(file)
+        prompt = await processes.run_sync(excel_reader.as_csv, file)
         validate_extracted_text(prompt)
     else:
         raise NotImplementedError(f'Content type {upload_content_type} not supported')
@@ -1,6 +1,7 @@
-from typing import Mapping
+from typing import Annotated, Any, Mapping
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Header
+from fastapi.responses import StreamingResponse
 
 from app.api.deps import CurrentUser, SessionDep
 from app.models import EventOut
@@ -12,8 +13,9 @@ from app.lm.models import (
 import app.lm.models.openai as openai_models
 import app.lm.models.mistral as mistral_models
 import app.lm.models.anthropic as anthropic_models
-from app.services import Response
+from app.services import Response, sse
 from app.lm.handlers import (
+    ChatCompletionHandler,
     OpenAIHandler,
     MistralHandler,
     AnthropicHandler,
@@ -35,6 +37,20 @@ from app.worker import evaluate
 
 router = APIRouter()
 
+# The caller opts in to cache non-deterministic responses with the header
+# `X-Arena-Cache: true`
+CacheHeader = Annotated[bool, Header(alias="X-Arena-Cache")]
+
+
+async def respond(handler: ChatCompletionHandler) -> Any:
+    """The response of the handler, streamed as server-sent events if the
+    request asks for it"""
+    if handler.chat_completion_request.stream:
+        return StreamingResponse(
+            await handler.stream_request(), media_type=sse.MEDIA_TYPE
+        )
+    return await handler.process_request()
+
 
 @router.post(
     "/openai/chat/completions",
@@ -44,13 +60,16 @@ async def openai_chat_completion(
     session_dep: SessionDep,
     current_user: CurrentUser,
     chat_completion_request: Mapping,
+    cache: CacheHeader = False,
 ) -> openai_models.ChatCompletionResponse:
     """
     OpenAI integration
     """
-    return await OpenAIHandler(
-        session_dep, current_user, chat_completion_request
-    ).process_request()
+    return await respond(
+        OpenAIHandler(
+            session_dep, current_user, chat_completion_request, cache=cache
+        )
+    )
 
 
 @router.post(
@@ -61,13 +80,16 @@ async def mistral_chat_completion(
     session_dep: SessionDep,
     current_user: CurrentUser,
     chat_completion_request: Mapping,
+    cache: CacheHeader = False,
 ) -> mistral_models.ChatCompletionResponse:
     """
     Mistral integration
     """
-    return await MistralHandler(
-        session_dep, current_user, chat_completion_request
-    ).process_request()
+    return await respond(
+        MistralHandler(
+            session_dep, current_user, chat_completion_request, cache=cache
+        )
+    )
 
 
 @router.post(
@@ -78,13 +100,16 @@ async def anthropic_chat_completion(
     session_dep: SessionDep,
     current_user: CurrentUser,
     chat_completion_request: Mapping,
+    cache: CacheHeader = False,
 ) -> anthropic_models.ChatCompletionResponse:
     """
     Anthropic integration
     """
-    return await AnthropicHandler(
-        session_dep, current_user, chat_completion_request
-    ).process_request()
+    return await respond(
+        AnthropicHandler(
+            session_dep, current_user, chat_completion_request, cache=cache
+        )
+    )
 
 
 @router.post("/chat/completions", response_model=ChatCompletionResponse)
@@ -92,13 +117,16 @@ async def chat_completion(
     session_dep: SessionDep,
     current_user: CurrentUser,
     chat_completion_request: Mapping,
+    cache: CacheHeader = False,
 ) -> ChatCompletionResponse:
     """
     Abstract version
     """
-    return await ArenaHandler(
-        session_dep, current_user, chat_completion_request
-    ).process_request()
+    return await respond(
+        ArenaHandler(
+            session_dep, current_user, chat_completion_request, cache=cache
+        )
+    )
 
 
 @router.post("/chat/completions/request", response_model=EventOut)
@@ -1,21 +1,31 @@
-from typing import TypeVar, Generic, Mapping
+from typing import Any, AsyncIterator, TypeVar, Generic, Mapping, ClassVar
 from abc import ABC, abstractmethod
+from time import time
+import asyncio
+import logging
 
-from anyio import create_task_group
 from sqlmodel import Session
 
 from app.api.deps import CurrentUser, SessionDep
+from app.core.config import settings
+from app.core.db import engine
 from app.models import UserOut
 from app.lm.models import (
     ChatCompletionResponse,
     ChatCompletionRequest,
+    ChatCompletionChunk,
     LMConfig,
 )
 import app.lm.models.openai as openai_models
 import app.lm.models.mistral as mistral_models
 import app.lm.models.anthropic as anthropic_models
-from app.services import Request, Response
-from app.ops import tup, Computation
+from app.services import Request, Response, sse
+from app.ops import tup, Computation, Op
+from app.ops.computation import interning
+from app.ops.control import cond, switch, fmap
+from app.ops.plan import Plan, placeholder
+from app.ops.streams import emit, emitted
+from app.ops.tracing import traced
 from app.ops.settings import (
     openai_api_key,
     mistral_api_key,
@@ -34,31 +44,55 @@ from app.ops.events import (
 from app.ops.lm import (
     openai,
     openai_request,
+    openai_stream,
     mistral,
     mistral_request,
+    mistral_stream,
     anthropic,
     anthropic_request,
+    anthropic_stream,
     chat,
     chat_request,
+    chat_stream,
+    accumulate,
     judge,
+    semantic_lookup,
+    semantic_store,
+)
+from app.ops.masking import (
+    masking,
+    replace_masking,
+    text_contents,
+    with_contents,
+    with_replacements,
+    replace_back,
+    replace_back_stream,
 )
-from app.ops.masking import masking, replace_masking
 from app.ops.session import session, user, event
 from app.worker import evaluate
 
+logger = logging.getLogger("uvicorn.error")
+
 Req = TypeVar("Req")
 Resp = TypeVar("Resp")
 
 
 class ChatCompletionHandler(ABC, Generic[Req, Resp]):
+    # The last server-sent event of a streamed response
+    done: ClassVar[str | None] = sse.encode("[DONE]")
+
     def __init__(
         self,
         session_dep: SessionDep,
         current_user: CurrentUser,
         chat_completion_request: Mapping,
+        cache: bool = False,
     ):
         self.session = session_dep
         self.user = current_user
+        # The caller opted in to cache the response (see
+        # app.services.lm.ResponseCache)
+        self.cache = cache
         self.chat_completion_request = self.validate_chat_completion_request(
             chat_completion_request
         )
@@ -74,12 +108,17 @@ class ChatCompletionHandler(ABC, Generic[Req, Resp]):
         pass
 
     def config(
-        self, ses: Computation[Session], usr: Computation[UserOut]
+        self,
+        ses: Computation[Session],
+        usr: Computation[UserOut],
+        chat_completion_request: Computation[Req],
     ) -> Computation[LMConfig]:
         return lm_config(ses, usr)
 
     @abstractmethod
-    def lm_request(self) -> Computation[Request[Req]]:
+    def lm_request(
+        self, chat_completion_request: Computation[Req]
+    ) -> Computation[Request[Req]]:
         pass
 
     @abstractmethod
@@ -87,51 +126,92 @@ class ChatCompletionHandler(ABC, Generic[Req, Resp]):
         self,
         ses: Computation[Session],
         usr: Computation[UserOut],
-        request: Request[Req],
+        request: Computation[Request[Req]],
     ) -> Computation[Response[Resp]]:
         pass
 
+    @abstractmethod
+    def lm_stream(
+        self,
+        ses: Computation[Session],
+        usr: Computation[UserOut],
+        request: Computation[Request[Req]],
+    ) -> Computation[AsyncIterator[Any]]:
+        """The chunks of the response, as they are generated"""
+        pass
 
-    async def process_request(self) -> Resp:
+    def response(
+        self,
+        ses: Computation[Session],
+        usr: Computation[UserOut],
+        config: Computation[LMConfig],
+        request: Computation[Request[Req]],
+    ) -> Computation[Response[Resp]]:
+        """The response of the model, or of a cache as configured"""
+        return self.lm_response(ses, usr, request)
+
+    def server_sent_event(self, chunk: Any) -> str:
+        return sse.encode(chunk.model_dump_json(exclude_none=True))
+
+    def masked_request(
+        self,
+        config: Computation[LMConfig],
+        lm_request: Computation[Request[Req]],
+    ) -> Computation[tuple[Request[Req], Mapping[str, str]]]:
+        """The request with its PII removed as configured and the mapping
+        to replace the entities back in the response"""
+        # The message content can be either a string (for text) or a list
+        # (for images), only texts are processed, identical ones once (the
+        # masking ops are interned, see `Map`)
+        texts = text_contents(lm_request)
+        return switch(
+            config.pii_removal,
+            {
+                "masking": tup(
+                    with_contents(lm_request, fmap(masking, texts)), {}
+                ),
+                "replace": with_replacements(
+                    lm_request, fmap(replace_masking, texts)
+                ),
+            },
+            tup(lm_request, {}),
+        )
+
+    def computation(
+        self,
+        user_id: Computation[int],
+        arena_request: Computation[Request[Req]],
+        chat_completion_request: Computation[Req],
+        stream: bool = False,
+    ) -> Computation[tuple]:
+        """The whole processing of a request as a single graph, the branches
+        not taken are not evaluated and independent ones run concurrently.
+        The response is the last item, a streamed response is emitted as
+        soon as it starts (see `app.ops.streams.Emit`)."""
         ses = session()
-        usr = user(ses, self.user.id)
+        usr = user(ses, user_id)
         # Arena request
-        arena_request = self.arena_request()
         arena_request_event = log_request(ses, usr, None, arena_request)
-        # We need the config now
-        config = await self.config(ses, usr).evaluate(session=self.session)
+        config = self.config(ses, usr, chat_completion_request)
         config_event = log_lm_config(ses, usr, arena_request_event, config)
-        # Build the request
-        lm_request = await self.lm_request().evaluate(session=self.session)
-        lm_request_event = arena_request_event
-        mapping_dict = {}   
-        # Do the masking
-        if config.pii_removal:  # TODO an IF op could be added to build conditional delayed computations if needed
-            if config.pii_removal == "masking":
-                async with create_task_group() as tg:
-                    for message in lm_request.content.messages:
-                        if isinstance(message.content, str):
-                            # The message content can be either a string (for text) or a list (for images). 
-                            # If it's not a string, PII removal should be avoided.
-                            async def set_content(message=message):
-                                message.content = await masking(message.content).evaluate(session=self.session)
-                            tg.start_soon(set_content)
-            if config.pii_removal == "replace":
-                async with create_task_group() as tg:
-                    for message in lm_request.content.messages:
-                        if isinstance(message.content, str):
-                            async def set_content(message=message):
-                                message.content, mapping = await replace_masking(message.content).evaluate(session=self.session)
-                                if message.role == 'user':    
-                                    # Update the mapping dictionary only with mappings from messages whose role is user
-                                    # since the content needs to be replaced back only for these messages.
-                                    # For system messages, we want to anonymyze but we do not want to replace back as we may leak some info of the examples to the user.
-                                    mapping_dict.update(mapping)
-                            tg.start_soon(set_content)
-            # Log the request event
-            lm_request_event = LogRequest(name="modified_request")(ses, usr, arena_request_event, lm_request)
-        # compute the response
-        lm_response = self.lm_response(ses, usr, lm_request)
+        # Build the request and remove the PII if configured
+        lm_request = self.lm_request(chat_completion_request)
+        masked_request = self.masked_request(config, lm_request)
+        request, mapping = masked_request[0], masked_request[1]
+        lm_request_event = cond(
+            config.pii_removal,
+            LogRequest(name="modified_request")(
+                ses, usr, arena_request_event, request
+            ),
+            arena_request_event,
+        )
+        # compute the response, a streamed one is logged once it is done
+        if stream:
+            chunks = self.lm_stream(ses, usr, request)
+            lm_response = accumulate(chunks)
+            output = emit(replace_back_stream(chunks, mapping))
+        else:
+            lm_response = self.response(ses, usr, config, request)
         lm_response_event = log_response(
             ses, usr, arena_request_event, lm_response
         )
@@ -139,51 +219,160 @@ class ChatCompletionHandler(ABC, Generic[Req, Resp]):
         event_identifier = create_event_identifier(
             ses, usr, arena_request_event, chat_completion_response.id
         )
-        # Evaluate before post-processing
-        (
-            arena_request_event,
-            config_event,
-            lm_request_event,
-            lm_response_event,
-            event_identifier,
-            chat_completion_response,
-        ) = await tup(
+        # post-process the (request, response) pair
+        judge_scheduled = cond(
+            config.judge_evaluation,
+            schedule_judge(
+                user_id,
+                cond(
+                    config.judge_with_pii,
+                    arena_request.content,
+                    request.content,
+                ),
+                chat_completion_response,
+                arena_request_event.id,
+            ),
+        )
+        if not stream:
+            output = replace_back(chat_completion_response, mapping)
+        return tup(
             arena_request_event,
             config_event,
             lm_request_event,
             lm_response_event,
             event_identifier,
-            chat_completion_response,
-        ).evaluate(session=self.session)
-        # post-process the (request, response) pair
+            judge_scheduled,
+            output,
+        )
 
-        if config.judge_evaluation:
-            judge_score = judge(
-                language_models_api_keys(ses, usr),
-                arena_request.content
-                if config.judge_with_pii
-                else lm_request.content,
-                chat_completion_response,
+    def plan(self, stream: bool = False) -> Plan:
+        """The computation compiled once per handler class"""
+        key = (type(self), stream)
+        if key not in plans:
+            # Identical sub-computations (session, user, settings...) are
+            # built once
+            with interning():
+                plans[key] = Plan.compile(
+                    self.computation(
+                        placeholder("user_id"),
+                        placeholder("arena_request"),
+                        placeholder("chat_completion_request"),
+                        stream,
+                    )
+                )
+        return plans[key]
+
+    async def process_request(self) -> Resp:
+        # The evaluations of the request are traced together (if sampled)
+        async with traced(f"{type(self).__name__}.process_request"):
+            chat_completion_request = self.chat_completion_request
+            computation = self.plan().bind(
+                user_id=self.user.id,
+                arena_request=self.arena_request(),
+                chat_completion_request=chat_completion_request.model_copy(
+                    deep=True
+                ),
             )
-            judge_score_event = log_lm_judge_evaluation(
-                ses, usr, event(ses, arena_request_event.id), judge_score
+            *_, chat_completion_response = await computation.evaluate(
+                deadline=time() + settings.REQUEST_TIMEOUT,
+                session=self.session,
+                user_id=self.user.id,
+                cache_responses=self.cache,
             )
-            evaluate.delay(judge_score.then(judge_score_event))
-        
-        if  config.pii_removal == "replace" and isinstance(message.content, str):
-            chat_completion_with_real_entities = replace_back(chat_completion_response, mapping_dict)
-            return chat_completion_with_real_entities
-        
-        return chat_completion_response
-
-
-def replace_back(chat_completion_response: ChatCompletionResponse, mapping: dict[str,str]) -> str:
-#Replacing entities in the chat response text with the actual entities specified in the `mapping` dictionary to ensure that the JSON response contains the real information.
-    chat_completion_text = chat_completion_response.choices[0].message.content
-    for fake_entity, real_entity in mapping.items():
-        chat_completion_text = chat_completion_text.replace(fake_entity, real_entity)
-    chat_completion_response.choices[0].message.content=chat_completion_text
-    return chat_completion_response
+            return chat_completion_response
+
+    async def stream_request(self) -> AsyncIterator[str]:
+        """Process a request with a streamed response: its server-sent
+        events are returned as soon as the first chunk is generated, the
+        evaluation goes on in the background to log the response"""
+        chat_completion_request = self.chat_completion_request
+        computation = self.plan(stream=True).bind(
+            user_id=self.user.id,
+            arena_request=self.arena_request(),
+            chat_completion_request=chat_completion_request.model_copy(
+                deep=True
+            ),
+        )
+        name = f"{type(self).__name__}.stream_request"
+
+        async def evaluate(future: asyncio.Future) -> tuple:
+            # The evaluation outlives the request and its DB session
+            with Session(engine) as ses:
+                async with traced(name):
+                    return await computation.evaluate(
+                        deadline=time() + settings.STREAM_TIMEOUT,
+                        session=ses,
+                        user_id=self.user.id,
+                        emitted=future,
+                    )
+
+        chunks, evaluation = await emitted(evaluate)
+        # The provider errors are raised before the response starts
+        try:
+            first = await anext(chunks)
+        except StopAsyncIteration:
+            first = None
+        except Exception as e:
+            # The evaluation fails with the node at fault
+            await evaluation
+            raise e
+        evaluation.add_done_callback(evaluated)
+        return self.server_sent_events(first, chunks)
+
+    async def server_sent_events(
+        self, first: Any, chunks: AsyncIterator[Any]
+    ) -> AsyncIterator[str]:
+        if first is not None:
+            yield self.server_sent_event(first)
+        async for chunk in chunks:
+            yield self.server_sent_event(chunk)
+        if self.done is not None:
+            yield self.done
+
+
+def evaluated(evaluation: asyncio.Task) -> None:
+    """Log the failure of an evaluation running in the background"""
+    if not evaluation.cancelled() and evaluation.exception() is not None:
+        logger.error(f"A streamed request failed: {evaluation.exception()}")
+
+
+# The compiled computations of the handlers, by class and streaming
+plans: dict[tuple[type[ChatCompletionHandler], bool], Plan] = {}
+
+
+class ScheduleJudge(
+    Op[tuple[int, ChatCompletionRequest, ChatCompletionResponse, int], None]
+):
+    """Schedule the evaluation of a (request, response) pair by a judge in
+    the worker"""
+
+    blocking: ClassVar[bool] = True
+
+    async def call(
+        self,
+        user_id: int,
+        request: ChatCompletionRequest,
+        response: ChatCompletionResponse,
+        event_id: int,
+    ) -> None:
+        ses = session()
+        usr = user(ses, user_id)
+        api_keys = language_models_api_keys(ses, usr)
+        judge_score = judge(api_keys, request, response)
+        judge_score_event = log_lm_judge_evaluation(
+            ses, usr, event(ses, event_id), judge_score
+        )
+        evaluate.delay(judge_score.then(judge_score_event))
+
+
+def schedule_judge(
+    user_id: Computation[int],
+    request: Computation[ChatCompletionRequest],
+    response: Computation[ChatCompletionResponse],
+    event_id: Computation[int],
+) -> Computation[None]:
+    return ScheduleJudge()(user_id, request, response, event_id)
+
 
 class OpenAIHandler(
     ChatCompletionHandler[
@@ -207,19 +396,28 @@ class OpenAIHandler(
 
     def lm_request(
         self,
+        chat_completion_request: Computation[
+            openai_models.ChatCompletionRequest
+        ],
     ) -> Computation[Request[openai_models.ChatCompletionRequest]]:
-        return openai_request(
-            self.chat_completion_request.model_copy(deep=True)
-        )
+        return openai_request(chat_completion_request)
 
     def lm_response(
         self,
         ses: Computation[Session],
         usr: Computation[UserOut],
-        request: Request[openai_models.ChatCompletionRequest],
+        request: Computation[Request[openai_models.ChatCompletionRequest]],
     ) -> Computation[Response[openai_models.ChatCompletionResponse]]:
         return openai(openai_api_key(ses, usr), request.content)
 
+    def lm_stream(
+        self,
+        ses: Computation[Session],
+        usr: Computation[UserOut],
+        request: Computation[Request[openai_models.ChatCompletionRequest]],
+    ) -> Computation[AsyncIterator[openai_models.ChatCompletionChunk]]:
+        return openai_stream(openai_api_key(ses, usr), request.content)
+
 
 class MistralHandler(
     ChatCompletionHandler[
@@ -243,19 +441,28 @@ class MistralHandler(
 
     def lm_request(
         self,
+        chat_completion_request: Computation[
+            mistral_models.ChatCompletionRequest
+        ],
     ) -> Computation[Request[mistral_models.ChatCompletionRequest]]:
-        return mistral_request(
-            self.chat_completion_request.model_copy(deep=True)
-        )
+        return mistral_request(chat_completion_request)
 
     def lm_response(
         self,
         ses: Computation[Session],
         usr: Computation[UserOut],
-        request: Request[mistral_models.ChatCompletionRequest],
+        request: Computation[Request[mistral_models.ChatCompletionRequest]],
     ) -> Computation[Response[mistral_models.ChatCompletionResponse]]:
         return mistral(mistral_api_key(ses, usr), request.content)
 
+    def lm_stream(
+        self,
+        ses: Computation[Session],
+        usr: Computation[UserOut],
+        request: Computation[Request[mistral_models.ChatCompletionRequest]],
+    ) -> Computation[AsyncIterator[mistral_models.ChatCompletionChunk]]:
+        return mistral_stream(mistral_api_key(ses, usr), request.content)
+
 
 class AnthropicHandler(
     ChatCompletionHandler[
@@ -263,6 +470,9 @@ class AnthropicHandler(
         anthropic_models.ChatCompletionResponse,
     ]
 ):
+    # The stream ends with a message_stop event
+    done: ClassVar[str | None] = None
+
     def validate_chat_completion_request(
         self, chat_completion_request: Mapping
     ) -> anthropic_models.ChatCompletionRequest:
@@ -279,19 +489,33 @@ class AnthropicHandler(
 
     def lm_request(
         self,
+        chat_completion_request: Computation[
+            anthropic_models.ChatCompletionRequest
+        ],
     ) -> Computation[Request[anthropic_models.ChatCompletionRequest]]:
-        return anthropic_request(
-            self.chat_completion_request.model_copy(deep=True)
-        )
+        return anthropic_request(chat_completion_request)
 
     def lm_response(
         self,
         ses: Computation[Session],
         usr: Computation[UserOut],
-        request: Request[anthropic_models.ChatCompletionRequest],
+        request: Computation[Request[anthropic_models.ChatCompletionRequest]],
     ) -> Computation[Response[anthropic_models.ChatCompletionResponse]]:
         return anthropic(anthropic_api_key(ses, usr), request.content)
 
+    def lm_stream(
+        self,
+        ses: Computation[Session],
+        usr: Computation[UserOut],
+        request: Computation[Request[anthropic_models.ChatCompletionRequest]],
+    ) -> Computation[AsyncIterator[anthropic_models.StreamEvent]]:
+        return anthropic_stream(anthropic_api_key(ses, usr), request.content)
+
+    def server_sent_event(self, chunk: anthropic_models.StreamEvent) -> str:
+        return sse.encode(
+            chunk.model_dump_json(exclude_none=True), event=chunk.type
+        )
+
 
 class ArenaHandler(
     ChatCompletionHandler[ChatCompletionRequest, ChatCompletionResponse]
@@ -309,19 +533,64 @@ class ArenaHandler(
         )
 
     def config(
-        self, ses: Computation[Session], usr: Computation[UserOut]
+        self,
+        ses: Computation[Session],
+        usr: Computation[UserOut],
+        chat_completion_request: Computation[ChatCompletionRequest],
     ) -> Computation[LMConfig]:
-        return lm_config(
-            ses, usr, override=self.chat_completion_request.lm_config
-        )
+        return lm_config(ses, usr, override=chat_completion_request.lm_config)
 
-    def lm_request(self) -> Computation[Request[ChatCompletionRequest]]:
-        return chat_request(self.chat_completion_request.model_copy(deep=True))
+    def lm_request(
+        self, chat_completion_request: Computation[ChatCompletionRequest]
+    ) -> Computation[Request[ChatCompletionRequest]]:
+        return chat_request(chat_completion_request)
 
     def lm_response(
         self,
         ses: Computation[Session],
         usr: Computation[UserOut],
-        request: Request[ChatCompletionRequest],
+        request: Computation[Request[ChatCompletionRequest]],
+        config: Computation[LMConfig] | None = None,
+    ) -> Computation[Response[ChatCompletionResponse]]:
+        """The response of the model, or of the alternative models set in
+        the config (see app.services.hedging)"""
+        return chat(
+            language_models_api_keys(ses, usr), request.content, config
+        )
+
+    def lm_stream(
+        self,
+        ses: Computation[Session],
+        usr: Computation[UserOut],
+        request: Computation[Request[ChatCompletionRequest]],
+    ) -> Computation[AsyncIterator[ChatCompletionChunk]]:
+        return chat_stream(language_models_api_keys(ses, usr), request.content)
+
+    def response(
+        self,
+        ses: Computation[Session],
+        usr: Computation[UserOut],
+        config: Computation[LMConfig],
+        request: Computation[Request[ChatCompletionRequest]],
     ) -> Computation[Response[ChatCompletionResponse]]:
-        return chat(language_models_api_keys(ses, usr), request.content)
+        """The response to a similar request if the user set a semantic
+        cache threshold (see app.services.semantic_cache), else the response
+        of the model, then stored. The requests are compared after the PII
+        removal, except with replacements (random, they would leak between
+        requests)."""
+        threshold = switch(
+            config.pii_removal,
+            {"replace": None},
+            config.semantic_cache_threshold,
+        )
+        cached = semantic_lookup(usr, threshold, request.content)
+        return cond(
+            cached,
+            cached,
+            semantic_store(
+                usr,
+                threshold,
+                request.content,
+                self.lm_response(ses, usr, request, config),
+            ),
+        )
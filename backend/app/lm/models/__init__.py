@@ -14,6 +14,9 @@ from app.lm.models.chat_completion import (
     Choice,
     CompletionUsage,
     ChatCompletionResponse,
+    ChoiceDelta,
+    ChunkChoice,
+    ChatCompletionChunk,
 )
 from app.lm.models.evaluation import Evaluation, Score
 from app.lm.models.settings import LMConfig
@@ -38,6 +41,9 @@ __all__ = [
     "ChoiceLogprobs",
     "Choice",
     "CompletionUsage",
+    "ChoiceDelta",
+    "ChunkChoice",
+    "ChatCompletionChunk",
 ]
 
 
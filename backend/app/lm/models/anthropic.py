@@ -6,6 +6,8 @@ from app.lm import models
 from app.lm.models import (
     Message,
     Choice,
+    ChoiceDelta,
+    ChunkChoice,
 )
 
 """
@@ -20,6 +22,14 @@ MODELS = (
     "claude-2.0",
     "claude-instant-1.2",
 )
+# The model families, by prefix (e.g. dated versions)
+PREFIXES = ("claude-",)
+
+FINISH_REASONS = {
+    "end_turn": "tool_calls",
+    "max_tokens": "length",
+    "stop_sequence": "stop",
+}
 
 
 class Metadata(BaseModel):
@@ -120,16 +130,11 @@ class ChatCompletionResponse(BaseModel):
         return ChatCompletionResponse.model_validate(m)
 
     def to_chat_completion_response(self) -> models.ChatCompletionResponse:
-        finish_reasons = {
-            "end_turn": "tool_calls",
-            "max_tokens": "length",
-            "stop_sequence": "stop",
-        }
         return models.ChatCompletionResponse(
             id=self.id,
             choices=[
                 Choice(
-                    finish_reason=finish_reasons.get(self.stop_reason, None),
+                    finish_reason=FINISH_REASONS.get(self.stop_reason, None),
                     index=i,
                     logprobs=None,
                     message=Message(role="assistant", content=cb.text),
@@ -144,3 +149,131 @@ class ChatCompletionResponse(BaseModel):
                 + self.usage.output_tokens,
             ),
         )
+
+
+class StreamEvent(BaseModel):
+    """
+    A server-sent event of a streamed message
+    https://docs.anthropic.com/en/api/messages-streaming
+    """
+
+    type: str
+    message: ChatCompletionResponse | None = None
+    index: int | None = None
+    content_block: Mapping[str, Any] | None = None
+    delta: Mapping[str, Any] | None = None
+    usage: CompletionUsage | None = None
+    error: Mapping[str, Any] | None = None
+
+    def texts(self) -> Mapping[int, str]:
+        """The text delta of the event, by content block index"""
+        if (
+            self.type == "content_block_delta"
+            and self.delta.get("type") == "text_delta"
+        ):
+            return {self.index: self.delta["text"]}
+        return {}
+
+    def with_texts(self, texts: Mapping[int, str]) -> "StreamEvent":
+        """A copy of the event with another text delta"""
+        if self.index not in self.texts() or self.index not in texts:
+            return self
+        return self.model_copy(
+            update={"delta": {**self.delta, "text": texts[self.index]}}
+        )
+
+    def ends(self) -> Sequence[int]:
+        """The indices of the content blocks finished by the event"""
+        return [self.index] if self.type == "content_block_stop" else []
+
+    def text_chunk(self, index: int, text: str) -> "StreamEvent":
+        """An event with only a text delta"""
+        return StreamEvent(
+            type="content_block_delta",
+            index=index,
+            delta={"type": "text_delta", "text": text},
+        )
+
+    @classmethod
+    def accumulate(
+        cls, events: Sequence["StreamEvent"]
+    ) -> ChatCompletionResponse:
+        """The message of the events of a stream"""
+        message: ChatCompletionResponse | None = None
+        texts: dict[int, list[str]] = {}
+        update: dict[str, Any] = {}
+        output_tokens: int | None = None
+        for event in events:
+            if event.type == "message_start":
+                message = event.message
+            elif event.type == "content_block_start":
+                texts.setdefault(event.index, []).append(
+                    event.content_block.get("text", "")
+                )
+            elif event.type == "content_block_delta":
+                for index, text in event.texts().items():
+                    texts.setdefault(index, []).append(text)
+            elif event.type == "message_delta":
+                update["stop_reason"] = event.delta.get("stop_reason")
+                update["stop_sequence"] = event.delta.get("stop_sequence")
+                if event.usage:
+                    output_tokens = event.usage.output_tokens
+            elif event.type == "error":
+                raise ValueError(f"The stream failed: {event.error}")
+        if message is None:
+            raise ValueError("The stream has no message")
+        return message.model_copy(
+            update={
+                **update,
+                "content": [
+                    TextBlock(text="".join(texts[index]))
+                    for index in sorted(texts)
+                ],
+                "usage": CompletionUsage(
+                    input_tokens=(
+                        message.usage.input_tokens if message.usage else None
+                    ),
+                    output_tokens=output_tokens,
+                ),
+            }
+        )
+
+    def to_chat_completion_chunk(
+        self, message: ChatCompletionResponse
+    ) -> models.ChatCompletionChunk | None:
+        """The event as a chunk of the started message, None if it carries
+        nothing for the client"""
+        usage = None
+        if self.type == "message_start":
+            choice = ChunkChoice(index=0, delta=ChoiceDelta(role="assistant"))
+        elif self.texts():
+            choice = ChunkChoice(
+                index=self.index,
+                delta=ChoiceDelta(content=self.texts()[self.index]),
+            )
+        elif self.type == "message_delta":
+            choice = ChunkChoice(
+                index=0,
+                delta=ChoiceDelta(),
+                finish_reason=FINISH_REASONS.get(
+                    self.delta.get("stop_reason")
+                ),
+            )
+            if message.usage and self.usage:
+                input_tokens = message.usage.input_tokens
+                output_tokens = self.usage.output_tokens
+                if input_tokens is not None and output_tokens is not None:
+                    usage = models.CompletionUsage(
+                        prompt_tokens=input_tokens,
+                        completion_tokens=output_tokens,
+                        total_tokens=input_tokens + output_tokens,
+                    )
+        else:
+            return None
+        return models.ChatCompletionChunk(
+            id=message.id,
+            choices=[choice],
+            model=message.model,
+            object="chat.completion.chunk",
+            usage=usage,
+        )
@@ -203,3 +203,137 @@ class ChatCompletionResponse(BaseModel):
     @classmethod
     def from_dict(cls, m: Mapping[str, Any]) -> "ChatCompletionResponse":
         return ChatCompletionResponse.model_validate(m)
+
+    @classmethod
+    def from_chunks(
+        cls, chunks: Sequence["ChatCompletionChunk"]
+    ) -> "ChatCompletionResponse":
+        """The response of a streamed chat completion"""
+        choices: dict[int, dict[str, Any]] = {}
+        for chunk in chunks:
+            for choice in chunk.choices:
+                accumulated = choices.setdefault(
+                    choice.index,
+                    {"role": "assistant", "content": [], "logprobs": []},
+                )
+                if choice.delta.role:
+                    accumulated["role"] = choice.delta.role
+                if choice.delta.content:
+                    accumulated["content"].append(choice.delta.content)
+                if choice.logprobs and choice.logprobs.content:
+                    accumulated["logprobs"].extend(choice.logprobs.content)
+                if choice.finish_reason:
+                    accumulated["finish_reason"] = choice.finish_reason
+        return cls.model_validate(
+            {
+                "id": chunks[0].id,
+                "created": chunks[0].created,
+                "model": chunks[0].model,
+                "object": "chat.completion",
+                "system_fingerprint": chunks[0].system_fingerprint,
+                "usage": next(
+                    (chunk.usage for chunk in reversed(chunks) if chunk.usage),
+                    None,
+                ),
+                "choices": [
+                    {
+                        "index": index,
+                        "finish_reason": choice.get("finish_reason"),
+                        "logprobs": (
+                            {"content": choice["logprobs"]}
+                            if choice["logprobs"]
+                            else None
+                        ),
+                        "message": {
+                            "role": choice["role"],
+                            "content": "".join(choice["content"]),
+                        },
+                    }
+                    for index, choice in sorted(choices.items())
+                ],
+            }
+        )
+
+
+"""ChatCompletionChunk"""
+
+
+class ChoiceDelta(BaseModel):
+    content: str | None = None
+    role: Literal["system", "user", "assistant", "tools"] | None = None
+
+
+class ChunkChoice(BaseModel):
+    delta: ChoiceDelta
+    finish_reason: (
+        Literal[
+            "stop",
+            "length",
+            "tool_calls",
+            "content_filter",
+            "function_call",
+            "error",
+        ]
+        | None
+    ) = None
+    index: int
+    logprobs: ChoiceLogprobs | None = None
+
+
+class ChatCompletionChunk(BaseModel):
+    """
+    A server-sent event of a streamed chat completion
+    Maps to:
+    https://github.com/openai/openai-python/blob/main/src/openai/types/chat/chat_completion_chunk.py
+    https://github.com/mistralai/client-python/blob/main/src/mistralai/models/completionchunk.py
+    """
+
+    id: str
+    choices: Sequence[ChunkChoice]
+    created: int | None = None
+    model: str
+    object: Literal["chat.completion.chunk"] | None = None
+    system_fingerprint: str | None = None
+    usage: CompletionUsage | None = None
+
+    def texts(self) -> Mapping[int, str]:
+        """The text deltas of the chunk, by choice index"""
+        return {
+            choice.index: choice.delta.content
+            for choice in self.choices
+            if choice.delta.content
+        }
+
+    def with_texts(self, texts: Mapping[int, str]) -> "ChatCompletionChunk":
+        """A copy of the chunk with other text deltas"""
+        chunk = self.model_copy(deep=True)
+        for choice in chunk.choices:
+            if choice.index in texts:
+                choice.delta.content = texts[choice.index]
+        return chunk
+
+    def ends(self) -> Sequence[int]:
+        """The indices of the choices finished by the chunk"""
+        return [
+            choice.index
+            for choice in self.choices
+            if choice.finish_reason is not None
+        ]
+
+    def text_chunk(self, index: int, text: str) -> "ChatCompletionChunk":
+        """A chunk of the same completion with only a text delta"""
+        return self.model_copy(
+            update={
+                "choices": [
+                    ChunkChoice(index=index, delta=ChoiceDelta(content=text))
+                ],
+                "usage": None,
+            }
+        )
+
+    @classmethod
+    def accumulate(
+        cls, chunks: Sequence["ChatCompletionChunk"]
+    ) -> ChatCompletionResponse:
+        """The response of the chunks of a streamed chat completion"""
+        return ChatCompletionResponse.from_chunks(chunks)
@@ -23,6 +23,8 @@ MODELS = (
     "open-mistral-7b",
     "open-mixtral-8x7b",
 )
+# The model families, by prefix (e.g. dated versions)
+PREFIXES = ("open-mistral-", "open-mixtral-", "mistral-")
 
 
 class ChatCompletionRequest(BaseModel):
@@ -78,3 +80,20 @@ class ChatCompletionResponse(models.ChatCompletionResponse):
         return models.ChatCompletionResponse.model_validate(
             self.model_dump(exclude_none=True)
         )
+
+
+class ChatCompletionChunk(models.ChatCompletionChunk):
+    """
+    https://github.com/mistralai/client-python/blob/main/src/mistralai/models/completionchunk.py
+    """
+
+    @classmethod
+    def accumulate(
+        cls, chunks: Sequence[models.ChatCompletionChunk]
+    ) -> ChatCompletionResponse:
+        return ChatCompletionResponse.from_chunks(chunks)
+
+    def to_chat_completion_chunk(self) -> models.ChatCompletionChunk:
+        return models.ChatCompletionChunk.model_validate(
+            self.model_dump(exclude_none=True)
+        )
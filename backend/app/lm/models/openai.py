@@ -1,4 +1,4 @@
-from typing import Mapping, Literal, Any
+from typing import Mapping, Sequence, Literal, Any
 
 
 from app.lm import models
@@ -10,6 +10,8 @@ MODELS = (
     "gpt-3.5-turbo",
     "gpt-3.5-turbo-16k",
 )
+# The model families, by prefix (e.g. dated versions or fine-tuned models)
+PREFIXES = ("gpt-4", "gpt-3", "ft:gpt-")
 
 
 class ChatCompletionRequest(models.ChatCompletionRequest):
@@ -45,3 +47,20 @@ class ChatCompletionResponse(models.ChatCompletionResponse):
         return models.ChatCompletionResponse.model_validate(
             self.model_dump(exclude_none=True)
         )
+
+
+class ChatCompletionChunk(models.ChatCompletionChunk):
+    """
+    https://github.com/openai/openai-python/blob/main/src/openai/types/chat/chat_completion_chunk.py
+    """
+
+    @classmethod
+    def accumulate(
+        cls, chunks: Sequence[models.ChatCompletionChunk]
+    ) -> ChatCompletionResponse:
+        return ChatCompletionResponse.from_chunks(chunks)
+
+    def to_chat_completion_chunk(self) -> models.ChatCompletionChunk:
+        return models.ChatCompletionChunk.model_validate(
+            self.model_dump(exclude_none=True)
+        )
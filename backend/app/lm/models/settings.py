@@ -1,5 +1,5 @@
 from typing import Literal
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 # A LM config setting
@@ -7,3 +7,12 @@ class LMConfig(BaseModel):
     pii_removal: Literal["masking", "replace"] | None = None
     judge_evaluation: bool = False
     judge_with_pii: bool = False
+    # The similarity above which a cached response to a similar request is
+    # returned (see app.services.semantic_cache), None to disable it
+    semantic_cache_threshold: float | None = Field(default=None, ge=0, le=1)
+    # Equivalent models (of any provider) the request may also be sent to
+    # (see app.services.hedging), in order: when the previous one fails or
+    # is slower than this percentile of its latencies
+    alternative_models: list[str] = []
+    fallback: bool = True
+    hedge_percentile: float | None = Field(default=None, gt=0, lt=100)
@@ -1,19 +1,36 @@
-from fastapi import FastAPI
+from typing import AsyncIterator
+from contextlib import asynccontextmanager
+import math
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.routing import APIRoute
 from starlette.middleware.cors import CORSMiddleware
 
 from app.api.main import api_router
 from app.core.config import settings
+from app.ops.computation import ComputationError, ComputationTimeout
+from app.services import clients
+from app.services.rate_limits import RateLimited
+from app.services.resilience import Unavailable
 
 
 def custom_generate_unique_id(route: APIRoute) -> str:
     return f"{route.tags[0]}-{route.name}"
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    yield
+    # Close the pooled connections to the services
+    await clients.aclose()
+
+
 app = FastAPI(
     title=settings.PROJECT_NAME,
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
     generate_unique_id_function=custom_generate_unique_id,
+    lifespan=lifespan,
 )
 
 # Set all CORS enabled origins
@@ -29,3 +46,27 @@ if settings.BACKEND_CORS_ORIGINS:
     )
 
 app.include_router(api_router, prefix=settings.API_V1_STR)
+
+
+@app.exception_handler(ComputationTimeout)
+async def computation_timeout_handler(
+    request: Request, exc: ComputationTimeout
+) -> JSONResponse:
+    # An upstream (language model, masking...) is too slow
+    return JSONResponse(status_code=504, content=exc.to_dict())
+
+
+@app.exception_handler(ComputationError)
+async def computation_error_handler(
+    request: Request, exc: ComputationError
+) -> JSONResponse:
+    # An upstream is degraded (its circuit is open) or the rate limits of
+    # the API key are exceeded, other failures are internal errors
+    for error in exc.errors:
+        if isinstance(error, (Unavailable, RateLimited)):
+            return JSONResponse(
+                status_code=503 if isinstance(error, Unavailable) else 429,
+                content=exc.to_dict(),
+                headers={"Retry-After": str(math.ceil(error.retry_after))},
+            )
+    raise exc
@@ -21,6 +21,7 @@ from app.ops.utils import (
     rndi,
 )
 from app.ops.computation import Op, Computation
+from app.ops.control import If, cond, Switch, switch, Map, fmap
 
 __all__ = [
     "Var",
@@ -35,4 +36,10 @@ __all__ = [
     "rndi",
     "Op",
     "Computation",
+    "If",
+    "cond",
+    "Switch",
+    "switch",
+    "Map",
+    "fmap",
 ]
@@ -0,0 +1,116 @@
+"""
+Coalesces the concurrent calls of batched ops (see `Op.batch_size`).
+The calls with the same `Op.batch_key` made within `Op.batch_window` seconds
+are merged, up to `Op.batch_size` calls, into a single `Op.batch_call` (e.g.
+a multi-row INSERT) and the results are handed back to each caller.
+The calls of concurrent evaluations are batched together, the bulk call runs
+in the background and is cancelled when all its callers are.
+"""
+
+from typing import Any, Awaitable, Callable, Hashable, TYPE_CHECKING
+from dataclasses import dataclass, field
+import asyncio
+
+from anyio.lowlevel import RunVar
+
+if TYPE_CHECKING:
+    from app.ops.computation import Op
+
+Calls = list[tuple["Op", tuple]]
+
+
+@dataclass
+class Batch:
+    """Calls waiting to be run together"""
+
+    run: Callable[[Calls], Awaitable[list[Any]]]
+    calls: Calls = field(default_factory=list)
+    futures: list[asyncio.Future] = field(default_factory=list)
+    task: asyncio.Task | None = None
+
+
+_batches: RunVar[dict[Hashable, Batch]] = RunVar("ops_batches")
+# Batches running in the background
+_running: set[asyncio.Task] = set()
+# The number of bulk calls and of calls, for metrics
+_counts = {"batches": 0, "calls": 0}
+
+
+def batches() -> dict[Hashable, Batch]:
+    """The pending batches of the current event loop"""
+    try:
+        return _batches.get()
+    except LookupError:
+        _batches.set({})
+        return _batches.get()
+
+
+async def _run(batch: Batch) -> None:
+    _counts["batches"] += 1
+    _counts["calls"] += len(batch.calls)
+    try:
+        results = await batch.run(batch.calls)
+        if len(results) != len(batch.calls):
+            raise RuntimeError("A batch call should return a result per call")
+    except Exception as e:
+        for future in batch.futures:
+            if not future.done():
+                future.set_exception(e)
+        return
+    except BaseException:
+        for future in batch.futures:
+            future.cancel()
+        raise
+    for future, result in zip(batch.futures, results, strict=True):
+        if not future.done():
+            future.set_result(result)
+
+
+def flush(key: Hashable, batch: Batch) -> None:
+    """Run a batch, if still pending"""
+    pending = batches()
+    if pending.get(key) is batch:
+        del pending[key]
+        if all(future.done() for future in batch.futures):
+            # The callers were cancelled
+            return
+        batch.task = asyncio.get_running_loop().create_task(_run(batch))
+        _running.add(batch.task)
+        batch.task.add_done_callback(_running.discard)
+
+
+async def submit(
+    op: "Op",
+    args: tuple,
+    run: Callable[[Calls], Awaitable[list[Any]]],
+) -> Any:
+    """Call the op with other calls of the same batch key, the batch is run
+    by the `run` of its first call"""
+    loop = asyncio.get_running_loop()
+    key = op.batch_key(*args)
+    pending = batches()
+    batch = pending.get(key)
+    if batch is None:
+        batch = pending[key] = Batch(run)
+        loop.call_later(op.batch_window, flush, key, batch)
+    future = loop.create_future()
+    batch.calls.append((op, args))
+    batch.futures.append(future)
+    if len(batch.calls) >= op.batch_size:
+        flush(key, batch)
+    try:
+        return await future
+    except asyncio.CancelledError:
+        if batch.task is not None and all(f.done() for f in batch.futures):
+            # No caller waits for the bulk call anymore
+            batch.task.cancel()
+        raise
+
+
+def stats() -> dict[str, float]:
+    """The number of bulk calls and the mean batch size"""
+    return {
+        "batches": _counts["batches"],
+        "calls": _counts["calls"],
+        "mean_size": _counts["calls"] / max(_counts["batches"], 1),
+    }
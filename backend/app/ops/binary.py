@@ -0,0 +1,125 @@
+"""
+A compact binary (msgpack) encoding of computations and values, an
+alternative to the `JsonSerializable` JSON encoding to ship them to workers.
+- The module and type of each model are written once in a type table and
+  models refer to them by index (a map with a `None` key)
+- bytes are written raw and base64 data URLs (e.g. images) are written as
+  their raw bytes instead of base64 text
+- computations are flattened (see `FlatComputations`)
+"""
+
+from typing import Any
+from types import NoneType
+import base64
+import binascii
+
+import msgpack
+from pydantic import BaseModel
+
+from app.ops.computation import (
+    Computation,
+    FlatComputations,
+    Hashable,
+    decoder,
+    serializable_name,
+    serializable_type,
+)
+
+CONTENT_TYPE = "application/x-arena-msgpack"
+# Extension type codes
+DATA_URL = 1
+# The marker of a model in a map
+TYPE = None
+
+
+def _data_url(value: str) -> msgpack.ExtType | None:
+    """The raw encoding of a base64 data URL"""
+    header, sep, data = value.partition(",")
+    if not sep or not header.endswith(";base64") or "\n" in header:
+        return None
+    try:
+        raw = base64.b64decode(data, validate=True)
+    except binascii.Error:
+        return None
+    # Only canonical base64 is written raw, so that it decodes identically
+    if base64.b64encode(raw).decode("ascii") != data:
+        return None
+    return msgpack.ExtType(DATA_URL, header.encode("utf8") + b"," + raw)
+
+
+def _fields(obj: BaseModel) -> list[str]:
+    if isinstance(obj, Hashable):
+        return obj._fields()
+    return list(obj.model_dump(exclude_unset=True))
+
+
+def to_wire(obj: Any, types: dict[tuple[str, str], int]) -> Any:
+    """Convert a value to msgpack types, registering model types"""
+    if isinstance(obj, Computation):
+        obj = FlatComputations.from_computation(obj)
+        key = (Computation.__module__, Computation.__name__)
+        return {
+            TYPE: types.setdefault(key, len(types)),
+            "flat": to_wire(obj, types),
+        }
+    elif isinstance(obj, BaseModel):
+        key = serializable_name(obj.__class__)
+        value: dict[Any, Any] = {TYPE: types.setdefault(key, len(types))}
+        for k in _fields(obj):
+            value[k] = to_wire(getattr(obj, k), types)
+        return value
+    elif isinstance(obj, dict):
+        return {k: to_wire(obj[k], types) for k in obj}
+    elif isinstance(obj, list | tuple | set):
+        return [to_wire(o, types) for o in obj]
+    elif isinstance(obj, str):
+        if obj.startswith("data:"):
+            return _data_url(obj) or obj
+        return obj
+    elif isinstance(obj, bytes | int | float | NoneType):
+        return obj
+    elif hasattr(obj, "__dict__"):
+        return to_wire(obj.__dict__, types)
+    else:
+        raise ValueError(f"{obj} ({obj.__class__})")
+
+
+def _ext_hook(code: int, data: bytes) -> Any:
+    if code == DATA_URL:
+        header, _, raw = data.partition(b",")
+        return f"{header.decode('utf8')},{base64.b64encode(raw).decode()}"
+    return msgpack.ExtType(code, data)
+
+
+def dumps(obj: Any) -> bytes:
+    """Encode a value: the type table followed by the value"""
+    types: dict[tuple[str, str], int] = {}
+    value = to_wire(obj, types)
+    packer = msgpack.Packer(use_bin_type=True)
+    return packer.pack(list(types)) + packer.pack(value)
+
+
+def loads(data: bytes, trusted: bool = False) -> Any:
+    """Decode a value encoded with `dumps`, a trusted payload is not
+    validated again (see `JsonSerializable.from_json_dict`)"""
+    classes: list[type] = []
+
+    def object_hook(value: dict[Any, Any]) -> Any:
+        if TYPE not in value:
+            return value
+        cls = classes[value.pop(TYPE)]
+        if cls is Computation:
+            return FlatComputations.to_computation(value["flat"])
+        return decoder(cls, trusted)(value)
+
+    unpacker = msgpack.Unpacker(
+        object_hook=object_hook,
+        ext_hook=_ext_hook,
+        strict_map_key=False,
+        max_buffer_size=len(data),
+    )
+    unpacker.feed(data)
+    # The hook only sees maps of the value, the type table is decoded first
+    for module, name in next(unpacker):
+        classes.append(serializable_type(module, name))
+    return next(unpacker)
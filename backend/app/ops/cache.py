@@ -0,0 +1,138 @@
+"""
+A content-addressed cache for the results of pure Ops.
+Results are keyed by the hash of the op and of its arguments (see `Op.key`).
+The caches are async so that a shared store does not block the event loop.
+"""
+
+from typing import Any, Callable, Protocol
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from collections import OrderedDict
+from time import monotonic
+import json
+
+from app.ops.computation import JsonSerializable
+from app.services import clients
+
+
+@dataclass
+class Cache(ABC):
+    hits: int = field(default=0, init=False)
+    misses: int = field(default=0, init=False)
+
+    @abstractmethod
+    async def load(self, key: str) -> tuple[bool, Any]:
+        """Returns (True, value) if the key is cached, (False, None) else"""
+        pass
+
+    @abstractmethod
+    async def save(self, key: str, value: Any) -> None:
+        pass
+
+    async def get(self, key: str) -> tuple[bool, Any]:
+        found, value = await self.load(key)
+        if found:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return found, value
+
+    async def set(self, key: str, value: Any) -> None:
+        await self.save(key, value)
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+@dataclass
+class LRUCache(Cache):
+    """An in-process cache with LRU eviction and TTL expiry"""
+
+    maxsize: int = 1024
+    ttl: float | None = 60.0
+    entries: OrderedDict[str, tuple[float, Any]] = field(
+        default_factory=OrderedDict, init=False
+    )
+
+    async def load(self, key: str) -> tuple[bool, Any]:
+        if key in self.entries:
+            expiry, value = self.entries[key]
+            if expiry >= monotonic():
+                self.entries.move_to_end(key)
+                return True, value
+            del self.entries[key]
+        return False, None
+
+    async def save(self, key: str, value: Any) -> None:
+        expiry = monotonic() + self.ttl if self.ttl else float("inf")
+        self.entries[key] = (expiry, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+
+class Store(Protocol):
+    """The subset of the redis.asyncio.Redis interface used by StoreCache"""
+
+    async def get(self, name: str) -> bytes | str | None: ...
+
+    async def set(
+        self, name: str, value: str, ex: int | None = None
+    ) -> Any: ...
+
+
+@dataclass
+class LocalStore:
+    """A local stand-in for the async client of the store"""
+
+    values: dict[str, tuple[float, str]] = field(default_factory=dict)
+
+    async def get(self, name: str) -> str | None:
+        if name in self.values:
+            expiry, value = self.values[name]
+            if expiry >= monotonic():
+                return value
+            del self.values[name]
+        return None
+
+    async def set(self, name: str, value: str, ex: int | None = None) -> bool:
+        self.values[name] = (monotonic() + ex if ex else float("inf"), value)
+        return True
+
+
+@dataclass
+class StoreCache(Cache):
+    """A cache shared between processes through the broker store, with the
+    async client of the event loop (e.g. `StoreCache(store=lambda: ...)`).
+    Values are stored in the json format used by the worker."""
+
+    store: Callable[[], Store] = clients.store
+    ttl: int | None = 60
+    prefix: str = "arena:ops:"
+
+    async def load(self, key: str) -> tuple[bool, Any]:
+        value = await self.store().get(f"{self.prefix}{key}")
+        if value is None:
+            return False, None
+        return True, JsonSerializable.from_json_dict(json.loads(value))
+
+    async def save(self, key: str, value: Any) -> None:
+        await self.store().set(
+            f"{self.prefix}{key}",
+            json.dumps(JsonSerializable.to_json_dict(value)),
+            ex=self.ttl,
+        )
+
+
+# The default cache, it can be overridden with a `cache` in the context
+cache: Cache | None = LRUCache()
+
+
+def context_cache(context: dict[str, Any] | None) -> Cache | None:
+    """The cache to use given an evaluation context"""
+    if context and "cache" in context:
+        return context["cache"]
+    return cache
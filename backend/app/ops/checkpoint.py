@@ -0,0 +1,92 @@
+"""
+Checkpoints of the evaluations run by the workers.
+The results of checkpointed ops (see `Op.checkpointed`) are persisted as soon
+as they are computed, keyed by the hash of their node (the op and, down the
+graph, its arguments), so that a retried evaluation resumes from the frontier
+of unfinished nodes instead of calling the language models again.
+The checkpoints are kept in the broker store, with the async client of the
+event loop so that the evaluation is not blocked.
+"""
+
+from typing import Any, Callable, Protocol
+from dataclasses import dataclass, field
+import json
+import logging
+
+from app.ops.computation import Computation, JsonSerializable, Op
+from app.services import clients
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class Store(Protocol):
+    """The subset of the redis.asyncio.Redis interface used by Checkpoint"""
+
+    async def get(self, name: str) -> bytes | str | None: ...
+
+    async def set(
+        self, name: str, value: str, ex: int | None = None
+    ) -> Any: ...
+
+
+@dataclass
+class Checkpoint:
+    """Node results of an evaluation and its retries
+    e.g. `Checkpoint(prefix=f"...{task_id}:")`
+    """
+
+    store: Callable[[], Store] = clients.store
+    ttl: int | None = 24 * 3600
+    prefix: str = "arena:checkpoint:"
+    keys: dict[Computation, str | None] = field(
+        default_factory=dict, init=False
+    )
+    hits: int = field(default=0, init=False)
+    misses: int = field(default=0, init=False)
+
+    def key(self, computation: Computation) -> str | None:
+        """A content address of a node, stable across processes"""
+        if computation not in self.keys:
+            for node in computation.order():
+                if node not in self.keys:
+                    args = [self.keys[arg] for arg in node.args]
+                    self.keys[node] = (
+                        None if None in args else Op.key(node.op, *args)
+                    )
+        return self.keys[computation]
+
+    async def get(self, key: str) -> tuple[bool, Any]:
+        """Returns (True, value) if the node has a result, (False, None)
+        else"""
+        # An unavailable checkpoint only costs a recomputation
+        try:
+            value = await self.store().get(f"{self.prefix}{key}")
+        except Exception as e:
+            logger.warning(f"The checkpoint {key} was not read: {e}")
+            value = None
+        if value is None:
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        return True, JsonSerializable.from_json_dict(json.loads(value))
+
+    async def set(self, key: str, value: Any) -> None:
+        # A missing checkpoint only costs a recomputation
+        try:
+            await self.store().set(
+                f"{self.prefix}{key}",
+                json.dumps(JsonSerializable.to_json_dict(value)),
+                ex=self.ttl,
+            )
+        except Exception as e:
+            logger.warning(f"The checkpoint {key} was not saved: {e}")
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def context_checkpoint(context: dict[str, Any] | None) -> Checkpoint | None:
+    """The checkpoint of an evaluation context, if any"""
+    if context:
+        return context.get("checkpoint")
+    return None
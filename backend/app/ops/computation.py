@@ -1,17 +1,42 @@
-from typing import Any, Generic, TypeVar, TypeVarTuple
+from typing import (
+    Annotated,
+    Any,
+    Callable,
+    ClassVar,
+    Generic,
+    Iterable,
+    Iterator,
+    Literal,
+    TypeVar,
+    TypeVarTuple,
+    Union,
+    get_args,
+    get_origin,
+)
 import logging
-from types import NoneType
+from contextlib import contextmanager
+from contextvars import ContextVar
+from weakref import ref
+from functools import partial
+from types import NoneType, UnionType
 from abc import ABC, abstractmethod
 from time import time
 from asyncio import TaskGroup, Task
+import asyncio
 import json
 import importlib
 import base64
+import hashlib
 from pydantic import (
     BaseModel,
     ConfigDict,
     Field,
+    PrivateAttr,
+    TypeAdapter,
 )
+from pydantic.errors import PydanticSchemaGenerationError
+from pydantic.fields import FieldInfo
+from pydantic_core import PydanticUndefined
 
 As = TypeVarTuple("As")
 A = TypeVar("A")
@@ -20,48 +45,353 @@ B = TypeVar("B")
 logger = logging.getLogger("uvicorn.error")
 
 
+class Immutable(tuple):
+    """A tuple representing a Hashable node, memoizing its hash"""
+
+    def __hash__(self) -> int:
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = tuple.__hash__(self)
+            return self._hash
+
+    def __eq__(self, other) -> bool:
+        # Compared with a worklist so that deep graphs do not recurse
+        pairs = [(self, other)]
+        while pairs:
+            a, b = pairs.pop()
+            if a is b:
+                continue
+            if not (isinstance(a, tuple) and isinstance(b, tuple)):
+                if isinstance(a, tuple) or isinstance(b, tuple) or a != b:
+                    return False
+                continue
+            if (
+                isinstance(a, Immutable)
+                and isinstance(b, Immutable)
+                and hash(a) != hash(b)
+            ) or len(a) != len(b):
+                return False
+            pairs.extend(zip(a, b, strict=True))
+        return True
+
+    def __ne__(self, other) -> bool:
+        return not self.__eq__(other)
+
+
+def _forget(parents: dict[int, ref], key: int, parent: ref) -> None:
+    """Unregister a parent once it is collected"""
+    if parents.get(key) is parent:
+        del parents[key]
+
+
 # A mixin class to add hashability to pydantic models
+# The structure of a node is cached and reused by its parents, the nodes
+# using it register as its parents when they cache theirs. It is
+# invalidated, with the caches of its ancestors, when a hashed field of the
+# node is set. Values held by a node should not be mutated in place once
+# hashed.
 class Hashable:
+    # The caches of the node, invalidated with those of its descendants
+    _caches: ClassVar[tuple[str, ...]] = ("_immutable",)
+
     def __eq__(self, other) -> bool:
+        if self is other:
+            return True
         if isinstance(other, self.__class__):
+            # The memoized hashes tell most distinct nodes apart
+            if hash(self) != hash(other):
+                return False
             return self.to_immutable(self) == self.to_immutable(other)
         return False
 
     def __hash__(self) -> int:
         return hash(self.to_immutable(self))
 
+    def __setattr__(self, name: str, value: Any) -> None:
+        super().__setattr__(name, value)
+        field = type(self).model_fields.get(name)
+        if field is not None and not field.exclude:
+            self._invalidate()
+
+    def _invalidate(self) -> None:
+        """Clear the caches of the node and of its ancestors"""
+        stack: list[Hashable] = [self]
+        seen: set[int] = set()
+        while stack:
+            node = stack.pop()
+            if id(node) in seen:
+                continue
+            seen.add(id(node))
+            for name in node._caches:
+                setattr(node, name, None)
+            if node._parents:
+                for parent in list(node._parents.values()):
+                    alive = parent()
+                    if alive is not None:
+                        stack.append(alive)
+
+    def _adopt(self, child: Any) -> None:
+        """Register as a parent of a node, the caches of the node reuse it.
+        Parents are held weakly and by identity, so that registering a
+        parent does not hash it"""
+        parents = child._parents
+        if parents is None:
+            parents = child._parents = {}
+        key = id(self)
+        if key not in parents:
+            parents[key] = ref(self, partial(_forget, parents, key))
+
+    def model_copy(self, *args: Any, **kwargs: Any) -> Any:
+        copy = super().model_copy(*args, **kwargs)
+        copy._immutable = None
+        copy._parents = None
+        return copy
+
+    def __getstate__(self) -> dict[str, Any]:
+        # The parents are not sent along with a node
+        state = super().__getstate__()
+        private = state.get("__pydantic_private__")
+        if private and private.get("_parents") is not None:
+            state["__pydantic_private__"] = private | {"_parents": None}
+        return state
+
     def _hash_str(self) -> str:
         return base64.urlsafe_b64encode(
             hash(self).to_bytes(length=8, byteorder="big", signed=True)
         ).decode("ascii")
 
+    def _fields(self) -> list[str]:
+        """The fields as in `model_dump(exclude_unset=True)`
+        without dumping the whole graph"""
+        return [
+            k
+            for k, field in type(self).model_fields.items()
+            if k in self.model_fields_set and not field.exclude
+        ]
+
     @classmethod
-    def to_immutable(cls, obj: Any) -> Any:
-        if isinstance(obj, BaseModel):
+    def to_immutable(cls, obj: Any, parent: "Hashable | None" = None) -> Any:
+        """The structure of a value, the nodes it holds are registered as
+        children of the `parent` node"""
+        if isinstance(obj, Hashable):
+            if parent is not None:
+                parent._adopt(obj)
+            cache = obj._immutable
+            if cache is None:
+                cache = Immutable(
+                    (obj.__class__.__name__,)
+                    + tuple(
+                        (k, cls.to_immutable(getattr(obj, k), obj))
+                        for k in obj._fields()
+                    )
+                )
+                obj._immutable = cache
+            return cache
+        elif isinstance(obj, BaseModel):
             return (obj.__class__.__name__,) + tuple(
-                (k, cls.to_immutable(getattr(obj, k)))
+                (k, cls.to_immutable(getattr(obj, k), parent))
                 for k in obj.model_dump(exclude_unset=True)
             )
         elif isinstance(obj, dict):
-            return tuple((k, cls.to_immutable(obj[k])) for k in obj)
+            return tuple((k, cls.to_immutable(obj[k], parent)) for k in obj)
         elif isinstance(obj, list | tuple | set):
-            return tuple(cls.to_immutable(o) for o in obj)
-        elif hasattr(obj, "__dict__"):
-            return cls.to_immutable(obj.__dict__)
+            return tuple(cls.to_immutable(o, parent) for o in obj)
         elif isinstance(obj, str | int | float | NoneType):
+            # Including the str or int enums
             return obj
+        elif hasattr(obj, "__dict__"):
+            return cls.to_immutable(obj.__dict__, parent)
         else:
             raise ValueError(f"{obj} ({obj.__class__})")
 
 
+# The interning table of the current scope
+_interning: ContextVar[dict["Computation", "Computation"] | None] = ContextVar(
+    "interning", default=None
+)
+
+
+@contextmanager
+def interning() -> Iterator[dict["Computation", "Computation"]]:
+    """In this scope, structurally identical computations of interned ops
+    are collapsed into a single node when they are built.
+    The table is scoped so that nodes are not shared between requests."""
+    table = _interning.get()
+    if table is not None:
+        yield table
+    else:
+        token = _interning.set({})
+        try:
+            yield _interning.get()
+        finally:
+            _interning.reset(token)
+
+
+# The task group of the current evaluation
+_task_group: ContextVar[TaskGroup | None] = ContextVar(
+    "task_group", default=None
+)
+
+
+# The serializable types by module and name, classes join when defined
+_registry: dict[tuple[str, str], type] = {}
+# The constructors of models from trusted values, by type
+_constructors: dict[type, Callable[[dict[str, Any]], Any]] = {}
+# The decoders of models, built once per type: the compiled validator of
+# the model, or its constructor from trusted values
+_decoders: dict[tuple[type, bool], Callable[[Any], Any]] = {}
+
+
+def serializable_type(module: str, name: str) -> type:
+    """Find a type, other modules are imported once"""
+    key = (module, name)
+    if key not in _registry:
+        _registry[key] = getattr(importlib.import_module(module), name)
+    return _registry[key]
+
+
+def serializable_name(cls: type) -> tuple[str, str]:
+    """The module and name of a type, parametrized generic models (e.g.
+    `Response[ChatCompletionResponse]`) are named after their origin"""
+    metadata = getattr(cls, "__pydantic_generic_metadata__", None)
+    if metadata and metadata["origin"]:
+        cls = metadata["origin"]
+    return cls.__module__, cls.__name__
+
+
+def exact(annotation: Any) -> bool:
+    """The values of the annotation are decoded as they were serialized,
+    without coercion (unlike tuples, enums or dicts with int keys)"""
+    if annotation in (Any, object, str, int, float, bool, NoneType, None):
+        return True
+    if annotation in (list, dict) or isinstance(annotation, TypeVar):
+        return True
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return True
+    origin, args = get_origin(annotation), get_args(annotation)
+    if origin is Annotated:
+        return exact(args[0])
+    if origin in (Union, UnionType, list):
+        return all(exact(arg) for arg in args)
+    if origin is Literal:
+        return all(type(arg) in (str, int, bool, NoneType) for arg in args)
+    if origin is dict:
+        return args[0] is str and exact(args[1])
+    return False
+
+
+def decoder(cls: type[BaseModel], trusted: bool) -> Callable[[Any], Any]:
+    """The decoder of a model from its serialized fields"""
+    try:
+        return _decoders[cls, trusted]
+    except KeyError:
+        validate = cls.__pydantic_validator__.validate_python
+        try:
+            _decoders[cls, trusted] = constructor(cls) if trusted else validate
+        except PydanticSchemaGenerationError:
+            # The fields to coerce cannot be validated alone
+            _decoders[cls, trusted] = validate
+        return _decoders[cls, trusted]
+
+
+def constructor(cls: type[BaseModel]) -> Callable[[dict[str, Any]], Any]:
+    """A constructor of the model from trusted values (written by our own
+    serializers): a lighter `model_construct` with defaults resolved once,
+    only the fields whose values are not decoded exactly are validated"""
+    if cls in _constructors:
+        return _constructors[cls]
+    coerced = {
+        name: TypeAdapter(
+            field.annotation,
+            config=ConfigDict(arbitrary_types_allowed=True),
+        ).validate_python
+        for name, field in cls.model_fields.items()
+        if not exact(field.annotation)
+    }
+    # Pydantic sets `init_private_attributes` as the post init of models with
+    # private attributes, they are initialized here
+    post_init = cls.model_post_init
+    if (
+        post_init is not BaseModel.model_post_init
+        and post_init.__name__ != "init_private_attributes"
+    ) or cls.model_config.get("extra") == "allow":
+
+        def construct(values: dict[str, Any]) -> Any:
+            for name, validate in coerced.items():
+                if name in values:
+                    values[name] = validate(values[name])
+            return cls.model_construct(set(values), **values)
+
+    else:
+        constants: dict[str, Any] = {}
+        factories: dict[str, FieldInfo] = {}
+        for name, field in cls.model_fields.items():
+            if field.is_required():
+                continue
+            if field.default_factory is None and isinstance(
+                field.default, str | int | float | bool | NoneType
+            ):
+                constants[name] = field.default
+            else:
+                factories[name] = field
+        private = {
+            name: attr.default
+            for name, attr in cls.__private_attributes__.items()
+            if isinstance(attr.default, str | int | float | bool | NoneType)
+        }
+        private_factories = {
+            name: attr
+            for name, attr in cls.__private_attributes__.items()
+            if name not in private
+            and (
+                attr.default is not PydanticUndefined
+                or attr.default_factory is not None
+            )
+        }
+
+        new = cls.__new__
+        set_attribute = object.__setattr__
+        has_private = bool(cls.__private_attributes__)
+
+        def construct(values: dict[str, Any]) -> Any:
+            fields_set = set(values)
+            for name, validate in coerced.items():
+                if name in values:
+                    values[name] = validate(values[name])
+            for name, field in factories.items():
+                if name not in values:
+                    values[name] = field.get_default(call_default_factory=True)
+            obj = new(cls)
+            set_attribute(obj, "__dict__", constants | values)
+            set_attribute(obj, "__pydantic_fields_set__", fields_set)
+            set_attribute(obj, "__pydantic_extra__", None)
+            if has_private:
+                private_values = private.copy()
+                for name, attr in private_factories.items():
+                    private_values[name] = attr.get_default()
+                set_attribute(obj, "__pydantic_private__", private_values)
+            else:
+                set_attribute(obj, "__pydantic_private__", None)
+            return obj
+
+    _constructors[cls] = construct
+    return construct
+
+
 # A mixin class to add json serializability to pydantic models
 class JsonSerializable:
+    def __init_subclass__(cls, **kwargs: Any) -> None:
+        super().__init_subclass__(**kwargs)
+        _registry[(cls.__module__, cls.__name__)] = cls
+
     @classmethod
     def to_json_dict(cls, obj: Any) -> Any:
         if isinstance(obj, BaseModel):
+            module, name = serializable_name(obj.__class__)
             return {
-                "module": obj.__class__.__module__,
-                "type": obj.__class__.__name__,
+                "module": module,
+                "type": name,
                 "value": {
                     k: cls.to_json_dict(getattr(obj, k))
                     for k in obj.model_dump(exclude_unset=True)
@@ -71,28 +401,37 @@ class JsonSerializable:
             return {k: cls.to_json_dict(obj[k]) for k in obj}
         elif isinstance(obj, list | tuple | set):
             return [cls.to_json_dict(o) for o in obj]
-        elif hasattr(obj, "__dict__"):
-            return cls.to_json_dict(obj.__dict__)
         elif isinstance(obj, str | int | float | NoneType):
+            # Including the str or int enums
             return obj
+        elif hasattr(obj, "__dict__"):
+            return cls.to_json_dict(obj.__dict__)
         else:
             raise ValueError(f"{obj} ({obj.__class__})")
 
     @classmethod
-    def from_json_dict(cls, obj: Any) -> Any:
-        if isinstance(obj, dict) and "module" in obj and "type" in obj:
-            module = importlib.import_module(obj["module"])
-            obj_cls = getattr(module, obj["type"])
-            if hasattr(obj_cls, "from_json_dict"):
-                return obj_cls.model_validate(
-                    obj_cls.from_json_dict(obj["value"])
+    def from_json_object(
+        cls, obj: dict[str, Any], trusted: bool = False
+    ) -> Any:
+        """Build a value from a JSON object whose values are already built,
+        a trusted value (written by our own services) is not validated"""
+        if "module" in obj and "type" in obj:
+            obj_cls = serializable_type(obj["module"], obj["type"])
+            return decoder(obj_cls, trusted)(obj["value"])
+        return obj
+
+    @classmethod
+    def from_json_dict(cls, obj: Any, trusted: bool = False) -> Any:
+        if isinstance(obj, dict):
+            if "module" in obj and "type" in obj:
+                obj_cls = serializable_type(obj["module"], obj["type"])
+                values = obj["value"]
+                return decoder(obj_cls, trusted)(
+                    {k: cls.from_json_dict(values[k], trusted) for k in values}
                 )
-            else:
-                return obj_cls.model_validate(cls.from_json_dict(obj["value"]))
-        elif isinstance(obj, dict):
-            return {k: cls.from_json_dict(obj[k]) for k in obj}
+            return {k: cls.from_json_dict(obj[k], trusted) for k in obj}
         elif isinstance(obj, list):
-            return [cls.from_json_dict(o) for o in obj]
+            return [cls.from_json_dict(o, trusted) for o in obj]
         else:
             return obj
 
@@ -100,8 +439,12 @@ class JsonSerializable:
         return json.dumps(self.to_json_dict(self))
 
     @classmethod
-    def from_json(cls, value: str) -> Any:
-        return cls.from_json_dict(json.loads(value))
+    def from_json(cls, value: str, trusted: bool = False) -> Any:
+        # The objects are built bottom-up while parsing
+        return json.loads(
+            value,
+            object_hook=lambda obj: cls.from_json_object(obj, trusted),
+        )
 
     def __str__(self) -> str:
         return self.to_json()
@@ -113,17 +456,88 @@ class Op(Hashable, JsonSerializable, BaseModel, ABC, Generic[*As, B]):
     and evaluated by calling `self.call`."""
 
     context: dict[str, Any] | None = Field(default=None, exclude=True)
+    _immutable: Immutable | None = PrivateAttr(default=None)
+    _parents: dict[int, ref] | None = PrivateAttr(default=None)
+    # A pure op result only depends on the op and its arguments,
+    # the engine can then memoize it across evaluations (and users): ops
+    # handling user data (e.g. PII) or reading mutable state are not pure
+    pure: ClassVar[bool] = False
+    # An interned op has no side effect and gives the same result
+    # within an evaluation, identical computations can then be shared
+    interned: ClassVar[bool] = False
+    # The resource the op uses (e.g. "object_store"), the scheduler can
+    # limit the concurrency per resource. Higher priority ops run first.
+    resource: ClassVar[str | None] = None
+    priority: ClassVar[int] = 0
+    # A blocking op runs sync code (DB, object store, parsing...) in its
+    # call, the engine runs it in a worker thread (see app.ops.threads)
+    blocking: ClassVar[bool] = False
+    # A checkpointed op is costly (e.g. a language model call), the worker
+    # persists its result so that a retry does not call it again (see
+    # app.ops.checkpoint), its result should be serializable
+    checkpointed: ClassVar[bool] = False
+    # A batched op coalesces its calls with the same `batch_key` made
+    # within `batch_window` seconds into one `batch_call` of up to
+    # `batch_size` calls (see app.ops.batching)
+    batch_size: ClassVar[int] = 1
+    batch_window: ClassVar[float] = 0.002
+    # The number of leading arguments evaluated before the op is called,
+    # None for all. The other arguments are passed as computations, the op
+    # evaluates them when needed with `Computation.force` (e.g. `If`)
+    eager: ClassVar[int | None] = None
+    # The time budget of a call in seconds (waiting for a slot included),
+    # past it the op fails with a TimeoutError
+    timeout: ClassVar[float | None] = None
+    # The call of a streaming op is an async generator, the nodes using it
+    # read its items as they are produced (see app.ops.streams). It runs in
+    # the event loop, is not scheduled nor memoized.
+    streaming: ClassVar[bool] = False
+    stream_buffer: ClassVar[int] = 8
+    # The longest wait for an item of the stream in seconds, past it the
+    # stream fails with a TimeoutError
+    stream_timeout: ClassVar[float | None] = None
 
     @abstractmethod
     async def call(self, *args: *As) -> B:
         """Execute the op"""
         pass
 
+    def batch_key(self, *args: Any) -> Any:
+        """The calls with equal batch keys are merged, the key should
+        identify the `batch_call` implementation"""
+        return self
+
+    async def batch_call(self, calls: list[tuple["Op", tuple]]) -> list[B]:
+        """Execute calls (op, args) of the same batch key at once"""
+        return [await op.call(*args) for op, args in calls]
+
+    def key(self, *args: Any) -> str | None:
+        """A content address for the result of the op applied to args
+        None if the result cannot be cached"""
+        try:
+            immutable = self.to_immutable(
+                (self.__class__.__module__, self, args)
+            )
+        except (ValueError, RecursionError):
+            return None
+        return hashlib.sha256(repr(immutable).encode()).hexdigest()
+
     def __call__(self, *args: Any) -> "Computation[B]":
         """Compose Ops into Computations"""
-        return Computation(
+        computation = Computation(
             op=self, args=[Computation.from_any(arg) for arg in args]
         )
+        table = _interning.get()
+        if (
+            table is not None
+            and (self.pure or self.interned)
+            and all(
+                isinstance(arg.op, Const) or table.get(arg) is arg
+                for arg in computation.args
+            )
+        ):
+            return table.setdefault(computation, computation)
+        return computation
 
 
 class Const(Op[tuple[()], B], Generic[B]):
@@ -139,6 +553,7 @@ class Getattr(Op[A, B], Generic[A, B]):
     """A getattr op"""
 
     attr: str
+    interned: ClassVar[bool] = True
 
     async def call(self, a: A) -> B:
         return a.__getattribute__(self.attr)
@@ -148,6 +563,7 @@ class Getitem(Op[*As, B], Generic[*As, B]):
     """A getitem op"""
 
     index: int
+    interned: ClassVar[bool] = True
 
     async def call(self, a: A) -> B:
         return a.__getitem__(self.index)
@@ -175,63 +591,280 @@ class Computation(Hashable, JsonSerializable, BaseModel, Generic[B]):
     op: Op
     args: list["Computation"]
     task: Task | None = Field(None, exclude=True)
+    _immutable: Immutable | None = PrivateAttr(default=None)
+    _order: dict[bool, list["Computation"]] | None = PrivateAttr(default=None)
+    _parents: dict[int, ref] | None = PrivateAttr(default=None)
+    _caches: ClassVar[tuple[str, ...]] = ("_immutable", "_order")
+
+    def __hash__(self) -> int:
+        # The nodes are hashed bottom up so that deep graphs do not recurse
+        if self._immutable is None:
+            for computation in self.order():
+                hash(Hashable.to_immutable(computation))
+        return super().__hash__()
+
+    def model_copy(self, *args: Any, **kwargs: Any) -> Any:
+        copy = super().model_copy(*args, **kwargs)
+        copy._order = None
+        return copy
+
+    def order(self, lazy: bool = True) -> list["Computation"]:
+        """The nodes in topological order (the arguments before the nodes
+        using them, `self` last), each node once, without the nodes only
+        reached through lazy arguments (see `Op.eager`) if not `lazy`.
+        The order is cached until a node is mutated (see `Hashable`)"""
+        cache = self._order
+        if cache is None:
+            cache = self._order = {}
+        if lazy not in cache:
+            order: list[Computation] = []
+            # Nodes are identified by identity, not by equality, as each
+            # node holds its own task
+            visited: set[int] = {id(self)}
+            stack: list[tuple[Computation, bool]] = [(self, False)]
+            while stack:
+                computation, expanded = stack.pop()
+                if expanded:
+                    order.append(computation)
+                    continue
+                stack.append((computation, True))
+                args = computation.args
+                if not lazy and computation.op.eager is not None:
+                    args = args[: computation.op.eager]
+                for arg in reversed(args):
+                    computation._adopt(arg)
+                    if id(arg) not in visited:
+                        visited.add(id(arg))
+                        stack.append((arg, False))
+            cache[lazy] = order
+        return cache[lazy]
 
     def clear(self):
-        """Clear the values
-        Clears only if value is set
-        The following invariant MUST holds:
-        If a value is set, all its parents are
-        """
-        if self.task or self.op.context:
-            for arg in self.args:
-                arg.clear()
-            self.task = None
-            self.op.context = None
+        """Clear the values and the contexts"""
+        for computation in self.order():
+            computation.task = None
+            computation.op.context = None
 
     def contexts(self, **context: Any):
         """Set the context in each op"""
-        if not self.op.context:
-            for arg in self.args:
-                arg.contexts(**context)
-            self.op.context = context
+        for computation in self.order():
+            if not computation.op.context:
+                computation.op.context = context
 
     async def call(self) -> B:
-        """Wait for all the args and calls the op.
+        """Wait for all the args and calls the op within its time budget.
         All tasks should have been created
         """
-        args = [await arg.task for arg in self.args]
-        logger.info(
-            f"Executing op {type(self.op)} with arguments of type {[type(el) for el in args]}"
-        )
-        return await self.op.call(*args)
+        from app.ops.tracing import node, result_size
 
-    def tasks(self, task_group: TaskGroup):
-        """Create all tasks"""
-        if not self.task:
-            for arg in self.args:
-                arg.tasks(task_group)
-            self.task = task_group.create_task(self.call())
-
-    async def evaluate(self, **context: Any) -> B:
-        """Execute the ops and clears all"""
-        self.contexts(**context)
         try:
-            async with TaskGroup() as task_group:
-                self.tasks(task_group)
-            result = await self.task
-        except Exception:
-            from app.ops.dot import dot
-
-            name = f"/tmp/dump_{time()}.dot"
-            with open(name, "w+") as f:
-                f.write(dot(self).to_string())
-            raise RuntimeError(
-                f"The computation failed. A dump is written there {name}"
+            args = [await arg.task for arg in self.args[: self.op.eager]]
+            args.extend(self.args[len(args) :])
+            logger.info(
+                f"Executing op {type(self.op)} with arguments of type {[type(el) for el in args]}"
+            )
+            with node(self) as span:
+                async with asyncio.timeout(self.op.timeout):
+                    value = await self.memoized(*args)
+                if span:
+                    span.size = result_size(value)
+                return value
+        except NodeError:
+            # An argument failed
+            raise
+        except Exception as e:
+            raise NodeError(self, e) from e
+
+    async def memoized(self, *args: Any) -> B:
+        """Call the op, the results of pure ops are cached and the results
+        of checkpointed ops are restored from a previous attempt"""
+        from app.ops.cache import context_cache
+        from app.ops.checkpoint import context_checkpoint
+
+        if self.op.streaming:
+            return await self.execute(*args)
+        cache = context_cache(self.op.context) if self.op.pure else None
+        key = self.op.key(*args) if cache else None
+        if key is not None:
+            found, value = await cache.get(key)
+            if found:
+                return value
+        checkpoint = (
+            context_checkpoint(self.op.context)
+            if self.op.checkpointed
+            else None
+        )
+        point = checkpoint.key(self) if checkpoint else None
+        if point is not None:
+            found, value = await checkpoint.get(point)
+            if found:
+                return value
+        value = await self.execute(*args)
+        if key is not None:
+            await cache.set(key, value)
+        if point is not None:
+            await checkpoint.set(point, value)
+        return value
+
+    async def execute(self, *args: Any) -> B:
+        """Call the op when the scheduler gives it a slot, the calls of
+        batched ops are coalesced"""
+        from app.ops.scheduler import context_scheduler
+        from app.ops.tracing import started
+
+        if self.op.streaming:
+            from app.ops.streams import Stream, readers, expected
+
+            started()
+            source = self.op.call(*readers(args))
+            return Stream(
+                source,
+                self.op.stream_buffer,
+                expected=expected(self),
+                idle=self.op.stream_timeout,
             )
+        if self.op.batch_size > 1:
+            from app.ops.batching import submit
+
+            started()
+            return await submit(self.op, args, self.execute_batch)
+        async with context_scheduler(self.op.context).slot(self.op):
+            started()
+            return await self.dispatch("call", *args)
+
+    async def execute_batch(self, calls: list[tuple[Op, tuple]]) -> list[Any]:
+        """Call the ops of a batch when the scheduler gives a slot"""
+        from app.ops.scheduler import context_scheduler
+
+        async with context_scheduler(self.op.context).slot(self.op):
+            return await self.dispatch("batch_call", calls)
+
+    async def dispatch(self, method: str, *args: Any) -> Any:
+        """Call a method of the op in a thread or the event loop"""
+        if method == "call":
+            from app.ops.streams import readers
+
+            # The streams are read from when the op starts
+            args = readers(args)
+        if self.op.blocking:
+            from app.ops.threads import run_blocking
+
+            return await run_blocking(self.op, *args, method=method)
+        return await getattr(self.op, method)(*args)
+
+    def tasks(self, task_group: TaskGroup):
+        """Create all tasks, the arguments first, lazy arguments are left to
+        their op"""
+        for computation in self.order(lazy=False):
+            if not computation.task:
+                task = task_group.create_task(computation.call())
+                computation.task = task
+
+    async def evaluate(
+        self, deadline: float | None = None, **context: Any
+    ) -> B:
+        """Execute the ops and clears all.
+        The evaluation is cancelled at the deadline (a `time()`), a failure
+        raises a `ComputationError` naming the nodes at fault"""
+        from app.ops.tracing import evaluation
+        from app.ops.streams import _consumers, consumers
+
+        if deadline is not None:
+            # Ops (and the evaluations they run) can see the deadline
+            context["deadline"] = deadline
+        with evaluation(context) as span:
+            self.contexts(**context)
+            try:
+                async with asyncio.timeout(
+                    None if deadline is None else deadline - time()
+                ):
+                    async with TaskGroup() as task_group:
+                        token = _task_group.set(task_group)
+                        # The streams drop the items read by all the nodes
+                        # using them
+                        counts = _consumers.set(consumers(self.order()))
+                        try:
+                            self.tasks(task_group)
+                        finally:
+                            _task_group.reset(token)
+                            _consumers.reset(counts)
+                result = await self.task
+            except Exception as e:
+                error = self.failure(e, span.trace if span else None)
+                self.clear()
+                raise error from error.errors[0] if error.errors else e
         self.clear()
         return result
 
+    def failure(
+        self, error: Exception, trace: Any = None
+    ) -> "ComputationError":
+        """The error of a failed evaluation, with a dump of the graph"""
+        from app.ops.dot import dot
+
+        if isinstance(error, TimeoutError):
+            # The deadline passed, the nodes at fault are the ones that were
+            # cancelled while their arguments were ready
+            nodes = [
+                computation
+                for computation in self.order()
+                if computation.task
+                and computation.task.cancelled()
+                and all(
+                    arg.task
+                    and arg.task.done()
+                    and not arg.task.cancelled()
+                    and arg.task.exception() is None
+                    for arg in computation.args[: computation.op.eager]
+                )
+            ]
+            errors: list[BaseException] = []
+            timeout = True
+            message = "The deadline passed while evaluating"
+        else:
+            node_errors = list(
+                {
+                    id(node_error): node_error
+                    for node_error in flatten(error)
+                    if isinstance(node_error, NodeError)
+                }.values()
+            )
+            nodes = [node_error.computation for node_error in node_errors]
+            errors = [node_error.error for node_error in node_errors]
+            timeout = bool(errors) and isinstance(errors[0], TimeoutError)
+            message = (
+                "The time budget ran out in" if timeout else "The op failed in"
+            )
+        names = ", ".join(type(node.op).__name__ for node in nodes)
+        name = f"/tmp/dump_{time()}.dot"
+        try:
+            with open(name, "w+") as f:
+                f.write(dot(self, trace).to_string())
+        except Exception as e:
+            logger.warning(f"The dump {name} was not written: {e}")
+        cls = ComputationTimeout if timeout else ComputationError
+        return cls(
+            f"{message} {names or 'the computation'}"
+            f"{f': {errors[0]!r}' if errors else ''}."
+            f" A dump is written there {name}",
+            nodes=nodes,
+            errors=errors,
+            dump=name,
+        )
+
+    async def force(self, context: dict[str, Any] | None = None) -> B:
+        """Evaluate a lazy argument, or a node built by an op, within the
+        current evaluation (evaluated on its own outside of an evaluation)"""
+        task_group = _task_group.get()
+        if task_group is None:
+            return await self.evaluate(**(context or {}))
+        self.contexts(**(context or {}))
+        self.tasks(task_group)
+        return await self.task
+
     def __getattr__(self, name: str) -> "Computation":
+        if name in self.__private_attributes__:
+            return super().__getattr__(name)
         return Getattr(attr=name)(self)
 
     def __getitem__(self, name: str) -> "Computation":
@@ -251,10 +884,8 @@ class Computation(Hashable, JsonSerializable, BaseModel, Generic[B]):
             return Const(value=obj)()
 
     def computation_set(self) -> set["Computation"]:
-        result = {self}
-        for arg in self.args:
-            result |= arg.computation_set()
-        return result
+        """The set of all the computations, equal ones are merged"""
+        return set(self.order())
 
     def computations(self) -> list["Computation"]:
         return sorted(self.computation_set(), key=lambda c: hash(c))
@@ -267,11 +898,67 @@ class Computation(Hashable, JsonSerializable, BaseModel, Generic[B]):
         return json.dumps(self.to_json_dict(flat_computations))
 
     @classmethod
-    def from_json(cls, value: str) -> Any:
-        flat_computations = cls.from_json_dict(json.loads(value))
+    def from_json(cls, value: str, trusted: bool = False) -> Any:
+        if trusted:
+            # The nodes are linked from the parsed value, the flat
+            # computations are not built
+            flat = json.loads(value)["value"]["flat_computation_list"]
+            return FlatComputations.link(
+                (
+                    fc["value"]["index"],
+                    cls.from_json_dict(fc["value"]["op"], trusted),
+                    fc["value"]["args"],
+                )
+                for fc in flat
+            )
+        flat_computations = super().from_json(value)
         return FlatComputations.to_computation(flat_computations)
 
 
+class NodeError(Exception):
+    """The exception of a node, passed up the graph as is"""
+
+    def __init__(self, computation: Computation, error: Exception):
+        super().__init__(f"{type(computation.op).__name__} failed: {error!r}")
+        self.computation = computation
+        self.error = error
+
+
+class ComputationError(RuntimeError):
+    """The failure of an evaluation: the nodes at fault (the node failing
+    first, or the nodes running when the deadline passed), their errors and
+    a dump of the graph"""
+
+    def __init__(
+        self,
+        message: str,
+        nodes: list[Computation],
+        errors: list[BaseException],
+        dump: str | None = None,
+    ):
+        super().__init__(message)
+        self.nodes = nodes
+        self.errors = errors
+        self.dump = dump
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "detail": str(self),
+            "nodes": [type(node.op).__name__ for node in self.nodes],
+        }
+
+
+class ComputationTimeout(ComputationError, TimeoutError):
+    """An evaluation past its deadline or an op past its time budget"""
+
+
+def flatten(error: BaseException) -> list[BaseException]:
+    """The exceptions of nested exception groups"""
+    if isinstance(error, BaseExceptionGroup):
+        return [e for group in error.exceptions for e in flatten(group)]
+    return [error]
+
+
 class FlatComputation(JsonSerializable, BaseModel):
     model_config = ConfigDict(arbitrary_types_allowed=True)
     """An Op applied to arguments"""
@@ -301,19 +988,26 @@ class FlatComputations(JsonSerializable, BaseModel):
     def to_computation(
         cls, flat_computations: "FlatComputations"
     ) -> Computation:
-        parents = {fc.index for fc in flat_computations.flat_computation_list}
-        children = {
-            index
-            for fc in flat_computations.flat_computation_list
-            for index in fc.args
-        }
-        maximal_parent = next(iter(parents - children))
-        computations = [
-            Computation(op=fc.op, args=[])
+        return cls.link(
+            (fc.index, fc.op, fc.args)
             for fc in flat_computations.flat_computation_list
-        ]
-        for fc in flat_computations.flat_computation_list:
-            computations[fc.index].args = [
-                computations[index] for index in fc.args
-            ]
-        return computations[maximal_parent]
+        )
+
+    @staticmethod
+    def link(nodes: Iterable[tuple[int, Op, list[int]]]) -> Computation:
+        """The computation of the nodes (index, op, arguments), the ops are
+        already built and the nodes are linked in place"""
+        nodes = list(nodes)
+        construct = constructor(Computation)
+        computations: list[Any] = [None] * len(nodes)
+        for index, op, _ in nodes:
+            computations[index] = construct({"op": op, "args": []})
+        children: set[int] = set()
+        for index, _, args in nodes:
+            computations[index].args.extend(computations[i] for i in args)
+            children.update(args)
+        return next(
+            computations[index]
+            for index, _, _ in nodes
+            if index not in children
+        )
@@ -0,0 +1,95 @@
+"""
+Control-flow ops: their branches are lazy arguments (see `Op.eager`), only
+the branch selected by a computed value is evaluated, within the same
+evaluation as the rest of the graph.
+"""
+
+from typing import Any, ClassVar, Generic, TypeVar
+
+from app.ops.computation import Op, Computation, Hashable
+from app.ops.utils import Tup, cst
+
+A = TypeVar("A")
+B = TypeVar("B")
+
+
+class If(Op[tuple[Any, B, B], B], Generic[B]):
+    """The `then` branch if the condition is truthy, else `otherwise`"""
+
+    eager: ClassVar[int] = 1
+
+    async def call(
+        self,
+        condition: Any,
+        then: Computation[B],
+        otherwise: Computation[B],
+    ) -> B:
+        return await (then if condition else otherwise).force(self.context)
+
+
+def cond(condition: Any, then: Any, otherwise: Any = None) -> Computation:
+    return If()(condition, then, otherwise)
+
+
+class Switch(Op[tuple[Any, B, *tuple[B, ...]], B], Generic[B]):
+    """The branch of the case equal to the value, else `default`"""
+
+    cases: list[Any]
+    eager: ClassVar[int] = 1
+
+    async def call(
+        self, value: Any, default: Computation[B], *branches: Computation[B]
+    ) -> B:
+        branch = default
+        if value in self.cases:
+            branch = branches[self.cases.index(value)]
+        return await branch.force(self.context)
+
+
+def switch(value: Any, cases: dict[Any, Any], default: Any = None):
+    return Switch(cases=list(cases))(value, default, *cases.values())
+
+
+class Map(Op[tuple[list[A], *tuple[Any, ...]], list[B]], Generic[A, B]):
+    """The op applied to each item of a list (and the other arguments),
+    the calls are nodes of the evaluation and run concurrently. An interned
+    op is called once per distinct item."""
+
+    op: Op
+
+    async def call(self, items: list[A], *args: Any) -> list[B]:
+        # The nodes are built apart from the graph (not interned) with a
+        # copy of the op, so that nothing is left in the graph
+        op = self.op.model_copy()
+        consts = [cst(arg) for arg in args]
+        indices, distinct = self.distinct(items)
+        calls = [
+            Computation(op=op, args=[cst(item), *consts]) for item in distinct
+        ]
+        computation = Computation(op=Tup(), args=calls)
+        results = await computation.force(self.context)
+        return [results[index] for index in indices]
+
+    def distinct(self, items: list[A]) -> tuple[list[int], list[A]]:
+        """The index of each item among the distinct items, equal items of
+        an interned op give the same result"""
+        if not self.op.interned:
+            return list(range(len(items))), items
+        positions: dict[Any, int] = {}
+        indices: list[int] = []
+        distinct: list[A] = []
+        for item in items:
+            try:
+                key = Hashable.to_immutable(item)
+            except ValueError:
+                # Not comparable, called on its own
+                key = object()
+            if key not in positions:
+                positions[key] = len(distinct)
+                distinct.append(item)
+            indices.append(positions[key])
+        return indices, distinct
+
+
+def fmap(op: Op, items: Any, *args: Any) -> Computation:
+    return Map(op=op)(items, *args)
@@ -1,14 +1,35 @@
 from io import BytesIO
-from typing import BinaryIO
+from typing import Any, AsyncIterator, BinaryIO, Callable, ClassVar, TypeVar
 from app.models import User
-from app.ops import Op
+from app.ops import Op, Computation
+from app.ops import processes, threads
+from app.ops.threads import complete
+from app.ops.scheduler import context_scheduler
 from app.services.object_store import documents
 from app.services.pdf_reader import pdf_reader
 from app.services.excel_reader import excel_reader
 from app.services.png_reader import png_reader
 from app.models import ContentType
 
+T = TypeVar("T")
+
+
+async def stored(op: Op, func: Callable[..., T], *args: Any) -> T:
+    """Access the object store in a thread, within an object store slot of
+    the scheduler of the op (held for the I/O, not for the parsing)"""
+    scheduler = context_scheduler(op.context)
+    async with scheduler.resource("object_store", op.priority):
+        return await threads.run_sync(func, *args)
+
+
+def read(path: str) -> bytes:
+    return documents.get(path).read()
+
+
 class Paths(Op[User, list[str]]):
+    resource: ClassVar[str] = "object_store"
+    blocking: ClassVar[bool] = True
+
     async def call(self, user: User) -> list[str]:
         prefixes = documents.list() if user.is_superuser else [f"{user.id}/"]
         return [
@@ -17,9 +38,14 @@ class Paths(Op[User, list[str]]):
             for path in documents.list(prefix=prefix)
         ]
 
+
 paths = Paths()
 
+
 class Path(Op[tuple[User, str], str]):
+    resource: ClassVar[str] = "object_store"
+    blocking: ClassVar[bool] = True
+
     async def call(self, user: User, name: str) -> str:
         """Get the path of a document from its name"""
         if user.is_superuser:
@@ -31,21 +57,48 @@ class Path(Op[tuple[User, str], str]):
         else:
             return f"{user.id}/{name}/"
 
+
 path = Path()
 
 
-class AsText(Op[tuple[User, str], str]):
+class Etag(Op[str, str]):
+    """The entity tag of the data of a document, it changes when the
+    document is uploaded again"""
+
+    resource: ClassVar[str] = "object_store"
+    blocking: ClassVar[bool] = True
+
+    async def call(self, source_path: str) -> str:
+        return documents.etag(f"{source_path}data")
+
+
+etag = Etag()
+
+
+class AsText(Op[tuple[str, str], str]):
+    """The text of the document at a path, the object store is read in
+    threads and only the parsing is sent to a worker process.
+    The text is addressed by the entity tag of the document data: it is
+    memoized across evaluations until the document changes."""
+
+    pure: ClassVar[bool] = True
+
+    def key(
+        self,
+        source_path: str,
+        etag: str,
+        start_page: int = 0,
+        end_page: int | None = None,
+    ) -> str | None:
+        return super().key(etag, start_page, end_page)
+
     async def call(
         self,
-        user: User,
-        name: str,
+        source_path: str,
+        etag: str,
         start_page: int = 0,
         end_page: int | None = None,
     ) -> str:
-        source_path = await path.call(user, name)
-        input = BytesIO(documents.get(f"{source_path}data").read())
-        content_type = documents.gets(f"{source_path}content_type")
-
         if end_page:
             path_as_text = (
                 f"{source_path}as_text_from_page_{start_page}_to_{end_page}"
@@ -54,31 +107,48 @@ class AsText(Op[tuple[User, str], str]):
             path_as_text = f"{source_path}as_text_from_page_{start_page}"
         else:
             path_as_text = f"{source_path}as_text"
-            
-        if not documents.exists(path_as_text):
+        # The text of a document uploaded again is parsed again
+        path_as_text = f"{path_as_text}_{etag}"
+
+        if not await stored(self, documents.exists, path_as_text):
             # The doc should be created
+            data = await stored(self, read, f"{source_path}data")
+            content_type = await stored(
+                self, documents.gets, f"{source_path}content_type"
+            )
             if content_type == ContentType.PDF:
-                documents.puts(
-                    path_as_text,
-                    pdf_reader.as_text(
-                        input, start_page=start_page, end_page=end_page
-                    ),
+                text = await processes.run_sync(
+                    pdf_reader.as_text, BytesIO(data), start_page, end_page
+                )
+            elif (
+                content_type == ContentType.XLS
+                or content_type == ContentType.XLSX
+            ):
+                text = await processes.run_sync(
+                    excel_reader.as_csv, BytesIO(data)
                 )
-            elif content_type == ContentType.XLS or content_type == ContentType.XLSX:
-                documents.puts(
-                    path_as_text,
-                    excel_reader.as_csv(input)
-                    )
             else:
-                documents.puts(path_as_text, "Error: Could not read as text")
+                text = "Error: Could not read as text"
+            await stored(self, documents.puts, path_as_text, text)
         # output the file
-        output = documents.get(path_as_text)
-        return output.read().decode("utf8")
+        return await stored(self, documents.gets, path_as_text)
+
+
+def as_text(
+    user: User | Computation[User],
+    name: str | Computation[str],
+    start_page: int | Computation[int] = 0,
+    end_page: int | None | Computation[int | None] = None,
+) -> Computation[str]:
+    """The text of a document from its name"""
+    source_path = path(user, name)
+    return AsText()(source_path, etag(source_path), start_page, end_page)
 
 
-as_text = AsText()
-     
 class AsPng(Op[tuple[User, str], str]):
+    """The pages of a document as PNG, the object store is read and written
+    in threads and only the rasterization is sent to a worker process"""
+
     async def call(
         self,
         user: User,
@@ -86,33 +156,103 @@ class AsPng(Op[tuple[User, str], str]):
         start_page: int = 0,
         end_page: int | None = None,
     ) -> list[BinaryIO]:
-        source_path = await path.call(user, name)
-        input = BytesIO(documents.get(f"{source_path}data").read())
-        content_type = documents.gets(f"{source_path}content_type")
-
+        source_path = await stored(self, complete, path.call, user, name)
+        data = await stored(self, read, f"{source_path}data")
+        content_type = await stored(
+            self, documents.gets, f"{source_path}content_type"
+        )
         path_as_png = f"{source_path}as_png"
-        binary_buffers = []
 
         if content_type == ContentType.PDF:
-            page_buffer = pdf_reader.as_pngs(input, start_page=start_page, end_page=end_page)
+            page_buffer = await processes.run_sync(
+                pdf_reader.as_pngs, BytesIO(data), start_page, end_page
+            )
+            binary_buffers = []
             for page, byte_stream in page_buffer:
-                specific_path_as_png = f"{path_as_png}_page_{page}"
-                documents.put(
-                            specific_path_as_png,
-                            byte_stream
-                            ),
+                await stored(
+                    self,
+                    documents.put,
+                    f"{path_as_png}_page_{page}",
+                    byte_stream,
+                )
+                byte_stream.seek(0)
                 binary_buffers.append(byte_stream)
             return binary_buffers
-        
-        elif content_type == ContentType.PNG:  
-            buffer = png_reader.as_png(input)
-            documents.put(
-                        path_as_png,
-                        buffer
-                        ),
+        elif content_type == ContentType.PNG:
+            buffer = await processes.run_sync(png_reader.as_png, BytesIO(data))
+            await stored(self, documents.put, path_as_png, buffer)
+            buffer.seek(0)
             return [buffer]
         else:
-            documents.puts(path_as_png, "Error: Could not read as png")
-            return [BytesIO(b"Error: Could not read as png")] 
-         
-as_png = AsPng()
\ No newline at end of file
+            await stored(
+                self,
+                documents.puts,
+                path_as_png,
+                "Error: Could not read as png",
+            )
+            return [BytesIO(b"Error: Could not read as png")]
+
+
+as_png = AsPng()
+
+
+class AsPngPages(Op[tuple[User, str], AsyncIterator[tuple[int, BinaryIO]]]):
+    """The pages of a document as PNG, streamed as they are rasterized
+    (see `AsPng`)"""
+
+    streaming: ClassVar[bool] = True
+    # The most pages rasterized in a worker call, held in memory together
+    max_chunk: ClassVar[int] = 16
+
+    async def call(
+        self,
+        user: User,
+        name: str,
+        start_page: int = 0,
+        end_page: int | None = None,
+    ) -> AsyncIterator[tuple[int, BinaryIO]]:
+        source_path = await stored(self, complete, path.call, user, name)
+        data = await stored(self, read, f"{source_path}data")
+        content_type = await stored(
+            self, documents.gets, f"{source_path}content_type"
+        )
+        path_as_png = f"{source_path}as_png"
+        if content_type == ContentType.PDF:
+            pages = await processes.run_sync(
+                pdf_reader.page_numbers, BytesIO(data), start_page, end_page
+            )
+            # The pages are rasterized by chunks of doubling sizes: the first
+            # page comes quickly and the document is sent to a worker (and
+            # parsed) a few times only
+            size = 1
+            while pages:
+                chunk, pages = pages[:size], pages[size:]
+                size = min(2 * size, self.max_chunk)
+                buffers = await processes.run_sync(
+                    pdf_reader.pages_as_png, BytesIO(data), chunk
+                )
+                for page, buffer in buffers:
+                    await stored(
+                        self,
+                        documents.put,
+                        f"{path_as_png}_page_{page}",
+                        buffer,
+                    )
+                    buffer.seek(0)
+                    yield (page, buffer)
+        elif content_type == ContentType.PNG:
+            buffer = await processes.run_sync(png_reader.as_png, BytesIO(data))
+            await stored(self, documents.put, path_as_png, buffer)
+            buffer.seek(0)
+            yield (0, buffer)
+        else:
+            await stored(
+                self,
+                documents.puts,
+                path_as_png,
+                "Error: Could not read as png",
+            )
+            yield (0, BytesIO(b"Error: Could not read as png"))
+
+
+as_png_pages = AsPngPages()
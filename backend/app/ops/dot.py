@@ -1,19 +1,42 @@
 from app.ops import Computation
 from app.ops.computation import FlatComputations
+from app.ops.tracing import Trace
 from pydot import Node, Edge, Dot
 
 
-def dot(computation: Computation) -> Dot:
+def dot(computation: Computation, trace: Trace | None = None) -> Dot:
+    """The graph of a computation, annotated with the timings of a trace
+    and its critical path in red"""
     graph = Dot("computation", graph_type="digraph")
     flat_computations = FlatComputations.from_computation(computation)
-    nodes(graph, flat_computations)
+    nodes(graph, flat_computations, computation, trace)
     edges(graph, flat_computations)
     return graph
 
 
-def nodes(graph: Dot, flat_computations: FlatComputations):
+def nodes(
+    graph: Dot,
+    flat_computations: FlatComputations,
+    computation: Computation,
+    trace: Trace | None = None,
+):
+    # Indexed as the flat computations
+    computations = computation.computations()
+    critical_path = set(trace.critical_path(computation)) if trace else set()
     for fc in flat_computations.flat_computation_list:
-        graph.add_node(Node(fc.index, label=str(fc.op)))
+        label = str(fc.op)
+        span = trace.nodes.get(computations[fc.index]) if trace else None
+        if span:
+            label += (
+                f"\nwait {span.queue_wait / 1e6:.1f}ms"
+                f" run {span.duration / 1e6:.1f}ms"
+            )
+            if span.error is not None:
+                label += f"\n{type(span.error).__name__}"
+        if computations[fc.index] in critical_path:
+            graph.add_node(Node(fc.index, label=label, color="red"))
+        else:
+            graph.add_node(Node(fc.index, label=label))
 
 
 def edges(graph: Dot, flat_computations: FlatComputations):
@@ -1,4 +1,4 @@
-from typing import TypeVar, Generic
+from typing import Any, TypeVar, Generic, ClassVar
 
 from pydantic import BaseModel
 from sqlmodel import Session
@@ -17,6 +17,9 @@ class LogEvent(
     Op[tuple[Session, User, EventOut | None, A], EventOut], Generic[A]
 ):
     name: str
+    resource: ClassVar[str] = "db"
+    blocking: ClassVar[bool] = True
+    batch_size: ClassVar[int] = 64
 
     def event_create(self, parent: EventOut | None, a: A) -> EventCreate:
         return EventCreate(
@@ -35,6 +38,28 @@ class LogEvent(
         # Create a copy to avoid future mutations
         return EventOut.model_validate(event)
 
+    def batch_key(
+        self, session: Session, user: User, parent: EventOut | None, a: A
+    ) -> Any:
+        # The events of all the sessions bound to a database are inserted
+        # together, by a session of the batch (`create_event` commits each
+        # event anyway)
+        return (LogEvent, session.get_bind())
+
+    async def batch_call(
+        self, calls: list[tuple[Op, tuple]]
+    ) -> list[EventOut]:
+        with Session(calls[0][1][0].get_bind()) as session:
+            events = crud.create_events(
+                session=session,
+                events_in=[
+                    op.event_create(parent, a)
+                    for op, (_, _, parent, a) in calls
+                ],
+                owner_ids=[user.id for _, (_, user, _, _) in calls],
+            )
+            return [EventOut.model_validate(event) for event in events]
+
 
 class LogRequest(LogEvent[Request]):
     name: str = "request"
@@ -53,6 +78,9 @@ log_response = LogResponse()
 class CreateEventIdentifier(
     Op[tuple[Session, User, EventOut, str], EventIdentifier]
 ):
+    resource: ClassVar[str] = "db"
+    blocking: ClassVar[bool] = True
+
     async def call(
         self, session: Session, user: User, event: EventOut, identifier: str
     ) -> EventIdentifier:
@@ -1,30 +1,55 @@
 import re
+from contextlib import aclosing
+from typing import Any, AsyncIterable, AsyncIterator, ClassVar
 
 from app.lm.models import (
     LMApiKeys,
+    LMConfig,
     ChatCompletionResponse,
     ChatCompletionRequest,
+    ChatCompletionChunk,
     Message,
     Score,
 )
 import app.lm.models.openai as openai_models
 import app.lm.models.mistral as mistral_models
 import app.lm.models.anthropic as anthropic_models
+from app.core.config import settings
+from app.models import UserOut
 from app.services import Request, Response
 import app.services.lm as slm
+import app.services.semantic_cache as ssc
 from app.ops import Op
 
 
+def cache_options(context: dict[str, Any] | None) -> dict[str, Any]:
+    """The response cache options of an evaluation (see
+    `app.services.lm.ResponseCache`): the caller may opt in with
+    `cache_responses`, the responses are isolated per `user_id`"""
+    context = context or {}
+    user_id = context.get("user_id")
+    return {
+        "cache_opt_in": bool(context.get("cache_responses")),
+        "cache_scope": None if user_id is None else str(user_id),
+    }
+
+
 class OpenAI(
     Op[
         tuple[str, openai_models.ChatCompletionRequest],
         Response[openai_models.ChatCompletionResponse],
     ]
 ):
+    resource: ClassVar[str] = "lm"
+    timeout: ClassVar[float] = settings.LM_TIMEOUT
+    checkpointed: ClassVar[bool] = True
+
     async def call(
         self, api_key: str, input: openai_models.ChatCompletionRequest
     ) -> Response[openai_models.ChatCompletionResponse]:
-        return await slm.OpenAI(api_key=api_key).openai_chat_completion(input)
+        return await slm.service(
+            slm.OpenAI, api_key, **cache_options(self.context)
+        ).openai_chat_completion(input)
 
 
 class OpenAIRequest(
@@ -36,12 +61,35 @@ class OpenAIRequest(
     async def call(
         self, input: openai_models.ChatCompletionRequest
     ) -> Request[openai_models.ChatCompletionRequest]:
-        return slm.OpenAI().request(input)
+        return slm.service(slm.OpenAI, "").request(input)
+
+
+class OpenAIStream(
+    Op[
+        tuple[str, openai_models.ChatCompletionRequest],
+        AsyncIterator[openai_models.ChatCompletionChunk],
+    ]
+):
+    streaming: ClassVar[bool] = True
+    stream_timeout: ClassVar[float] = settings.STREAM_IDLE_TIMEOUT
+
+    async def call(
+        self, api_key: str, input: openai_models.ChatCompletionRequest
+    ) -> AsyncIterator[openai_models.ChatCompletionChunk]:
+        # The provider stream is closed when the stream is given up
+        async with aclosing(
+            slm.service(slm.OpenAI, api_key).openai_chat_completion_stream(
+                input
+            )
+        ) as chunks:
+            async for chunk in chunks:
+                yield chunk
 
 
 # instances
 openai = OpenAI()
 openai_request = OpenAIRequest()
+openai_stream = OpenAIStream()
 
 
 class Mistral(
@@ -50,12 +98,16 @@ class Mistral(
         Response[mistral_models.ChatCompletionResponse],
     ]
 ):
+    resource: ClassVar[str] = "lm"
+    timeout: ClassVar[float] = settings.LM_TIMEOUT
+    checkpointed: ClassVar[bool] = True
+
     async def call(
         self, api_key: str, input: mistral_models.ChatCompletionRequest
     ) -> Response[mistral_models.ChatCompletionResponse]:
-        return await slm.Mistral(api_key=api_key).mistral_chat_completion(
-            input
-        )
+        return await slm.service(
+            slm.Mistral, api_key, **cache_options(self.context)
+        ).mistral_chat_completion(input)
 
 
 class MistralRequest(
@@ -67,12 +119,35 @@ class MistralRequest(
     async def call(
         self, input: mistral_models.ChatCompletionRequest
     ) -> Request[mistral_models.ChatCompletionRequest]:
-        return slm.Mistral().request(input)
+        return slm.service(slm.Mistral, "").request(input)
+
+
+class MistralStream(
+    Op[
+        tuple[str, mistral_models.ChatCompletionRequest],
+        AsyncIterator[mistral_models.ChatCompletionChunk],
+    ]
+):
+    streaming: ClassVar[bool] = True
+    stream_timeout: ClassVar[float] = settings.STREAM_IDLE_TIMEOUT
+
+    async def call(
+        self, api_key: str, input: mistral_models.ChatCompletionRequest
+    ) -> AsyncIterator[mistral_models.ChatCompletionChunk]:
+        # The provider stream is closed when the stream is given up
+        async with aclosing(
+            slm.service(slm.Mistral, api_key).mistral_chat_completion_stream(
+                input
+            )
+        ) as chunks:
+            async for chunk in chunks:
+                yield chunk
 
 
 # instances
 mistral = Mistral()
 mistral_request = MistralRequest()
+mistral_stream = MistralStream()
 
 
 class Anthropic(
@@ -81,12 +156,16 @@ class Anthropic(
         Response[anthropic_models.ChatCompletionResponse],
     ]
 ):
+    resource: ClassVar[str] = "lm"
+    timeout: ClassVar[float] = settings.LM_TIMEOUT
+    checkpointed: ClassVar[bool] = True
+
     async def call(
         self, api_key: str, input: anthropic_models.ChatCompletionRequest
     ) -> Response[anthropic_models.ChatCompletionResponse]:
-        return await slm.Anthropic(api_key=api_key).anthropic_chat_completion(
-            input
-        )
+        return await slm.service(
+            slm.Anthropic, api_key, **cache_options(self.context)
+        ).anthropic_chat_completion(input)
 
 
 class AnthropicRequest(
@@ -98,12 +177,35 @@ class AnthropicRequest(
     async def call(
         self, input: anthropic_models.ChatCompletionRequest
     ) -> Request[anthropic_models.ChatCompletionRequest]:
-        return slm.Anthropic().request(input)
+        return slm.service(slm.Anthropic, "").request(input)
+
+
+class AnthropicStream(
+    Op[
+        tuple[str, anthropic_models.ChatCompletionRequest],
+        AsyncIterator[anthropic_models.StreamEvent],
+    ]
+):
+    streaming: ClassVar[bool] = True
+    stream_timeout: ClassVar[float] = settings.STREAM_IDLE_TIMEOUT
+
+    async def call(
+        self, api_key: str, input: anthropic_models.ChatCompletionRequest
+    ) -> AsyncIterator[anthropic_models.StreamEvent]:
+        # The provider stream is closed when the stream is given up
+        async with aclosing(
+            slm.service(
+                slm.Anthropic, api_key
+            ).anthropic_chat_completion_stream(input)
+        ) as events:
+            async for event in events:
+                yield event
 
 
 # instances
 anthropic = Anthropic()
 anthropic_request = AnthropicRequest()
+anthropic_stream = AnthropicStream()
 
 
 class Chat(
@@ -112,12 +214,28 @@ class Chat(
         Response[ChatCompletionResponse],
     ]
 ):
+    resource: ClassVar[str] = "lm"
+    timeout: ClassVar[float] = settings.LM_TIMEOUT
+    checkpointed: ClassVar[bool] = True
+
     async def call(
-        self, api_keys: LMApiKeys, input: ChatCompletionRequest
+        self,
+        api_keys: LMApiKeys,
+        input: ChatCompletionRequest,
+        config: LMConfig | None = None,
     ) -> Response[ChatCompletionResponse]:
-        return await slm.LanguageModels(api_keys=api_keys).chat_completion(
-            input
+        service = slm.LanguageModels(
+            api_keys=api_keys, **cache_options(self.context)
         )
+        # The request may be hedged or fall back to alternative models
+        if config and config.alternative_models:
+            return await service.chat_completion_race(
+                input,
+                config.alternative_models,
+                config.hedge_percentile,
+                config.fallback,
+            )
+        return await service.chat_completion(input)
 
 
 class ChatRequest(Op[ChatCompletionRequest, Request[ChatCompletionRequest]]):
@@ -131,9 +249,48 @@ class ChatRequest(Op[ChatCompletionRequest, Request[ChatCompletionRequest]]):
         ).request(input)
 
 
+class ChatStream(
+    Op[
+        tuple[LMApiKeys, ChatCompletionRequest],
+        AsyncIterator[ChatCompletionChunk],
+    ]
+):
+    streaming: ClassVar[bool] = True
+    stream_timeout: ClassVar[float] = settings.STREAM_IDLE_TIMEOUT
+
+    async def call(
+        self, api_keys: LMApiKeys, input: ChatCompletionRequest
+    ) -> AsyncIterator[ChatCompletionChunk]:
+        # The provider stream is closed when the stream is given up
+        async with aclosing(
+            slm.LanguageModels(api_keys=api_keys).chat_completion_stream(input)
+        ) as chunks:
+            async for chunk in chunks:
+                yield chunk
+
+
 # instances
 chat = Chat()
 chat_request = ChatRequest()
+chat_stream = ChatStream()
+
+
+class Accumulate(Op[tuple[AsyncIterable[Any]], Response[Any]]):
+    """The response of a streamed chat completion, once the stream is
+    done. The chunks (or events) implement `accumulate`."""
+
+    async def call(self, chunks: AsyncIterable[Any]) -> Response[Any]:
+        items = [chunk async for chunk in chunks]
+        if not items:
+            raise ValueError("The stream is empty")
+        return Response(
+            status_code=200,
+            headers={},
+            content=type(items[0]).accumulate(items),
+        )
+
+
+accumulate = Accumulate()
 
 
 class Judge(
@@ -141,6 +298,10 @@ class Judge(
 ):
     """Implements a simple LLM-as-a-judge as in https://arxiv.org/pdf/2306.05685.pdf"""
 
+    resource: ClassVar[str] = "lm"
+    timeout: ClassVar[float] = settings.LM_TIMEOUT
+    checkpointed: ClassVar[bool] = True
+
     name: str = "judge"
     reference_model: str = "gpt-4o"
     judge_model: str = "gpt-4o"
@@ -159,7 +320,10 @@ class Judge(
         request: ChatCompletionRequest,
         response: ChatCompletionResponse,
     ) -> Score:
-        service = slm.LanguageModels(api_keys=api_keys)
+        # The reference answer (at temperature 0) is cached
+        service = slm.LanguageModels(
+            api_keys=api_keys, **cache_options(self.context)
+        )
         reference_request = request.model_copy()
         reference_request.model = self.reference_model
         reference_request.temperature = 0
@@ -203,3 +367,72 @@ and level of detail of their responses.""",
 
 
 judge = Judge()
+
+
+def context_semantic_cache(
+    context: dict[str, Any] | None,
+) -> ssc.SemanticCache:
+    """The semantic cache to use given an evaluation context"""
+    if context and context.get("semantic_cache"):
+        return context["semantic_cache"]
+    return ssc.semantic_cache
+
+
+class SemanticLookup(
+    Op[
+        tuple[UserOut, float | None, ChatCompletionRequest],
+        Response[ChatCompletionResponse] | None,
+    ]
+):
+    """The cached response of a similar request of the user, if any (and
+    the user set a threshold)"""
+
+    blocking: ClassVar[bool] = True
+
+    async def call(
+        self,
+        user: UserOut,
+        threshold: float | None,
+        request: ChatCompletionRequest,
+    ) -> Response[ChatCompletionResponse] | None:
+        if threshold is None:
+            return None
+        return context_semantic_cache(self.context).lookup(
+            str(user.id), threshold, request
+        )
+
+
+semantic_lookup = SemanticLookup()
+
+
+class SemanticStore(
+    Op[
+        tuple[
+            UserOut,
+            float | None,
+            ChatCompletionRequest,
+            Response[ChatCompletionResponse],
+        ],
+        Response[ChatCompletionResponse],
+    ]
+):
+    """Store the response of a request of the user (if the user set a
+    threshold) and pass it on"""
+
+    blocking: ClassVar[bool] = True
+
+    async def call(
+        self,
+        user: UserOut,
+        threshold: float | None,
+        request: ChatCompletionRequest,
+        response: Response[ChatCompletionResponse],
+    ) -> Response[ChatCompletionResponse]:
+        if threshold is not None:
+            context_semantic_cache(self.context).store(
+                str(user.id), threshold, request, response
+            )
+        return response
+
+
+semantic_store = SemanticStore()
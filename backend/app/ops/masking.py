@@ -1,24 +1,69 @@
-from typing import Mapping
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Mapping,
+    ClassVar,
+    Sequence,
+)
+from dataclasses import dataclass
+import asyncio
+import re
 from pydantic import Field, ConfigDict
 from faker import Faker
+from app.core.config import settings
 from app.services.masking import (
     Analyzer,
     AnalyzerRequest,
+    AnalyzerResponseItem,
     Anonymizer,
     AnonymizerRequest,
     Anonymizers,
     Replace,
     Keep,
 )
+from app.services import Request
+from app.lm.models import ChatCompletionResponse
 from app.ops import Op
 
+# The entities masked
+ENTITIES = ["PERSON", "EMAIL_ADDRESS"]
+
 
 class Masking(Op[str, str]):
+    interned: ClassVar[bool] = True
+    resource: ClassVar[str] = "presidio"
+    timeout: ClassVar[float] = settings.MASKING_TIMEOUT
+    # The texts masked concurrently are analyzed in one request
+    batch_size: ClassVar[int] = 16
+
     async def call(self, input: str) -> str:
         analyzer = Analyzer()
-        anonymizer = Anonymizer()
         entities = ["PERSON", "EMAIL_ADDRESS"]
         analysis = await analyzer.analyze(AnalyzerRequest(text=input, entities=entities))
+        return await self.anonymize(input, analysis)
+
+    def batch_key(self, input: str) -> Any:
+        return Masking
+
+    async def batch_call(self, calls: list[tuple[Op, tuple]]) -> list[str]:
+        texts = [input for _, (input,) in calls]
+        analyses = await Analyzer().analyze_texts(
+            AnalyzerRequest(text="", entities=ENTITIES), texts
+        )
+        return list(
+            await asyncio.gather(
+                *(
+                    self.anonymize(text, analysis)
+                    for text, analysis in zip(texts, analyses, strict=True)
+                )
+            )
+        )
+
+    async def anonymize(
+        self, input: str, analysis: Sequence[AnalyzerResponseItem]
+    ) -> str:
+        anonymizer = Anonymizer()
         anonymized = await anonymizer.anonymize(
             AnonymizerRequest(
                 text=input,
@@ -38,6 +83,10 @@ masking = Masking()
 class ReplaceMasking(Op[str, tuple[str, Mapping[str, str]]]):
     model_config = ConfigDict(arbitrary_types_allowed=True)
     fake: Faker = Field(exclude=True, default_factory=lambda: Faker())
+    interned: ClassVar[bool] = True
+    resource: ClassVar[str] = "presidio"
+    timeout: ClassVar[float] = settings.MASKING_TIMEOUT
+    batch_size: ClassVar[int] = 16
 
     def replace_person(self, person: str, salt: str = "") -> str:
         self.fake.seed_instance(hash(person + salt))
@@ -65,10 +114,34 @@ class ReplaceMasking(Op[str, tuple[str, Mapping[str, str]]]):
 
     async def call(self, input: str) -> tuple[str, Mapping[str, str]]:
         analyzer = Analyzer()
-        anonymizer = Anonymizer()
         #Passing only the relevant entities to the analyzer so the model searches for these specifically.
         entities = ["PERSON", "EMAIL_ADDRESS"]
         analysis = await analyzer.analyze(AnalyzerRequest(text=input, entities=entities))
+        return await self.anonymize(input, analysis)
+
+    def batch_key(self, input: str) -> Any:
+        return ReplaceMasking
+
+    async def batch_call(
+        self, calls: list[tuple[Op, tuple]]
+    ) -> list[tuple[str, Mapping[str, str]]]:
+        texts = [input for _, (input,) in calls]
+        analyses = await Analyzer().analyze_texts(
+            AnalyzerRequest(text="", entities=ENTITIES), texts
+        )
+        return list(
+            await asyncio.gather(
+                *(
+                    self.anonymize(text, analysis)
+                    for text, analysis in zip(texts, analyses, strict=True)
+                )
+            )
+        )
+
+    async def anonymize(
+        self, input: str, analysis: Sequence[AnalyzerResponseItem]
+    ) -> tuple[str, Mapping[str, str]]:
+        anonymizer = Anonymizer()
         anonymized = await anonymizer.anonymize(AnonymizerRequest(
             text=input,
             anonymizers=Anonymizers(
@@ -91,3 +164,187 @@ class ReplaceMasking(Op[str, tuple[str, Mapping[str, str]]]):
 
 
 replace_masking = ReplaceMasking()
+
+
+def text_messages(request: Request[Any]) -> list[Any]:
+    """The messages of a chat completion request with a text content,
+    other contents (e.g. images) are not masked"""
+    return [
+        message
+        for message in request.content.messages
+        if isinstance(message.content, str)
+    ]
+
+
+class TextContents(Op[tuple[Request[Any]], list[str]]):
+    """The text contents of the messages of a request"""
+
+    async def call(self, request: Request[Any]) -> list[str]:
+        return [message.content for message in text_messages(request)]
+
+
+text_contents = TextContents()
+
+
+class WithContents(Op[tuple[Request[Any], list[str]], Request[Any]]):
+    """A copy of the request with its text contents replaced"""
+
+    async def call(
+        self, request: Request[Any], contents: list[str]
+    ) -> Request[Any]:
+        request = request.model_copy(deep=True)
+        for message, content in zip(
+            text_messages(request), contents, strict=True
+        ):
+            message.content = content
+        return request
+
+
+with_contents = WithContents()
+
+
+class WithReplacements(
+    Op[
+        tuple[Request[Any], list[tuple[str, Mapping[str, str]]]],
+        tuple[Request[Any], Mapping[str, str]],
+    ]
+):
+    """A copy of the request with its text contents replaced by
+    `ReplaceMasking` and the mapping to replace the entities back"""
+
+    async def call(
+        self,
+        request: Request[Any],
+        replacements: list[tuple[str, Mapping[str, str]]],
+    ) -> tuple[Request[Any], Mapping[str, str]]:
+        request = request.model_copy(deep=True)
+        mapping: dict[str, str] = {}
+        for message, (content, message_mapping) in zip(
+            text_messages(request), replacements, strict=True
+        ):
+            message.content = content
+            # Only the entities of the user are replaced back, the ones of
+            # the system messages (e.g. examples) should not leak to the user
+            if message.role == "user":
+                mapping.update(message_mapping)
+        return (request, mapping)
+
+
+with_replacements = WithReplacements()
+
+
+class ReplaceBack(
+    Op[
+        tuple[ChatCompletionResponse, Mapping[str, str]],
+        ChatCompletionResponse,
+    ]
+):
+    """Replace the entities of the response by the real ones"""
+
+    async def call(
+        self, response: ChatCompletionResponse, mapping: Mapping[str, str]
+    ) -> ChatCompletionResponse:
+        if not mapping:
+            return response
+        # The response may be logged concurrently, it is left untouched
+        response = response.model_copy(deep=True)
+        message = response.choices[0].message
+        for fake_entity, real_entity in mapping.items():
+            message.content = message.content.replace(fake_entity, real_entity)
+        return response
+
+
+replace_back = ReplaceBack()
+
+
+@dataclass
+class Replacer:
+    """Replaces the entities in a text received in pieces, the end of the
+    text that could be the beginning of an entity is held back"""
+
+    mapping: Mapping[str, str]
+    pending: str = ""
+
+    def __post_init__(self) -> None:
+        # The longest entities first, as `str.replace` would
+        keys = sorted(filter(None, self.mapping), key=len, reverse=True)
+        self.pattern = (
+            re.compile("|".join(map(re.escape, keys))) if keys else None
+        )
+
+    def held(self, text: str, start: int) -> int:
+        """Where the end of the text that could begin an entity starts"""
+        for position in range(start, len(text)):
+            tail = text[position:]
+            if any(
+                len(key) > len(tail) and key.startswith(tail)
+                for key in self.mapping
+            ):
+                return position
+        return len(text)
+
+    def replace(self, final: bool) -> str:
+        text, position, output = self.pending, 0, []
+        while True:
+            hold = len(text) if final else self.held(text, position)
+            match = self.pattern and self.pattern.search(text, position)
+            # A match is kept if no longer entity may start before it
+            if not match or match.start() >= hold:
+                break
+            output.append(text[position : match.start()])
+            output.append(self.mapping[match.group()])
+            position = match.end()
+        output.append(text[position:hold])
+        self.pending = text[hold:]
+        return "".join(output)
+
+    def feed(self, text: str) -> str:
+        """The replaced text that can be sent so far"""
+        self.pending += text
+        return self.replace(final=False)
+
+    def flush(self) -> str:
+        """The rest of the replaced text"""
+        return self.replace(final=True)
+
+
+class ReplaceBackStream(
+    Op[tuple[AsyncIterable[Any], Mapping[str, str]], AsyncIterator[Any]]
+):
+    """Replace the entities of a streamed response by the real ones, the
+    chunks have `texts`, `with_texts`, `ends` and `text_chunk` methods (see
+    `app.lm.models.ChatCompletionChunk`)"""
+
+    streaming: ClassVar[bool] = True
+
+    async def call(
+        self, chunks: AsyncIterable[Any], mapping: Mapping[str, str]
+    ) -> AsyncIterator[Any]:
+        replacers: dict[int, Replacer] = {}
+        last = None
+        async for chunk in chunks:
+            last = chunk
+            if not mapping:
+                yield chunk
+                continue
+            texts = {
+                index: replacers.setdefault(index, Replacer(mapping)).feed(
+                    text
+                )
+                for index, text in chunk.texts().items()
+            }
+            for index in chunk.ends():
+                rest = replacers.pop(index, Replacer(mapping)).flush()
+                if rest and index in texts:
+                    texts[index] += rest
+                elif rest:
+                    yield chunk.text_chunk(index, rest)
+            yield chunk.with_texts(texts) if texts else chunk
+        # The text of unfinished choices
+        for index, replacer in replacers.items():
+            rest = replacer.flush()
+            if rest:
+                yield last.text_chunk(index, rest)
+
+
+replace_back_stream = ReplaceBackStream()
@@ -0,0 +1,116 @@
+"""
+Compiled plans of computations.
+A computation built from placeholder inputs (a template) is compiled once into
+an immutable plan: its ops in topological order with the indices of their
+arguments. Binding a plan to inputs builds a fresh computation without
+building and validating the graph again, e.g. a plan per handler class bound
+to each request.
+"""
+
+from typing import Any, ClassVar, Generic, TypeVar
+from dataclasses import dataclass
+from copy import deepcopy
+
+from app.ops.computation import (
+    Op,
+    Computation,
+    Const,
+    constructor,
+)
+
+B = TypeVar("B")
+
+
+class Placeholder(Op[tuple[()], B], Generic[B]):
+    """An input of a plan, replaced by a constant when the plan is bound"""
+
+    name: str
+    interned: ClassVar[bool] = True
+
+    async def call(self) -> B:
+        raise ValueError(f"The input {self.name} is not bound")
+
+
+def placeholder(name: str) -> Computation:
+    return Placeholder(name=name)()
+
+
+def copy_op(op: Op) -> Op:
+    """A copy of an op for a binding: the copy is shallow but the fields
+    excluded from its serialization (e.g. the `Faker` of `ReplaceMasking`)
+    are not shared, they are built again or copied if they were set"""
+    fresh = {
+        name: (
+            deepcopy(getattr(op, name))
+            if name in op.model_fields_set
+            else field.get_default(call_default_factory=True)
+        )
+        for name, field in type(op).model_fields.items()
+        if field.exclude
+    }
+    return op.model_copy(update=fresh)
+
+
+@dataclass(frozen=True)
+class Step:
+    """A node of a plan, its arguments are earlier steps"""
+
+    op: Op
+    args: tuple[int, ...]
+    # The name of the input, for placeholders
+    input: str | None = None
+
+
+@dataclass(frozen=True)
+class Plan:
+    """The steps of a computation in topological order, the root last"""
+
+    steps: tuple[Step, ...]
+    inputs: frozenset[str]
+
+    @classmethod
+    def compile(cls, template: Computation) -> "Plan":
+        nodes = template.order()
+        indices = {id(node): index for index, node in enumerate(nodes)}
+        steps = tuple(
+            Step(
+                op=node.op,
+                args=tuple(indices[id(arg)] for arg in node.args),
+                input=(
+                    node.op.name if isinstance(node.op, Placeholder) else None
+                ),
+            )
+            for node in nodes
+        )
+        return cls(
+            steps=steps,
+            inputs=frozenset(s.input for s in steps if s.input is not None),
+        )
+
+    def bind(self, **inputs: Any) -> Computation:
+        """A fresh computation with the placeholders replaced by the inputs,
+        the ops are copied as an evaluation sets their context (see
+        `copy_op`)"""
+        if inputs.keys() != self.inputs:
+            raise ValueError(
+                f"The inputs {sorted(inputs)} should be {sorted(self.inputs)}"
+            )
+        computation = constructor(Computation)
+        const = constructor(Const)
+        nodes: list[Computation] = []
+        for step in self.steps:
+            if step.input is None:
+                op = copy_op(step.op)
+            else:
+                op = const({"value": inputs[step.input]})
+            node = computation(
+                {"op": op, "args": [nodes[index] for index in step.args]}
+            )
+            for arg in node.args:
+                node._adopt(arg)
+            nodes.append(node)
+        root = nodes[-1]
+        # The steps are already in topological order, the order is reset if
+        # a node is mutated
+        root._order = {True: nodes}
+        return root
@@ -0,0 +1,143 @@
+"""
+Runs CPU-bound code in a bounded pool of worker processes, so that PDF
+parsing, rasterization, OCR or grammar parsing can use all the cores instead
+of holding the GIL of the event loop. Ops send their CPU-bound parts with
+`run_sync`, their I/O stays in threads (see app.ops.documents).
+Large byte buffers are passed through shared memory instead of being pickled.
+"""
+
+from typing import Any, Callable, TypeVar
+from dataclasses import dataclass
+from io import BytesIO
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+import os
+
+from anyio import CapacityLimiter, to_process
+from anyio.lowlevel import RunVar
+
+T = TypeVar("T")
+
+# The number of worker processes per event loop
+size: int = os.cpu_count() or 1
+# Buffers larger than this (in bytes) are passed through shared memory
+threshold: int = 1 << 16
+_limiter: RunVar[CapacityLimiter] = RunVar("ops_process_limiter")
+
+
+def limiter() -> CapacityLimiter:
+    """The process limiter of the current event loop"""
+    try:
+        return _limiter.get()
+    except LookupError:
+        _limiter.set(CapacityLimiter(size))
+        return _limiter.get()
+
+
+@dataclass
+class SharedBuffer:
+    """A byte buffer in shared memory"""
+
+    name: str
+    size: int
+    stream: bool
+
+    @classmethod
+    def share(cls, data: bytes, stream: bool) -> "SharedBuffer":
+        memory = SharedMemory(create=True, size=max(len(data), 1))
+        memory.buf[: len(data)] = data
+        buffer = cls(name=memory.name, size=len(data), stream=stream)
+        memory.close()
+        return buffer
+
+    def load(self) -> bytes | BytesIO:
+        memory = SharedMemory(name=self.name)
+        data = bytes(memory.buf[: self.size])
+        memory.close()
+        # Attaching registers the block in the resource tracker of this
+        # process, it is not the owner
+        resource_tracker.unregister(memory._name, "shared_memory")
+        return BytesIO(data) if self.stream else data
+
+    def unlink(self) -> None:
+        try:
+            memory = SharedMemory(name=self.name)
+        except FileNotFoundError:
+            return
+        memory.close()
+        memory.unlink()
+
+
+def pack(value: Any, buffers: list[SharedBuffer]) -> Any:
+    """Move the large buffers of a value to shared memory"""
+    if isinstance(value, BytesIO) and value.getbuffer().nbytes > threshold:
+        buffers.append(SharedBuffer.share(value.getvalue(), stream=True))
+        return buffers[-1]
+    elif isinstance(value, bytes) and len(value) > threshold:
+        buffers.append(SharedBuffer.share(value, stream=False))
+        return buffers[-1]
+    elif isinstance(value, list | tuple):
+        return type(value)(pack(v, buffers) for v in value)
+    elif isinstance(value, dict):
+        return {k: pack(v, buffers) for k, v in value.items()}
+    else:
+        return value
+
+
+def unpack(value: Any) -> Any:
+    """Load the buffers of a packed value"""
+    if isinstance(value, SharedBuffer):
+        return value.load()
+    elif isinstance(value, list | tuple):
+        return type(value)(unpack(v) for v in value)
+    elif isinstance(value, dict):
+        return {k: unpack(v) for k, v in value.items()}
+    else:
+        return value
+
+
+def _run(func: Callable[..., T], args: tuple) -> Any:
+    """Runs in the worker process"""
+    result = func(*unpack(args))
+    buffers: list[SharedBuffer] = []
+    packed = pack(result, buffers)
+    # The parent process owns the result buffers
+    for buffer in buffers:
+        resource_tracker.unregister(f"/{buffer.name}", "shared_memory")
+    return packed
+
+
+def shared(value: Any) -> list[SharedBuffer]:
+    """The buffers of a packed value"""
+    if isinstance(value, SharedBuffer):
+        return [value]
+    elif isinstance(value, list | tuple):
+        return [buffer for v in value for buffer in shared(v)]
+    elif isinstance(value, dict):
+        return [buffer for v in value.values() for buffer in shared(v)]
+    else:
+        return []
+
+
+async def run_sync(func: Callable[..., T], *args: Any) -> T:
+    """Call a picklable function in a worker process"""
+    buffers: list[SharedBuffer] = []
+    try:
+        packed = await to_process.run_sync(
+            _run, func, pack(args, buffers), limiter=limiter()
+        )
+        buffers += shared(packed)
+        return unpack(packed)
+    finally:
+        for buffer in buffers:
+            buffer.unlink()
+
+
+def stats() -> dict[str, int]:
+    """The process pool metrics of the current event loop"""
+    statistics = limiter().statistics()
+    return {
+        "size": int(statistics.total_tokens),
+        "running": statistics.borrowed_tokens,
+        "waiting": statistics.tasks_waiting,
+    }
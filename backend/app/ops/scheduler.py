@@ -0,0 +1,120 @@
+"""
+Bounds the concurrency of the ops of a computation.
+Limits are set per op class name or per resource tag (see `Op.resource`),
+plus a global cap on the ops using a resource (in-memory ops like `Tup` or
+`Getattr` are not capped). When slots are contended, ready ops with a higher
+`Op.priority` run first.
+"""
+
+from typing import Any, AsyncContextManager, AsyncIterator, TYPE_CHECKING
+from dataclasses import dataclass, field
+from contextlib import asynccontextmanager
+from itertools import count
+import asyncio
+import heapq
+
+if TYPE_CHECKING:
+    from app.ops.computation import Op
+
+
+class PrioritySemaphore:
+    """A semaphore waking up its highest priority waiter first"""
+
+    def __init__(self, value: int):
+        self.value = value
+        self.waiters: list[tuple[int, int, asyncio.Future]] = []
+        self.order = count()
+
+    @property
+    def waiting(self) -> int:
+        return sum(not future.done() for _, _, future in self.waiters)
+
+    async def acquire(self, priority: int = 0) -> None:
+        if self.value > 0 and not self.waiting:
+            self.value -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (-priority, next(self.order), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over, give it back
+                self.release()
+            raise
+
+    def release(self) -> None:
+        while self.waiters:
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                # Hand the slot over
+                future.set_result(None)
+                return
+        self.value += 1
+
+
+@dataclass
+class Scheduler:
+    """Limits the number of ops running at the same time"""
+
+    limit: int | None = None
+    # Limits by op class name or resource tag
+    limits: dict[str, int] = field(default_factory=dict)
+    semaphores: dict[str | None, PrioritySemaphore] = field(
+        default_factory=dict, init=False
+    )
+
+    def semaphore(self, key: str | None) -> PrioritySemaphore | None:
+        """The semaphore of a key, None is the global one"""
+        limit = self.limit if key is None else self.limits.get(key)
+        if limit is None:
+            return None
+        if key not in self.semaphores:
+            self.semaphores[key] = PrioritySemaphore(limit)
+        return self.semaphores[key]
+
+    def slot(self, op: "Op") -> AsyncContextManager[None]:
+        """Wait for a slot to run the op"""
+        keys = [type(op).__name__]
+        if op.resource:
+            keys += [op.resource, None]
+        return self.acquire(keys, op.priority)
+
+    def resource(
+        self, resource: str, priority: int = 0
+    ) -> AsyncContextManager[None]:
+        """Wait for a slot to use a resource for a part of an op (e.g. its
+        I/O and not its parsing)"""
+        return self.acquire([resource, None], priority)
+
+    @asynccontextmanager
+    async def acquire(
+        self, keys: list[str | None], priority: int = 0
+    ) -> AsyncIterator[None]:
+        """Wait for the semaphores of the keys"""
+        # Always acquire in the same order to avoid deadlocks
+        semaphores = [
+            semaphore
+            for key in keys
+            if (semaphore := self.semaphore(key)) is not None
+        ]
+        acquired = []
+        try:
+            for semaphore in semaphores:
+                await semaphore.acquire(priority)
+                acquired.append(semaphore)
+            yield
+        finally:
+            for semaphore in reversed(acquired):
+                semaphore.release()
+
+
+# The default scheduler, it can be overridden with a `scheduler` in the context
+scheduler = Scheduler(limits={"object_store": 16, "presidio": 8})
+
+
+def context_scheduler(context: dict[str, Any] | None) -> Scheduler:
+    """The scheduler to use given an evaluation context"""
+    if context and context.get("scheduler"):
+        return context["scheduler"]
+    return scheduler
@@ -1,3 +1,4 @@
+from typing import ClassVar
 import sqlmodel
 import app.models as am
 from app.ops.computation import Op
@@ -6,6 +7,8 @@ from app.ops.computation import Op
 class Session(Op[tuple[()], sqlmodel.Session]):
     """A basic template for ops"""
 
+    interned: ClassVar[bool] = True
+
     async def call(self) -> sqlmodel.Session:
         if "session" in self.context:
             return self.context["session"]
@@ -17,6 +20,10 @@ session = Session()
 
 
 class User(Op[sqlmodel.Session, am.UserOut]):
+    interned: ClassVar[bool] = True
+    resource: ClassVar[str] = "db"
+    blocking: ClassVar[bool] = True
+
     async def call(
         self, session: sqlmodel.Session, id: int
     ) -> am.UserOut | None:
@@ -32,6 +39,10 @@ user = User()
 
 
 class Event(Op[sqlmodel.Session, am.EventOut]):
+    interned: ClassVar[bool] = True
+    resource: ClassVar[str] = "db"
+    blocking: ClassVar[bool] = True
+
     async def call(
         self, session: sqlmodel.Session, id: int
     ) -> am.EventOut | None:
@@ -47,6 +58,10 @@ event = Event()
 
 
 class EventIdentifier(Op[sqlmodel.Session, am.EventIdentifierOut]):
+    interned: ClassVar[bool] = True
+    resource: ClassVar[str] = "db"
+    blocking: ClassVar[bool] = True
+
     async def call(
         self, session: sqlmodel.Session, id: str
     ) -> am.EventIdentifierOut | None:
@@ -1,3 +1,4 @@
+from typing import Any, ClassVar
 from sqlmodel import Session
 from app.services import crud
 from app.models import UserOut
@@ -10,6 +11,12 @@ class Setting(Op[tuple[Session, UserOut], str]):
     """An op to access setting by name"""
 
     name: str
+    # The settings are read once per evaluation, not memoized across
+    # evaluations: they change when the user writes them
+    interned: ClassVar[bool] = True
+    resource: ClassVar[str] = "db"
+    blocking: ClassVar[bool] = True
+    batch_size: ClassVar[int] = 16
 
     async def call(self, session: Session, user: UserOut) -> str:
         setting = crud.get_setting(
@@ -20,6 +27,31 @@ class Setting(Op[tuple[Session, UserOut], str]):
         else:
             return ""
 
+    def batch_key(self, session: Session, user: UserOut) -> Any:
+        # The settings of all the sessions bound to a database are read
+        # together, by a session of the batch
+        return (Setting, session.get_bind())
+
+    async def batch_call(self, calls: list[tuple[Op, tuple]]) -> list[str]:
+        names: dict[int, set[str]] = {}
+        for op, (_, user) in calls:
+            names.setdefault(user.id, set()).add(op.name)
+        with Session(calls[0][1][0].get_bind()) as session:
+            settings = {
+                owner_id: crud.get_settings(
+                    session=session,
+                    setting_names=sorted(setting_names),
+                    owner_id=owner_id,
+                )
+                for owner_id, setting_names in names.items()
+            }
+        return [
+            setting.content
+            if (setting := settings[user.id].get(op.name))
+            else ""
+            for op, (_, user) in calls
+        ]
+
 
 def openai_api_key(session: Session, user: UserOut) -> Computation[str]:
     return Setting(name="OPENAI_API_KEY")(session, user)
@@ -36,10 +68,20 @@ def anthropic_api_key(session: Session, user: UserOut) -> Computation[str]:
 class LMConfigSetting(Op[tuple[Session, UserOut], lmm.LMConfig]):
     name: str = "LM_CONFIG"
     override: lmm.LMConfig | None = None
+    interned: ClassVar[bool] = True
+    resource: ClassVar[str] = "db"
+    blocking: ClassVar[bool] = True
 
-    async def call(self, session: Session, user: UserOut) -> lmm.LMConfig:
-        if self.override:
-            return self.override
+    async def call(
+        self,
+        session: Session,
+        user: UserOut,
+        override: lmm.LMConfig | None = None,
+    ) -> lmm.LMConfig:
+        # The override is a field or a computed argument (e.g. in a plan)
+        override = override or self.override
+        if override:
+            return override
         setting = crud.get_setting(
             session=session, setting_name=self.name, owner_id=user.id
         )
@@ -50,12 +92,18 @@ class LMConfigSetting(Op[tuple[Session, UserOut], lmm.LMConfig]):
 
 
 def lm_config(
-    session: Session, user: UserOut, override: lmm.LMConfig | None = None
+    session: Session,
+    user: UserOut,
+    override: lmm.LMConfig | Computation[lmm.LMConfig | None] | None = None,
 ) -> Computation[lmm.LMConfig]:
+    if isinstance(override, Computation):
+        return LMConfigSetting()(session, user, override)
     return LMConfigSetting(override=override)(session, user)
 
 
 class LMApiKeys(Op[tuple[str, str, str], str]):
+    interned: ClassVar[bool] = True
+
     async def call(
         self, openai_api_key: str, mistral_api_key: str, anthropic_api_key: str
     ) -> lmm.LMApiKeys:
@@ -0,0 +1,258 @@
+"""
+Streamed values of computations.
+The call of a streaming op (see `Op.streaming`) is an async generator: its
+node is done as soon as the op is called and its value is a `Stream` that
+the nodes using it read while it is produced (e.g. the chunks of a language
+model response or the pages of a document as they are rasterized).
+- Each op reading a stream gets its own `Reader` when it starts, a reader
+  starts from the first item, the items are kept for the readers to come.
+  Once all the nodes using the stream have their reader, the items read by
+  all of them are dropped. The stream of the root is kept whole for the
+  caller of the evaluation.
+- The stream is produced as it is read: the fastest reader pulls the items
+  from the source, but no further than `buffer` items ahead of the slowest
+  open reader (back-pressure). A reader is open until it reaches the end or
+  is dropped.
+- An evaluation can hand a stream over (see `Emit`) to be read while it goes
+  on in the background, e.g. a response streamed to a client while its
+  chunks are accumulated and logged.
+- A stream waits at most `idle` seconds for an item (see
+  `Op.stream_timeout`) and its source is closed when it is given up.
+"""
+
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Generic,
+    TypeVar,
+)
+from dataclasses import dataclass, field
+from contextvars import ContextVar
+from weakref import WeakSet
+import asyncio
+
+from app.ops.computation import Op, Computation
+
+T = TypeVar("T")
+
+# The number of readers of the streaming nodes of the current evaluation
+_consumers: ContextVar[dict[int, int] | None] = ContextVar(
+    "consumers", default=None
+)
+# The sources of the streams given up, being closed
+_closing: set[asyncio.Task] = set()
+
+
+def consumers(order: list[Computation]) -> dict[int, int] | None:
+    """The number of readers of the streaming nodes of a graph (in
+    topological order): the arguments of the nodes using them. The root is
+    read by the caller of the evaluation, its readers are not known."""
+    streaming = {
+        id(computation)
+        for computation in order[:-1]
+        if computation.op.streaming
+    }
+    if not streaming:
+        return None
+    counts = dict.fromkeys(streaming, 0)
+    for computation in order:
+        for arg in computation.args:
+            if id(arg) in counts:
+                counts[id(arg)] += 1
+    return counts
+
+
+def expected(computation: Computation) -> int | None:
+    """The number of readers of a streaming node, None if not known"""
+    counts = _consumers.get()
+    return None if counts is None else counts.get(id(computation))
+
+
+@dataclass(eq=False)
+class Stream(Generic[T]):
+    """The items of an async iterator, read by any number of readers"""
+
+    source: AsyncIterator[T]
+    # How far ahead of the slowest open reader the source is pulled
+    buffer: int = 8
+    # The number of readers to come, None if not known (the items are kept)
+    expected: int | None = None
+    # The longest wait for an item in seconds
+    idle: float | None = None
+    items: list[T] = field(default_factory=list, init=False)
+    # The number of items dropped, read by all the readers
+    offset: int = field(default=0, init=False)
+    done: bool = field(default=False, init=False)
+    error: BaseException | None = field(default=None, init=False)
+    pulling: bool = field(default=False, init=False)
+    readers: WeakSet["Reader[T]"] = field(default_factory=WeakSet, init=False)
+    changed: asyncio.Event = field(default_factory=asyncio.Event, init=False)
+
+    def reader(self) -> "Reader[T]":
+        reader = Reader(self, self.offset)
+        self.readers.add(reader)
+        if self.expected:
+            self.expected -= 1
+        return reader
+
+    def __aiter__(self) -> "Reader[T]":
+        return self.reader()
+
+    def notify(self) -> None:
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    def lagging(self) -> bool:
+        """An open reader is `buffer` items behind"""
+        end = self.offset + len(self.items)
+        return any(
+            end - reader.position >= self.buffer for reader in self.readers
+        )
+
+    def trim(self) -> None:
+        """Drop the items read by all the readers, once they all came, and
+        close the source if they all left"""
+        if self.expected != 0:
+            return
+        end = self.offset + len(self.items)
+        position = min(
+            (reader.position for reader in self.readers), default=end
+        )
+        del self.items[: position - self.offset]
+        self.offset = position
+        if self.readers or self.done or self.pulling or self.error:
+            return
+        close = getattr(self.source, "aclose", None)
+        if close is not None:
+            task = asyncio.get_running_loop().create_task(close())
+            _closing.add(task)
+            task.add_done_callback(_closing.discard)
+        self.done = True
+
+    async def pull(self) -> None:
+        self.pulling = True
+        try:
+            async with asyncio.timeout(self.idle):
+                self.items.append(await anext(self.source))
+        except StopAsyncIteration:
+            self.done = True
+        except Exception as e:
+            self.error = e
+        except BaseException:
+            # The reader pulling was cancelled, the source is left unusable
+            self.error = RuntimeError("The stream was interrupted")
+            raise
+        finally:
+            self.pulling = False
+            self.notify()
+
+    async def next(self, reader: "Reader[T]") -> T:
+        while reader.position >= self.offset + len(self.items):
+            if self.error is not None:
+                raise self.error
+            if self.done:
+                raise StopAsyncIteration
+            if self.pulling or self.lagging():
+                await self.changed.wait()
+            else:
+                await self.pull()
+        item = self.items[reader.position - self.offset]
+        reader.position += 1
+        self.trim()
+        self.notify()
+        return item
+
+
+@dataclass(eq=False)
+class Reader(Generic[T]):
+    """A reader of a stream, from its first item kept"""
+
+    stream: Stream[T]
+    position: int = 0
+
+    def __aiter__(self) -> "Reader[T]":
+        return self
+
+    async def __anext__(self) -> T:
+        try:
+            return await self.stream.next(self)
+        except StopAsyncIteration:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        """Stop reading, the stream is not held back by this reader"""
+        if self not in self.stream.readers:
+            return
+        self.stream.readers.discard(self)
+        try:
+            self.stream.trim()
+        except RuntimeError:
+            # Dropped outside of the event loop
+            pass
+        self.stream.notify()
+
+    def __del__(self) -> None:
+        self.close()
+
+
+def readers(args: tuple) -> tuple:
+    """The arguments of an op starting, with a new reader of each stream"""
+    return tuple(
+        arg.reader() if isinstance(arg, Stream) else arg for arg in args
+    )
+
+
+class Collect(Op[tuple[AsyncIterable[T]], list[T]], Generic[T]):
+    """The items of a stream (or of any iterable) in a list"""
+
+    async def call(self, items: AsyncIterable[T] | Any) -> list[T]:
+        if isinstance(items, AsyncIterable):
+            return [item async for item in items]
+        return list(items)
+
+
+collect = Collect()
+
+
+class Emit(Op[tuple[T], T], Generic[T]):
+    """Hand the value over to the caller of `emitted` as soon as it is
+    computed, the evaluation goes on"""
+
+    async def call(self, value: T) -> T:
+        future = (self.context or {}).get("emitted")
+        if future is not None and not future.done():
+            future.set_result(value)
+        return value
+
+
+emit = Emit()
+
+# The evaluations running in the background
+_running: set[asyncio.Task] = set()
+
+
+async def emitted(
+    evaluate: Callable[[asyncio.Future], Awaitable[Any]],
+) -> tuple[Any, asyncio.Task]:
+    """Start an evaluation in the background and wait for the value it
+    emits. `evaluate` evaluates a computation with the future it is given as
+    `emitted` context. Returns the value and the task of the evaluation."""
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    task = loop.create_task(evaluate(future))
+    _running.add(task)
+    task.add_done_callback(_running.discard)
+    try:
+        await asyncio.wait({future, task}, return_when=asyncio.FIRST_COMPLETED)
+    except BaseException:
+        task.cancel()
+        raise
+    if future.done():
+        return future.result(), task
+    # The evaluation failed (or ended) before emitting
+    task.result()
+    raise RuntimeError("The evaluation emitted nothing")
@@ -0,0 +1,86 @@
+"""
+Runs blocking ops (see `Op.blocking`) in a bounded pool of worker threads,
+so that sync DB queries, object store calls or document parsing do not stall
+the event loop.
+"""
+
+from typing import Any, Callable, Coroutine, TypeVar, TYPE_CHECKING
+from contextlib import AsyncExitStack
+from weakref import WeakKeyDictionary
+
+from anyio import CapacityLimiter, Lock, to_thread
+from anyio.lowlevel import RunVar
+from sqlalchemy.orm import Session
+
+if TYPE_CHECKING:
+    from app.ops.computation import Op
+
+T = TypeVar("T")
+
+# The number of worker threads per event loop
+size: int = 16
+_limiter: RunVar[CapacityLimiter] = RunVar("ops_thread_limiter")
+# DB sessions are not thread-safe, blocking ops sharing one are serialized
+_locks: WeakKeyDictionary[Session, Lock] = WeakKeyDictionary()
+
+
+def limiter() -> CapacityLimiter:
+    """The thread limiter of the current event loop"""
+    try:
+        return _limiter.get()
+    except LookupError:
+        _limiter.set(CapacityLimiter(size))
+        return _limiter.get()
+
+
+def lock(session: Session) -> Lock:
+    if session not in _locks:
+        _locks[session] = Lock()
+    return _locks[session]
+
+
+def complete(call: Callable[..., Coroutine], *args: Any) -> Any:
+    """Run the call of a blocking op, it should never suspend"""
+    coroutine = call(*args)
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coroutine.close()
+    raise RuntimeError("A blocking op cannot await asynchronous operations")
+
+
+def sessions(args: tuple) -> dict[int, Session]:
+    """The sessions among the arguments (or the calls of a batch)"""
+    result = {}
+    for arg in args:
+        if isinstance(arg, Session):
+            result[id(arg)] = arg
+        elif isinstance(arg, list | tuple):
+            result.update(sessions(tuple(arg)))
+    return result
+
+
+async def run_sync(func: Callable[..., T], *args: Any) -> T:
+    """Call a sync function in a worker thread"""
+    return await to_thread.run_sync(func, *args, limiter=limiter())
+
+
+async def run_blocking(op: "Op", *args: Any, method: str = "call") -> Any:
+    """Call the op (or another method) in a worker thread"""
+    async with AsyncExitStack() as stack:
+        for session in sessions(args).values():
+            await stack.enter_async_context(lock(session))
+        return await to_thread.run_sync(
+            complete, getattr(op, method), *args, limiter=limiter()
+        )
+
+
+def stats() -> dict[str, int]:
+    """The thread pool metrics of the current event loop"""
+    statistics = limiter().statistics()
+    return {
+        "size": int(statistics.total_tokens),
+        "running": statistics.borrowed_tokens,
+        "waiting": statistics.tasks_waiting,
+    }
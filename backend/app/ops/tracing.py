@@ -0,0 +1,386 @@
+"""
+Tracing of computations: each evaluated node records a span with its queue
+wait (from its arguments being ready to its execution starting), its
+execution time, the size of its result and its exception.
+Traces are sampled and exported in the OpenTelemetry (OTLP/JSON) format to a
+file or to a collector. `app.ops.dot.dot` can annotate a graph with a trace.
+"""
+
+from typing import (
+    Any,
+    AsyncIterator,
+    Iterator,
+    Protocol,
+    Sequence,
+    TYPE_CHECKING,
+)
+from dataclasses import dataclass, field
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from io import BytesIO
+from time import time_ns
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+
+from pydantic import BaseModel
+
+from app.core.config import settings
+from app.services import clients
+
+if TYPE_CHECKING:
+    from app.ops.computation import Computation
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def result_size(value: Any) -> int:
+    """An estimate of the size of a result in bytes"""
+    if isinstance(value, str | bytes):
+        return len(value)
+    elif isinstance(value, BytesIO):
+        return value.getbuffer().nbytes
+    elif isinstance(value, BaseModel):
+        try:
+            return len(value.model_dump_json())
+        except Exception:
+            return sys.getsizeof(value)
+    elif isinstance(value, list | tuple | set):
+        return sum(result_size(v) for v in value)
+    elif isinstance(value, dict):
+        return sum(result_size(v) for v in value.values())
+    else:
+        return sys.getsizeof(value)
+
+
+@dataclass(eq=False)
+class Span:
+    """A timed operation, times are in ns since the epoch"""
+
+    trace: "Trace"
+    name: str
+    parent: "Span | None" = None
+    # The spans of the arguments
+    links: list["Span"] = field(default_factory=list)
+    span_id: str = field(default_factory=lambda: os.urandom(8).hex())
+    # When the arguments are ready
+    ready: int = field(default_factory=time_ns)
+    start: int | None = None
+    end: int | None = None
+    size: int | None = None
+    error: BaseException | None = None
+    attributes: dict[str, str | int | float | bool] = field(
+        default_factory=dict
+    )
+
+    @property
+    def queue_wait(self) -> int:
+        return (self.start or self.end or self.ready) - self.ready
+
+    @property
+    def duration(self) -> int:
+        return (self.end or self.ready) - (self.start or self.ready)
+
+    def to_otlp(self) -> dict[str, Any]:
+        attributes = self.attributes | {
+            "arena.queue_wait_ns": self.queue_wait,
+            "arena.cached": self.start is None and self.error is None,
+        }
+        if self.size is not None:
+            attributes["arena.result_size"] = self.size
+        span: dict[str, Any] = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.ready),
+            "endTimeUnixNano": str(self.end or time_ns()),
+            "attributes": [
+                {"key": key, "value": otlp_value(value)}
+                for key, value in attributes.items()
+            ],
+            "links": [
+                {"traceId": self.trace.trace_id, "spanId": link.span_id}
+                for link in self.links
+            ],
+            "status": {"code": 1},
+        }
+        if self.parent:
+            span["parentSpanId"] = self.parent.span_id
+        if self.error is not None:
+            span["status"] = {"code": 2, "message": str(self.error)}
+            span["events"] = [
+                {
+                    "name": "exception",
+                    "timeUnixNano": str(self.end or time_ns()),
+                    "attributes": [
+                        {
+                            "key": "exception.type",
+                            "value": otlp_value(type(self.error).__name__),
+                        },
+                        {
+                            "key": "exception.message",
+                            "value": otlp_value(str(self.error)),
+                        },
+                    ],
+                }
+            ]
+        return span
+
+
+def otlp_value(value: str | int | float | bool) -> dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    elif isinstance(value, int):
+        return {"intValue": str(value)}
+    elif isinstance(value, float):
+        return {"doubleValue": value}
+    else:
+        return {"stringValue": str(value)}
+
+
+@dataclass(eq=False)
+class Trace:
+    """The spans of one or more evaluations"""
+
+    name: str
+    trace_id: str = field(default_factory=lambda: os.urandom(16).hex())
+    root: Span = field(init=False)
+    spans: list[Span] = field(default_factory=list, init=False)
+    # The spans of the nodes of the computations
+    nodes: dict["Computation", Span] = field(default_factory=dict, init=False)
+
+    def __post_init__(self) -> None:
+        self.root = Span(self, self.name)
+        self.root.start = self.root.ready
+
+    def span(
+        self,
+        name: str,
+        parent: Span | None = None,
+        links: Sequence[Span] = (),
+    ) -> Span:
+        span = Span(self, name, parent or self.root, list(links))
+        self.spans.append(span)
+        return span
+
+    def node(self, computation: "Computation", parent: Span) -> Span:
+        """The span of a computation node, its arguments are done"""
+        span = self.span(
+            type(computation.op).__name__,
+            parent,
+            [self.nodes[arg] for arg in computation.args if arg in self.nodes],
+        )
+        if computation.op.resource:
+            span.attributes["arena.resource"] = computation.op.resource
+        self.nodes[computation] = span
+        return span
+
+    def critical_path(self, computation: "Computation") -> list["Computation"]:
+        """The chain of nodes, from the computation down, each waiting for
+        its last argument to end"""
+        path = []
+        node: Computation | None = computation
+        while node is not None and node in self.nodes:
+            path.append(node)
+            node = max(
+                (arg for arg in node.args if arg in self.nodes),
+                key=lambda arg: self.nodes[arg].end or 0,
+                default=None,
+            )
+        return path
+
+    def to_otlp(self) -> dict[str, Any]:
+        """An OTLP/JSON export request"""
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            {
+                                "key": "service.name",
+                                "value": otlp_value(settings.PROJECT_NAME),
+                            }
+                        ]
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": __name__},
+                            "spans": [
+                                span.to_otlp()
+                                for span in [self.root] + self.spans
+                            ],
+                        }
+                    ],
+                }
+            ]
+        }
+
+
+class Exporter(Protocol):
+    def export(self, trace: Trace) -> None: ...
+
+
+@dataclass
+class FileExporter:
+    """Appends traces as OTLP/JSON lines (as the collector file exporter)"""
+
+    path: str
+
+    def export(self, trace: Trace) -> None:
+        with open(self.path, "a") as f:
+            f.write(json.dumps(trace.to_otlp()) + "\n")
+
+
+@dataclass
+class CollectorExporter:
+    """Sends traces to an OpenTelemetry collector over OTLP/HTTP, in the
+    background"""
+
+    endpoint: str
+    timeout: float = 5.0
+    sending: set[asyncio.Task] = field(default_factory=set, init=False)
+
+    async def send(self, trace: Trace) -> None:
+        try:
+            response = await clients.client(self.endpoint).post(
+                f"{self.endpoint.rstrip('/')}/v1/traces",
+                json=trace.to_otlp(),
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+        except Exception as e:
+            logger.warning(f"The trace {trace.trace_id} was not sent: {e}")
+
+    def export(self, trace: Trace) -> None:
+        task = asyncio.get_running_loop().create_task(self.send(trace))
+        self.sending.add(task)
+        task.add_done_callback(self.sending.discard)
+
+
+@dataclass
+class Tracer:
+    """Samples and exports traces"""
+
+    sample_rate: float = 0.0
+    exporters: list[Exporter] = field(default_factory=list)
+
+    def trace(self, name: str) -> Trace | None:
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return Trace(name)
+        return None
+
+    def export(self, trace: Trace) -> None:
+        for exporter in self.exporters:
+            try:
+                exporter.export(trace)
+            except Exception as e:
+                logger.warning(
+                    f"The trace {trace.trace_id} was not exported: {e}"
+                )
+
+
+def default_exporters() -> list[Exporter]:
+    exporters: list[Exporter] = []
+    if settings.TRACING_FILE:
+        exporters.append(FileExporter(settings.TRACING_FILE))
+    if settings.TRACING_ENDPOINT:
+        exporters.append(CollectorExporter(settings.TRACING_ENDPOINT))
+    return exporters
+
+
+# The default tracer, it can be overridden with a `tracer` in the context
+tracer = Tracer(settings.TRACING_SAMPLE_RATE, default_exporters())
+
+# The trace of the current scope
+_trace: ContextVar[Trace | None] = ContextVar("trace", default=None)
+# The span of the current node
+_span: ContextVar[Span | None] = ContextVar("span", default=None)
+
+
+def context_tracer(context: dict[str, Any] | None) -> Tracer:
+    """The tracer to use given an evaluation context"""
+    if context and context.get("tracer"):
+        return context["tracer"]
+    return tracer
+
+
+@asynccontextmanager
+async def traced(
+    name: str, tracer: Tracer | None = None
+) -> AsyncIterator[Trace | None]:
+    """Collect the evaluations of the scope (e.g. a request) in one trace,
+    if sampled"""
+    tracer = tracer or context_tracer(None)
+    trace = _trace.get()
+    if trace is not None:
+        yield trace
+        return
+    trace = tracer.trace(name)
+    token = _trace.set(trace)
+    try:
+        yield trace
+    except BaseException as e:
+        if trace:
+            trace.root.error = e
+        raise
+    finally:
+        _trace.reset(token)
+        if trace:
+            trace.root.end = time_ns()
+            tracer.export(trace)
+
+
+@contextmanager
+def evaluation(context: dict[str, Any]) -> Iterator[Span | None]:
+    """The span of an evaluation, set in its context as `span`"""
+    trace = _trace.get()
+    tracer = context_tracer(context)
+    if trace is not None:
+        span = trace.span("evaluate")
+    elif (trace := tracer.trace("evaluate")) is not None:
+        span = trace.root
+    else:
+        yield None
+        return
+    span.start = span.ready
+    context["span"] = span
+    try:
+        yield span
+    except BaseException as e:
+        span.error = e
+        raise
+    finally:
+        span.end = time_ns()
+        if span is trace.root:
+            tracer.export(trace)
+
+
+@contextmanager
+def node(computation: "Computation") -> Iterator[Span | None]:
+    """The span of a node, its arguments are done"""
+    context = computation.op.context
+    parent = context.get("span") if context else None
+    if parent is None:
+        yield None
+        return
+    span = parent.trace.node(computation, parent)
+    token = _span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.error = e
+        raise
+    finally:
+        span.end = time_ns()
+        _span.reset(token)
+
+
+def started() -> None:
+    """The current node starts executing"""
+    span = _span.get()
+    if span is not None:
+        span.start = time_ns()
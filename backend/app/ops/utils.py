@@ -1,4 +1,4 @@
-from typing import TypeVar, Generic, Callable, TypeVarTuple, Any
+from typing import TypeVar, Generic, Callable, TypeVarTuple, Any, ClassVar
 from random import random, randint
 
 from app.ops.computation import Op, Computation, Const
@@ -16,6 +16,8 @@ def cst(value: B) -> Computation[B]:
 class Var(Op[tuple[B], B], Generic[B]):
     """A variable op"""
 
+    interned: ClassVar[bool] = True
+
     async def call(self, value: B) -> B:
         return value
 
@@ -27,6 +29,8 @@ def var(name: str, value: B) -> Computation[B]:
 class Tup(Op[*As, tuple[*As]], Generic[*As]):
     """A tuple op"""
 
+    interned: ClassVar[bool] = True
+
     async def call(self, *tup: *As) -> tuple[*As]:
         return tup
 
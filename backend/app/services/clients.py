@@ -0,0 +1,98 @@
+"""
+Long-lived HTTP clients shared by the services.
+Opening a client per request costs a TCP and TLS handshake every time: the
+services get a pooled client per origin (scheme, host and port) instead,
+keeping connections alive between requests (and multiplexing them over HTTP/2
+when the h2 package is installed).
+Connections belong to an event loop: the clients (and the async client of the
+broker store) are per event loop and closed with it, by the FastAPI lifespan or
+the Celery worker shutdown.
+"""
+
+from typing import Any
+from importlib.util import find_spec
+
+import httpx
+from anyio.lowlevel import RunVar
+from redis.asyncio import Redis
+
+from app.core.config import settings
+
+# HTTP/2 needs the optional h2 package (httpx[http2])
+http2: bool = settings.HTTP2 and find_spec("h2") is not None
+limits = httpx.Limits(
+    max_connections=settings.HTTP_MAX_CONNECTIONS,
+    max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+)
+_clients: RunVar[dict[str, httpx.AsyncClient]] = RunVar("http_clients")
+_store: RunVar[Redis | None] = RunVar("store_client", None)
+
+
+def clients() -> dict[str, httpx.AsyncClient]:
+    """The clients of the current event loop, by origin"""
+    try:
+        return _clients.get()
+    except LookupError:
+        _clients.set({})
+        return _clients.get()
+
+
+def origin(url: str | httpx.URL) -> str:
+    url = httpx.URL(url)
+    return f"{url.scheme}://{url.netloc.decode('ascii')}"
+
+
+def client(url: str | httpx.URL) -> httpx.AsyncClient:
+    """The pooled client of the origin of the url, the timeouts are set per
+    request"""
+    pool = clients()
+    key = origin(url)
+    if key not in pool or pool[key].is_closed:
+        pool[key] = httpx.AsyncClient(http2=http2, limits=limits)
+    return pool[key]
+
+
+def store() -> Redis:
+    """The async client of the broker store (redis) of the current event
+    loop, the store calls do not block the loop"""
+    client = _store.get()
+    if client is None:
+        client = Redis.from_url(str(settings.CELERY_STORE_URI))
+        _store.set(client)
+    return client
+
+
+async def aclose() -> None:
+    """Close the clients of the current event loop"""
+    pool = clients()
+    while pool:
+        _, client = pool.popitem()
+        await client.aclose()
+    store = _store.get()
+    if store is not None:
+        _store.set(None)
+        await store.aclose()
+
+
+def _connections(client: httpx.AsyncClient) -> dict[str, int]:
+    # The connection pool of httpcore behind the default transport
+    pool: Any = getattr(client._transport, "_pool", None)
+    connections = list(getattr(pool, "connections", []))
+    idle = sum(1 for connection in connections if connection.is_idle())
+    return {
+        "connections": len(connections),
+        "active": len(connections) - idle,
+        "idle": idle,
+        "requests": len(getattr(pool, "_requests", [])),
+    }
+
+
+def stats() -> dict[str, Any]:
+    """The pool metrics of the current event loop, by origin"""
+    return {
+        "http2": http2,
+        "max_connections": limits.max_connections,
+        "max_keepalive_connections": limits.max_keepalive_connections,
+        "pools": {key: _connections(c) for key, c in clients().items()},
+    }
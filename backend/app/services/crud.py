@@ -89,6 +89,22 @@ def get_setting(
     return setting
 
 
+def get_settings(
+    *, session: Session, setting_names: list[str], owner_id: int
+) -> dict[str, Setting]:
+    """The latest settings of an owner by name, in a single query"""
+    statement = (
+        select(Setting)
+        .where(Setting.owner_id == owner_id)
+        .where(Setting.name.in_(setting_names))
+        .order_by(desc(Setting.timestamp))
+    )
+    settings: dict[str, Setting] = {}
+    for setting in session.exec(statement):
+        settings.setdefault(setting.name, setting)
+    return settings
+
+
 # Events
 def get_event(*, session: Session, event_id: int) -> Event:
     db_event = session.get(Event, event_id)
@@ -105,6 +121,28 @@ def create_event(
     return db_event
 
 
+def create_events(
+    *, session: Session, events_in: list[EventCreate], owner_ids: list[int]
+) -> list[Event]:
+    """Create events in a single transaction, they are refreshed with a
+    single query"""
+    db_events = [
+        Event.model_validate(event_in, update={"owner_id": owner_id})
+        for event_in, owner_id in zip(events_in, owner_ids, strict=True)
+    ]
+    session.add_all(db_events)
+    session.flush()
+    ids = [db_event.id for db_event in db_events]
+    session.commit()
+    statement = (
+        select(Event)
+        .where(Event.id.in_(ids))
+        .execution_options(populate_existing=True)
+    )
+    events = {db_event.id: db_event for db_event in session.exec(statement)}
+    return [events[id] for id in ids]
+
+
 def delete_event(*, session: Session, event_id: int) -> None:
     db_event = get_event(session=session, event_id=event_id)
     session.delete(db_event)
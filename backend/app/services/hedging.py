@@ -0,0 +1,137 @@
+"""
+Hedged and fallback requests to alternative models: the request goes to a
+first model, and to the next one if the first fails (fallback) or has not
+responded within a percentile of its latencies (hedging). The first
+successful response wins, the other requests are cancelled.
+Hedging cuts the tail latency (a slow request is raced by another) for the
+price of the duplicate requests sent, a small share of them at a high
+percentile.
+"""
+
+from typing import Any, Awaitable, Callable, Sequence
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from threading import Lock
+from time import perf_counter
+import asyncio
+
+import numpy as np
+
+from app.core.config import settings
+from app.services import Response
+
+
+@dataclass
+class Latencies:
+    """The recent latencies of the successful requests, by model"""
+
+    window: int = settings.LM_LATENCY_WINDOW
+    # The percentiles are not estimated on fewer latencies
+    min_samples: int = settings.LM_HEDGE_MIN_SAMPLES
+    latencies: dict[str, deque[float]] = field(default_factory=dict)
+    _lock: Lock = field(default_factory=Lock)
+
+    def record(self, model: str, latency: float) -> None:
+        with self._lock:
+            if model not in self.latencies:
+                self.latencies[model] = deque(maxlen=self.window)
+            self.latencies[model].append(latency)
+
+    def percentile(self, model: str, q: float) -> float | None:
+        with self._lock:
+            values = list(self.latencies.get(model, ()))
+        if len(values) < self.min_samples:
+            return None
+        return float(np.percentile(values, q))
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        with self._lock:
+            models = {m: list(v) for m, v in self.latencies.items()}
+        return {
+            model: {
+                "count": len(values),
+                "p50": float(np.percentile(values, 50)),
+                "p99": float(np.percentile(values, 99)),
+            }
+            for model, values in models.items()
+            if values
+        }
+
+
+latencies = Latencies()
+counts: Counter[str] = Counter()
+
+
+def succeeded(task: asyncio.Task) -> bool:
+    return (
+        not task.cancelled()
+        and task.exception() is None
+        and task.result().status_code == 200
+    )
+
+
+async def race(
+    models: Sequence[str],
+    call: Callable[[str], Awaitable[Response[Any]]],
+    hedge_percentile: float | None = None,
+    fallback: bool = True,
+) -> Response[Any]:
+    """The first successful response of `call` on the models, tried in
+    order: the next model is called when the last one called fails (if
+    `fallback`) or is slower than the percentile of its latencies (if
+    `hedge_percentile`). The last failure is returned (or raised) if all
+    the models fail."""
+    tasks: dict[asyncio.Task, str] = {}
+    remaining = list(models)
+
+    def start() -> str:
+        model = remaining.pop(0)
+        tasks[asyncio.ensure_future(call(model))] = model
+        return model
+
+    model = start()
+    try:
+        last: asyncio.Task | None = None
+        while tasks:
+            # The delay before hedging the last model called
+            delay = None
+            if remaining and hedge_percentile is not None:
+                delay = latencies.percentile(model, hedge_percentile)
+            done, _ = await asyncio.wait(
+                tasks, timeout=delay, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                counts["hedged"] += 1
+                model = start()
+                continue
+            for task in done:
+                last = task
+                if succeeded(task):
+                    if tasks[task] != models[0]:
+                        counts["won_by_alternative"] += 1
+                    return task.result()
+                del tasks[task]
+            if remaining and fallback:
+                counts["fell_back"] += 1
+                model = start()
+        assert last is not None
+        return last.result()
+    finally:
+        # The losers are cancelled
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def timed(model: str, call: Awaitable[Response[Any]]) -> Response[Any]:
+    """The response of a call, its latency recorded if it succeeded (and
+    was not cached)"""
+    start = perf_counter()
+    response = await call
+    if response.status_code == 200 and not response.cached:
+        latencies.record(model, perf_counter() - start)
+    return response
+
+
+def stats() -> dict[str, Any]:
+    return {**counts, "latencies": latencies.stats()}
@@ -1,23 +1,243 @@
-from typing import Mapping, Sequence, Any
+from typing import (
+    AsyncIterator,
+    Mapping,
+    Sequence,
+    Any,
+    Callable,
+    ClassVar,
+    Protocol,
+    TypeVar,
+)
 from dataclasses import dataclass, field
-from functools import cached_property
+from contextlib import aclosing
+from functools import cached_property, lru_cache
+from uuid import uuid4
+import hashlib
+import json
 
-import httpx
+from pydantic import BaseModel
 
+from app.core.config import settings
+from app.ops.cache import Cache, LRUCache
+from app.ops.computation import JsonSerializable
 from app.lm.models import (
     LMApiKeys,
     ChatCompletionResponse,
     ChatCompletionRequest,
+    ChatCompletionChunk,
 )
 from app.lm.models import openai, mistral, anthropic
-from app.services import Service, Request, Response
+from app.services import (
+    Service,
+    Request,
+    Response,
+    clients,
+    hedging,
+    rate_limits,
+)
+from app.services.service import Req, Res
+from app.services.routing import routes
+
+
+def served(response: Response[Any]) -> Response[Any]:
+    """A deep copy of a cached response to serve (the steps using it may
+    mutate it), with a fresh identifier: the identifiers of the responses
+    are unique (they identify the events)"""
+    response = response.model_copy(update={"cached": True}, deep=True)
+    content = response.content
+    if getattr(content, "id", None) is not None:
+        content.id = f"{content.id}-{uuid4().hex[:12]}"
+    return response
+
+
+class Store(Protocol):
+    """The subset of the redis.asyncio.Redis interface used by
+    StoreResponseCache"""
+
+    async def get(self, name: str) -> bytes | str | None: ...
+
+    async def set(
+        self, name: str, value: str, ex: int | None = None
+    ) -> Any: ...
+
+
+@dataclass
+class ResponseCache:
+    """Caches the responses of chat completions, keyed on the canonical
+    request, the endpoint and the user (or the API key) sending it.
+    Only deterministic requests are cached, unless the caller opts in."""
+
+    cache: Cache = field(
+        default_factory=lambda: LRUCache(
+            maxsize=settings.LM_CACHE_SIZE, ttl=settings.LM_CACHE_TTL
+        )
+    )
+
+    @staticmethod
+    def deterministic(req: BaseModel) -> bool:
+        return (
+            getattr(req, "temperature", None) == 0
+            and getattr(req, "n", None) in (None, 1)
+            and not getattr(req, "stream", None)
+        )
+
+    @staticmethod
+    def key(request: Request[Any], scope: str) -> str:
+        content = request.content.model_dump(
+            mode="json", exclude_none=True, exclude={"stream"}
+        )
+        canonical = json.dumps(content, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(
+            f"{request.url}\n{scope}\n{canonical}".encode()
+        ).hexdigest()
+
+    async def load(self, key: str) -> tuple[bool, Any]:
+        return await self.cache.get(key)
+
+    async def save(self, key: str, response: Response[Any]) -> None:
+        # The response returned to the caller may be mutated by the next
+        # steps (e.g. the masking replaced back), the cache keeps a copy
+        await self.cache.set(key, response.model_copy(deep=True))
+
+    async def get(self, key: str) -> Response[Any] | None:
+        found, response = await self.load(key)
+        return served(response) if found else None
+
+    async def set(self, key: str, response: Response[Any]) -> None:
+        if response.status_code == 200:
+            await self.save(key, response)
+
+    def stats(self) -> dict[str, int]:
+        return self.cache.stats()
+
+
+@dataclass
+class StoreResponseCache(ResponseCache):
+    """A response cache shared by the API and the workers through the
+    broker store, with the async client of the event loop. The store evicts
+    the entries (e.g. with a maxmemory policy) and expires them."""
+
+    store: Callable[[], Store] = clients.store
+    ttl: int | None = int(settings.LM_CACHE_TTL)
+    prefix: str = "arena:lm:"
+
+    async def load(self, key: str) -> tuple[bool, Any]:
+        value = await self.store().get(f"{self.prefix}{key}")
+        if value is None:
+            self.cache.misses += 1
+            return False, None
+        self.cache.hits += 1
+        return True, JsonSerializable.from_json_dict(json.loads(value))
+
+    async def save(self, key: str, response: Response[Any]) -> None:
+        await self.store().set(
+            f"{self.prefix}{key}",
+            json.dumps(JsonSerializable.to_json_dict(response)),
+            ex=self.ttl,
+        )
+
+
+def default_response_cache() -> ResponseCache | None:
+    """The response cache configured by `LM_CACHE`"""
+    if settings.LM_CACHE == "memory":
+        return ResponseCache()
+    if settings.LM_CACHE == "store":
+        # Shared by the API and the workers
+        return StoreResponseCache()
+    return None
+
+
+# The response cache of the process, None to disable it
+response_cache: ResponseCache | None = default_response_cache()
+
+
+@dataclass
+class LanguageModel(Service[Req, Res]):
+    # The name of the provider in the routes (see app.services.routing)
+    provider: ClassVar[str]
+    api_key: str = ""
+    # The caller opted in to cache non-deterministic requests
+    cache_opt_in: bool = False
+    # The user the cached responses are isolated to, the API key if None
+    cache_scope: str | None = None
+
+    def has_model(self, model: str) -> bool:
+        """Return True if the model is from the provider"""
+        return routes.provider(model) == self.provider
+
+    def scope(self) -> str:
+        if self.cache_scope is not None:
+            return f"user:{self.cache_scope}"
+        return f"key:{hashlib.sha256(self.api_key.encode()).hexdigest()}"
+
+    async def call(self, req: Req) -> Response[Res]:
+        cache = response_cache
+        if cache is None or not (
+            self.cache_opt_in or cache.deterministic(req)
+        ):
+            return await self.limited(req)
+        key = cache.key(self.request(req), self.scope())
+        response = await cache.get(key)
+        if response is None:
+            response = await self.limited(req)
+            await cache.set(key, response)
+        return response
+
+    async def limited(self, req: Req) -> Response[Res]:
+        """The response of the provider, once the rate limits of the API
+        key allow the request (see app.services.rate_limits)"""
+        limiter = rate_limits.rate_limiter
+        if limiter is None:
+            return await super().call(req)
+        tokens = limiter.estimate(req)
+        taken = await limiter.acquire(self.provider, self.api_key, tokens)
+        try:
+            response = await super().call(req)
+        except BaseException:
+            await limiter.release(taken)
+            raise
+        await limiter.update(self.provider, self.api_key, tokens, response)
+        return response
+
+    async def stream(self, req: Req) -> AsyncIterator[Any]:
+        limiter = rate_limits.rate_limiter
+        if limiter is None:
+            async with aclosing(super().stream(req)) as stream:
+                async for data in stream:
+                    yield data
+            return
+        tokens = limiter.estimate(req)
+        taken = await limiter.acquire(self.provider, self.api_key, tokens)
+        streamed = False
+        used: dict[str, int] = {}
+        try:
+            async with aclosing(super().stream(req)) as stream:
+                async for data in stream:
+                    streamed = True
+                    rate_limits.stream_usage(data, used)
+                    yield data
+        except BaseException:
+            # The budget is given back if nothing was generated
+            if not streamed:
+                await limiter.release(taken)
+            raise
+        finally:
+            if streamed:
+                # The estimate is corrected with the usage reported by the
+                # stream, if any
+                await limiter.update(
+                    self.provider,
+                    self.api_key,
+                    tokens,
+                    used=rate_limits.streamed(used),
+                )
 
 
 @dataclass
 class OpenAI(
-    Service[openai.ChatCompletionRequest, openai.ChatCompletionResponse]
+    LanguageModel[openai.ChatCompletionRequest, openai.ChatCompletionResponse]
 ):
-    api_key: str = ""
+    provider: ClassVar[str] = "openai"
     url: str = "https://api.openai.com/v1"
     models: tuple[str] = openai.MODELS
 
@@ -38,10 +258,6 @@ class OpenAI(
     def from_any(self, a: Any) -> openai.ChatCompletionResponse:
         return openai.ChatCompletionResponse.model_validate(a)
 
-    def has_model(self, model: str) -> bool:
-        """Return True if the model is from OpenAI"""
-        return "gpt-4" in model or "gpt-3" in model or model in self.models
-
     async def openai_chat_completion(
         self, ccc: openai.ChatCompletionRequest
     ) -> Response[openai.ChatCompletionResponse]:
@@ -56,15 +272,40 @@ class OpenAI(
         return Response(
             status_code=response.status_code,
             headers=response.headers,
-            content=response.content.to_chat_completion_response(),
+            # No content if the request failed
+            content=(
+                response.content
+                and response.content.to_chat_completion_response()
+            ),
+            cached=response.cached,
         )
 
+    async def openai_chat_completion_stream(
+        self, ccc: openai.ChatCompletionRequest
+    ) -> AsyncIterator[openai.ChatCompletionChunk]:
+        stream = self.stream(ccc.model_copy(update={"stream": True}))
+        async with aclosing(stream):
+            async for data in stream:
+                yield openai.ChatCompletionChunk.model_validate(data)
+
+    async def chat_completion_stream(
+        self, ccc: ChatCompletionRequest
+    ) -> AsyncIterator[ChatCompletionChunk]:
+        chunks = self.openai_chat_completion_stream(
+            openai.ChatCompletionRequest.from_chat_completion_request(ccc)
+        )
+        async with aclosing(chunks):
+            async for chunk in chunks:
+                yield chunk.to_chat_completion_chunk()
+
 
 @dataclass
 class Mistral(
-    Service[mistral.ChatCompletionRequest, mistral.ChatCompletionResponse]
+    LanguageModel[
+        mistral.ChatCompletionRequest, mistral.ChatCompletionResponse
+    ]
 ):
-    api_key: str = ""
+    provider: ClassVar[str] = "mistral"
     url: str = "https://api.mistral.ai"
     models: tuple[str] = mistral.MODELS
 
@@ -85,15 +326,6 @@ class Mistral(
     def from_any(self, a: Any) -> mistral.ChatCompletionResponse:
         return mistral.ChatCompletionResponse.model_validate(a)
 
-    def has_model(self, model: str) -> bool:
-        """Return True if the model is from Mistral"""
-        return (
-            "open-mistral-" in model
-            or "open-mixtral-" in model
-            or "mistral-" in model
-            or model in self.models
-        )
-
     async def mistral_chat_completion(
         self, ccc: mistral.ChatCompletionRequest
     ) -> Response[mistral.ChatCompletionResponse]:
@@ -108,15 +340,40 @@ class Mistral(
         return Response(
             status_code=response.status_code,
             headers=response.headers,
-            content=response.content.to_chat_completion_response(),
+            # No content if the request failed
+            content=(
+                response.content
+                and response.content.to_chat_completion_response()
+            ),
+            cached=response.cached,
         )
 
+    async def mistral_chat_completion_stream(
+        self, ccc: mistral.ChatCompletionRequest
+    ) -> AsyncIterator[mistral.ChatCompletionChunk]:
+        stream = self.stream(ccc.model_copy(update={"stream": True}))
+        async with aclosing(stream):
+            async for data in stream:
+                yield mistral.ChatCompletionChunk.model_validate(data)
+
+    async def chat_completion_stream(
+        self, ccc: ChatCompletionRequest
+    ) -> AsyncIterator[ChatCompletionChunk]:
+        chunks = self.mistral_chat_completion_stream(
+            mistral.ChatCompletionRequest.from_chat_completion_request(ccc)
+        )
+        async with aclosing(chunks):
+            async for chunk in chunks:
+                yield chunk.to_chat_completion_chunk()
+
 
 @dataclass
 class Anthropic(
-    Service[anthropic.ChatCompletionRequest, anthropic.ChatCompletionResponse]
+    LanguageModel[
+        anthropic.ChatCompletionRequest, anthropic.ChatCompletionResponse
+    ]
 ):
-    api_key: str = ""
+    provider: ClassVar[str] = "anthropic"
     url: str = "https://api.anthropic.com"
     models: tuple[str] = anthropic.MODELS
 
@@ -140,10 +397,6 @@ class Anthropic(
     def from_any(self, a: Any) -> anthropic.ChatCompletionResponse:
         return anthropic.ChatCompletionResponse.model_validate(a)
 
-    def has_model(self, model: str) -> bool:
-        """Return True if the model is from Anthropic"""
-        return "claude-" in model or model in self.models
-
     async def anthropic_chat_completion(
         self, ccc: anthropic.ChatCompletionRequest
     ) -> Response[anthropic.ChatCompletionRequest]:
@@ -158,51 +411,138 @@ class Anthropic(
         return Response(
             status_code=response.status_code,
             headers=response.headers,
-            content=response.content.to_chat_completion_response(),
+            # No content if the request failed
+            content=(
+                response.content
+                and response.content.to_chat_completion_response()
+            ),
+            cached=response.cached,
         )
 
+    async def anthropic_chat_completion_stream(
+        self, ccc: anthropic.ChatCompletionRequest
+    ) -> AsyncIterator[anthropic.StreamEvent]:
+        stream = self.stream(ccc.model_copy(update={"stream": True}))
+        async with aclosing(stream):
+            async for data in stream:
+                yield anthropic.StreamEvent.model_validate(data)
 
-@dataclass
-class LanguageModels:
-    api_keys: LMApiKeys
-    timeout: httpx.Timeout = field(
-        default_factory=lambda: httpx.Timeout(30.0, read=None)
+    async def chat_completion_stream(
+        self, ccc: ChatCompletionRequest
+    ) -> AsyncIterator[ChatCompletionChunk]:
+        message: anthropic.ChatCompletionResponse | None = None
+        events = self.anthropic_chat_completion_stream(
+            anthropic.ChatCompletionRequest.from_chat_completion_request(ccc)
+        )
+        async with aclosing(events):
+            async for event in events:
+                if event.type == "error":
+                    raise ValueError(f"The stream failed: {event.error}")
+                if event.type == "message_start":
+                    message = event.message
+                if message is not None:
+                    chunk = event.to_chat_completion_chunk(message)
+                    if chunk is not None:
+                        yield chunk
+
+
+L = TypeVar("L", bound=LanguageModel)
+
+
+@lru_cache(maxsize=1024)
+def _service(
+    cls: type[L], api_key: str, cache_opt_in: bool, cache_scope: str | None
+) -> L:
+    return cls(
+        api_key=api_key, cache_opt_in=cache_opt_in, cache_scope=cache_scope
     )
 
-    @cached_property
-    def openai(self) -> OpenAI:
-        return OpenAI(
-            api_key=self.api_keys.openai_api_key, timeout=self.timeout
-        )
 
-    @cached_property
-    def mistral(self) -> Mistral:
-        return Mistral(
-            api_key=self.api_keys.mistral_api_key, timeout=self.timeout
-        )
+def service(
+    cls: type[L],
+    api_key: str,
+    cache_opt_in: bool = False,
+    cache_scope: str | None = None,
+) -> L:
+    """The service of a provider for an API key (and cache options), built
+    once"""
+    # The arguments are positional to share the cache entries
+    return _service(cls, api_key, cache_opt_in, cache_scope)
 
-    @cached_property
-    def anthropic(self) -> Anthropic:
-        return Anthropic(
-            api_key=self.api_keys.anthropic_api_key, timeout=self.timeout
+
+@dataclass
+class LanguageModels:
+    """The services of the providers, the requests are routed by model"""
+
+    api_keys: LMApiKeys
+    cache_opt_in: bool = False
+    cache_scope: str | None = None
+
+    providers: ClassVar[dict[str, type[LanguageModel]]] = {
+        "openai": OpenAI,
+        "mistral": Mistral,
+        "anthropic": Anthropic,
+    }
+
+    def service(self, provider: str) -> LanguageModel:
+        return service(
+            self.providers[provider],
+            getattr(self.api_keys, f"{provider}_api_key"),
+            self.cache_opt_in,
+            self.cache_scope,
         )
 
-    @cached_property
-    def services(self) -> Sequence[Service]:
-        return [self.openai, self.mistral, self.anthropic]
+    def route(
+        self, req: ChatCompletionRequest
+    ) -> tuple[LanguageModel, ChatCompletionRequest]:
+        """The service of the model and the request, with the actual model
+        if it is an alias"""
+        provider, model = routes.route(req.model)
+        if model != req.model:
+            req = req.model_copy(update={"model": model})
+        return self.service(provider), req
 
     def request(
         self, req: ChatCompletionRequest
     ) -> Request[ChatCompletionRequest]:
-        for service in self.services:
-            if service.has_model(req.model):
-                return service.request(req=req)
-        raise ValueError(req.model)
+        service, req = self.route(req)
+        return service.request(req=req)
 
     async def chat_completion(
         self, ccc: ChatCompletionRequest
     ) -> Response[ChatCompletionResponse]:
-        for service in self.services:
-            if service.has_model(ccc.model):
-                return await service.chat_completion(ccc=ccc)
-        raise ValueError(ccc.model)
+        service, ccc = self.route(ccc)
+        return await hedging.timed(
+            str(ccc.model), service.chat_completion(ccc=ccc)
+        )
+
+    async def chat_completion_race(
+        self,
+        ccc: ChatCompletionRequest,
+        alternative_models: Sequence[str],
+        hedge_percentile: float | None = None,
+        fallback: bool = True,
+    ) -> Response[ChatCompletionResponse]:
+        """The response of the model of the request or of an alternative
+        model, whichever succeeds first (see app.services.hedging)"""
+        # The actual models, the latencies are recorded by model
+        models = [
+            routes.route(model)[1]
+            for model in [ccc.model, *alternative_models]
+        ]
+        return await hedging.race(
+            models,
+            lambda model: self.chat_completion(
+                ccc.model_copy(update={"model": model})
+            ),
+            hedge_percentile,
+            fallback,
+        )
+
+    async def chat_completion_stream(
+        self, ccc: ChatCompletionRequest
+    ) -> AsyncIterator[ChatCompletionChunk]:
+        service, ccc = self.route(ccc)
+        async with aclosing(service.chat_completion_stream(ccc=ccc)) as chunks:
+            async for chunk in chunks:
+                yield chunk
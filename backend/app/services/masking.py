@@ -1,10 +1,10 @@
 from typing import Mapping, Sequence, Literal, Any
 from dataclasses import dataclass
+from bisect import bisect_right
 from pydantic import BaseModel, Field, TypeAdapter
 
-import httpx
-
 from app.core.config import settings
+from app.services import clients
 
 
 class AnalyzerRequest(BaseModel):
@@ -36,6 +36,8 @@ class AnalyzerResponseItem(BaseModel):
 
 
 analyzer_response = TypeAdapter(Sequence[AnalyzerResponseItem])
+# Between the texts analyzed in one request
+SEPARATOR = "\n\n"
 
 
 @dataclass
@@ -45,16 +47,43 @@ class Analyzer:
     async def analyze(
         self, req: AnalyzerRequest
     ) -> Sequence[AnalyzerResponseItem]:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url=f"{self.url}",
-                json=req.model_dump(exclude_none=True),
-                timeout=1000,
-            )
-
-            return analyzer_response.validate_python(
-                response.raise_for_status().json()
-            )
+        response = await clients.client(self.url).post(
+            url=f"{self.url}",
+            json=req.model_dump(exclude_none=True),
+            timeout=settings.MASKING_TIMEOUT,
+        )
+        return analyzer_response.validate_python(
+            response.raise_for_status().json()
+        )
+
+    async def analyze_texts(
+        self, req: AnalyzerRequest, texts: Sequence[str]
+    ) -> list[list[AnalyzerResponseItem]]:
+        """The analysis of each text, in a single request with the options of
+        `req`: the texts are joined and the entities found are split back
+        (those spanning a separator are dropped)"""
+        starts = []
+        start = 0
+        for text in texts:
+            starts.append(start)
+            start += len(text) + len(SEPARATOR)
+        analysis = await self.analyze(
+            req.model_copy(update={"text": SEPARATOR.join(texts)})
+        )
+        results: list[list[AnalyzerResponseItem]] = [[] for _ in texts]
+        for item in analysis:
+            index = bisect_right(starts, item.start) - 1
+            offset = starts[index]
+            if item.end <= offset + len(texts[index]):
+                results[index].append(
+                    item.model_copy(
+                        update={
+                            "start": item.start - offset,
+                            "end": item.end - offset,
+                        }
+                    )
+                )
+        return results
 
 
 class Replace(BaseModel):
@@ -147,12 +176,11 @@ class Anonymizer:
     url: str = f"http://{settings.PRESIDIO_ANONYMIZER_SERVER}:{settings.PRESIDIO_ANONYMIZER_PORT}/anonymize"
 
     async def anonymize(self, req: AnonymizerRequest) -> AnonymizerResponse:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url=f"{self.url}",
-                json=req.model_dump(exclude_none=True),
-                timeout=1000,
-            )
-            return AnonymizerResponse.model_validate(
-                response.raise_for_status().json()
-            )
+        response = await clients.client(self.url).post(
+            url=f"{self.url}",
+            json=req.model_dump(exclude_none=True),
+            timeout=settings.MASKING_TIMEOUT,
+        )
+        return AnonymizerResponse.model_validate(
+            response.raise_for_status().json()
+        )
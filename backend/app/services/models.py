@@ -16,3 +16,5 @@ class Response(BaseModel, Generic[C]):
     status_code: int = 500
     headers: Mapping[str, str] = Field(default_factory=lambda: {})
     content: C | None = None
+    # The response was served from a cache
+    cached: bool = False
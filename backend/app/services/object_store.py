@@ -45,6 +45,10 @@ class Bucket:
             else:
                 raise err
 
+    def etag(self, name: str) -> str:
+        """The entity tag of an object, it changes with its content"""
+        return store.stat_object(bucket_name=self.name, object_name=name).etag
+
     def list(
         self, prefix: str | None = None, recursive: bool = False
     ) -> list[str]:
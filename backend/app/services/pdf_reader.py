@@ -46,6 +46,38 @@ class PDFReader:
 
         return text
     
+    def page_numbers(
+        self,
+        pdf_data: BinaryIO,
+        start_page: int = 0,
+        end_page: int | None = None,
+    ) -> list[int]:
+        doc = pymupdf.Document(stream=pdf_data)
+        return [
+            page_num
+            for page_num in range(doc.page_count)
+            if page_num >= start_page and (not end_page or page_num < end_page)
+        ]
+
+    @staticmethod
+    def png(page: pymupdf.Page) -> BinaryIO:
+        pix = page.get_pixmap(dpi=96, colorspace="csRGB", alpha=False)
+        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+        buffer = BytesIO()
+        img.save(buffer, format="PNG", optimize=True, compress_level=0)
+        buffer.seek(0)
+        return buffer
+
+    def pages_as_png(
+        self, pdf_data: BinaryIO, pages: list[int]
+    ) -> list[tuple[int, BinaryIO]]:
+        """Some pages, to rasterize the pages by chunks: the document is
+        opened once per chunk"""
+        doc = pymupdf.Document(stream=pdf_data)
+        return [
+            (page_num, self.png(doc.load_page(page_num))) for page_num in pages
+        ]
+
     def as_pngs(
         self,
         pdf_data: BinaryIO,
@@ -63,12 +95,7 @@ class PDFReader:
 
         for page_num in pages:
             page = doc.load_page(page_num)
-            pix = page.get_pixmap(dpi=96, colorspace="csRGB", alpha=False)     
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            buffer = BytesIO()
-            img.save(buffer, format="PNG", optimize=True, compress_level=0)
-            buffer.seek(0)
-            page_buffer_pairs.append((page_num, buffer))  
+            page_buffer_pairs.append((page_num, self.png(page)))
         return page_buffer_pairs
 
 
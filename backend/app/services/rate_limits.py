@@ -0,0 +1,389 @@
+"""
+Client-side rate limiting of the language model providers: the requests and
+tokens per minute of each (provider, API key) are budgeted with token
+buckets, the requests wait (a bounded time) for their budget instead of
+being rejected by the provider with a 429.
+The tokens of a request are estimated before the call and corrected with
+the actual usage after. The limits are learned from the rate limit headers
+of the responses (the defaults are set with `LM_RATE_LIMITS`).
+The budget is reserved in the order of the requests (the later ones wait
+longer) and given back if a request fails.
+The buckets and the learned limits are shared by the processes (e.g. uvicorn
+and Celery workers) through a redis store, or local to the process.
+Disabled by default, enabled with `LM_RATE_LIMIT`.
+"""
+
+from typing import Any, Callable, Mapping, Protocol, Sequence
+from collections import Counter
+from dataclasses import dataclass, field
+from threading import Lock
+from time import monotonic
+import hashlib
+import math
+
+import anyio
+from pydantic import BaseModel
+from redis.asyncio import Redis
+
+from app.core.config import settings
+from app.services import Response, clients
+
+# The limits per minute in the headers (OpenAI, then Anthropic)
+LIMIT_HEADERS = {
+    "requests": (
+        "x-ratelimit-limit-requests",
+        "anthropic-ratelimit-requests-limit",
+    ),
+    "tokens": (
+        "x-ratelimit-limit-tokens",
+        "anthropic-ratelimit-tokens-limit",
+    ),
+}
+# A bucket: its key, capacity, refill rate (per second) and the amount taken
+Bucket = tuple[str, float, float, float]
+
+
+class RateLimited(RuntimeError):
+    """The budget of an API key was not available in time"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(
+            f"The rate limits of {name} are exceeded,"
+            f" retry in {retry_after:.0f}s"
+        )
+        self.retry_after = retry_after
+
+
+class Buckets(Protocol):
+    async def take(self, buckets: Sequence[Bucket], max_wait: float) -> float:
+        """Reserve the amounts from all the buckets and return the time to
+        wait until they are available (the levels can go negative, the
+        later reservations wait longer). Nothing is reserved if the wait
+        would be longer than `max_wait`."""
+        ...
+
+    async def give(self, bucket: Bucket) -> None:
+        """Give an amount back to a bucket (or take it if negative, even
+        if not available)"""
+        ...
+
+    async def limits(self, name: str) -> dict[str, float]:
+        """The limits learned for an API key"""
+        ...
+
+    async def learn(self, name: str, limits: Mapping[str, float]) -> None: ...
+
+
+@dataclass
+class LocalBuckets:
+    """Buckets local to the process, a stand-in for the store"""
+
+    levels: dict[str, tuple[float, float]] = field(default_factory=dict)
+    learned: dict[str, dict[str, float]] = field(default_factory=dict)
+    _lock: Lock = field(default_factory=Lock)
+
+    def level(self, key: str, capacity: float, rate: float) -> float:
+        level, time = self.levels.get(key, (capacity, monotonic()))
+        return min(capacity, level + (monotonic() - time) * rate)
+
+    async def take(self, buckets: Sequence[Bucket], max_wait: float) -> float:
+        with self._lock:
+            levels = [self.level(*bucket[:3]) for bucket in buckets]
+            wait = max(
+                max(amount - level, 0.0) / rate
+                for (_, _, rate, amount), level in zip(
+                    buckets, levels, strict=True
+                )
+            )
+            if wait <= max_wait:
+                for (key, _, _, amount), level in zip(
+                    buckets, levels, strict=True
+                ):
+                    self.levels[key] = (level - amount, monotonic())
+            return wait
+
+    async def give(self, bucket: Bucket) -> None:
+        key, capacity, rate, amount = bucket
+        with self._lock:
+            level = self.level(key, capacity, rate)
+            self.levels[key] = (min(capacity, level + amount), monotonic())
+
+    async def limits(self, name: str) -> dict[str, float]:
+        with self._lock:
+            return dict(self.learned.get(name, {}))
+
+    async def learn(self, name: str, limits: Mapping[str, float]) -> None:
+        with self._lock:
+            self.learned.setdefault(name, {}).update(limits)
+
+
+# The buckets are updated atomically in the store, with its clock
+TAKE = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local max_wait = tonumber(ARGV[1])
+local levels, wait = {}, 0
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[3 * i - 1])
+    local rate = tonumber(ARGV[3 * i])
+    local amount = tonumber(ARGV[3 * i + 1])
+    local state = redis.call('HMGET', key, 'level', 'time')
+    local level = tonumber(state[1]) or capacity
+    local last = tonumber(state[2]) or now
+    levels[i] = math.min(capacity, level + (now - last) * rate)
+    wait = math.max(wait, (amount - levels[i]) / rate)
+end
+if wait <= max_wait then
+    for i, key in ipairs(KEYS) do
+        local capacity = tonumber(ARGV[3 * i - 1])
+        local rate = tonumber(ARGV[3 * i])
+        local level = levels[i] - tonumber(ARGV[3 * i + 1])
+        redis.call('HSET', key, 'level', level, 'time', now)
+        redis.call('EXPIRE', key, math.ceil((capacity - level) / rate) + 1)
+    end
+end
+return tostring(wait)
+"""
+GIVE = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local capacity, rate = tonumber(ARGV[1]), tonumber(ARGV[2])
+local state = redis.call('HMGET', KEYS[1], 'level', 'time')
+local level = tonumber(state[1]) or capacity
+local last = tonumber(state[2]) or now
+level = math.min(capacity, level + (now - last) * rate + tonumber(ARGV[3]))
+redis.call('HSET', KEYS[1], 'level', level, 'time', now)
+redis.call('EXPIRE', KEYS[1], math.ceil((capacity - level) / rate) + 1)
+return 0
+"""
+
+
+@dataclass
+class StoreBuckets:
+    """Buckets (and learned limits) shared by the processes through a redis
+    store, with the async client of the event loop"""
+
+    store: Callable[[], Redis] = clients.store
+    prefix: str = "arena:rate:"
+    # The learned limits are refreshed by the responses
+    limits_ttl: int = 24 * 3600
+
+    async def take(self, buckets: Sequence[Bucket], max_wait: float) -> float:
+        take = self.store().register_script(TAKE)
+        return float(
+            await take(
+                keys=[f"{self.prefix}{bucket[0]}" for bucket in buckets],
+                args=[
+                    max_wait,
+                    *(value for bucket in buckets for value in bucket[1:]),
+                ],
+            )
+        )
+
+    async def give(self, bucket: Bucket) -> None:
+        key, *args = bucket
+        give = self.store().register_script(GIVE)
+        await give(keys=[f"{self.prefix}{key}"], args=args)
+
+    async def limits(self, name: str) -> dict[str, float]:
+        limits = await self.store().hgetall(f"{self.prefix}{name}:limits")
+        return {key.decode(): float(value) for key, value in limits.items()}
+
+    async def learn(self, name: str, limits: Mapping[str, float]) -> None:
+        key = f"{self.prefix}{name}:limits"
+        async with self.store().pipeline() as pipeline:
+            pipeline.hset(key, mapping=dict(limits))
+            pipeline.expire(key, self.limits_ttl)
+            await pipeline.execute()
+
+
+def usage(content: Any) -> int | None:
+    """The tokens used by a request, from its response"""
+    usage = getattr(content, "usage", None)
+    if usage is None:
+        return None
+    total = getattr(usage, "total_tokens", None)
+    if total is None:
+        # Anthropic
+        total = (getattr(usage, "input_tokens", 0) or 0) + (
+            getattr(usage, "output_tokens", 0) or 0
+        )
+    return total
+
+
+def stream_usage(data: Any, used: dict[str, int]) -> None:
+    """Collect the usage reported by an event of a stream: the usage of
+    the last chunk (OpenAI, Mistral), or the input tokens of the message
+    start and the output tokens of the message delta (Anthropic)"""
+    if not isinstance(data, Mapping):
+        return
+    usage = data.get("usage") or (data.get("message") or {}).get("usage")
+    if isinstance(usage, Mapping):
+        for name, value in usage.items():
+            if isinstance(value, int):
+                used[name] = value
+
+
+def streamed(used: Mapping[str, int]) -> int | None:
+    """The tokens used by a stream, from its collected usage"""
+    if "total_tokens" in used:
+        return used["total_tokens"]
+    if "input_tokens" in used or "output_tokens" in used:
+        return used.get("input_tokens", 0) + used.get("output_tokens", 0)
+    return None
+
+
+def header_limits(headers: Mapping[str, str]) -> dict[str, float]:
+    """The limits per minute sent by the provider, if any"""
+    limits = {}
+    for limit, names in LIMIT_HEADERS.items():
+        for name in names:
+            if headers.get(name, "").isdigit() and int(headers[name]):
+                limits[limit] = float(headers[name])
+    return limits
+
+
+@dataclass
+class RateLimiter:
+    buckets: Buckets = field(default_factory=LocalBuckets)
+    # The default limits per minute of the providers, until the actual
+    # ones are learned
+    limits: Mapping[str, Mapping[str, float]] = field(
+        default_factory=lambda: settings.LM_RATE_LIMITS
+    )
+    # Requests not served in time fail
+    max_wait: float = settings.LM_RATE_LIMIT_MAX_WAIT
+    # The period of the limits, in seconds
+    period: float = 60.0
+    # The tokens of the completions, when the request sets no maximum
+    completion_tokens: int = 512
+    waiting: Counter[str] = field(default_factory=Counter)
+    counts: Counter[str] = field(default_factory=Counter)
+    wait_time: Counter[str] = field(default_factory=Counter)
+
+    @staticmethod
+    def name(provider: str, api_key: str) -> str:
+        digest = hashlib.sha256(api_key.encode()).hexdigest()[:16]
+        return f"{provider}:{digest}"
+
+    def estimate(self, req: BaseModel) -> int:
+        """The tokens of a request (prompt and completion), roughly 4
+        characters per prompt token"""
+        prompt = len(req.model_dump_json(exclude_none=True)) // 4
+        completion = getattr(req, "max_tokens", None)
+        return prompt + (completion or self.completion_tokens)
+
+    def bucket(
+        self,
+        name: str,
+        learned: Mapping[str, float],
+        limit: str,
+        amount: float,
+    ) -> Bucket:
+        provider = name.split(":")[0]
+        capacity = learned.get(
+            limit, self.limits.get(provider, {}).get(limit, math.inf)
+        )
+        return (f"{name}:{limit}", capacity, capacity / self.period, amount)
+
+    async def acquire(
+        self, provider: str, api_key: str, tokens: int
+    ) -> list[Bucket]:
+        """Wait for the budget of a request and return the buckets taken
+        from (to release them if the request fails). The budget is
+        reserved: the requests are served in order, a large request is not
+        overtaken by smaller ones."""
+        name = self.name(provider, api_key)
+        learned = await self.buckets.limits(name)
+        buckets = [
+            self.bucket(name, learned, "requests", 1),
+            self.bucket(name, learned, "tokens", tokens),
+        ]
+        # The unlimited buckets and the amounts over the capacity (they
+        # would never be available) are left out
+        buckets = [
+            (key, capacity, rate, min(amount, capacity))
+            for key, capacity, rate, amount in buckets
+            if capacity < math.inf
+        ]
+        if not buckets:
+            return []
+        wait = await self.buckets.take(buckets, self.max_wait)
+        if wait > self.max_wait:
+            self.counts[f"{provider}:rejected"] += 1
+            raise RateLimited(name, wait)
+        self.counts[f"{provider}:requests"] += 1
+        if wait > 0:
+            self.waiting[provider] += 1
+            try:
+                await anyio.sleep(wait)
+            except BaseException:
+                # Cancelled while waiting
+                await self.release(buckets)
+                raise
+            finally:
+                self.waiting[provider] -= 1
+            self.counts[f"{provider}:waited"] += 1
+            self.wait_time[provider] += wait
+        return buckets
+
+    async def release(self, buckets: Sequence[Bucket]) -> None:
+        """Give back the budget of a request that failed"""
+        with anyio.CancelScope(shield=True):
+            for bucket in buckets:
+                await self.buckets.give(bucket)
+
+    async def update(
+        self,
+        provider: str,
+        api_key: str,
+        tokens: int,
+        response: Response[Any] | None = None,
+        used: int | None = None,
+    ) -> None:
+        """Learn the limits from the response and correct the estimated
+        tokens with the actual usage (of the response if not given, e.g. by
+        a stream)"""
+        name = self.name(provider, api_key)
+        if response is not None:
+            limits = header_limits(response.headers)
+            if limits:
+                await self.buckets.learn(name, limits)
+            if used is None:
+                used = usage(response.content)
+        if used is None:
+            return
+        learned = await self.buckets.limits(name)
+        bucket = self.bucket(name, learned, "tokens", tokens - used)
+        if bucket[1] < math.inf:
+            await self.buckets.give(bucket)
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        providers = {key.split(":")[0] for key in self.counts} | set(
+            self.waiting
+        )
+        return {
+            provider: {
+                "waiting": self.waiting[provider],
+                "requests": self.counts[f"{provider}:requests"],
+                "waited": self.counts[f"{provider}:waited"],
+                "rejected": self.counts[f"{provider}:rejected"],
+                "wait_time": self.wait_time[provider],
+            }
+            for provider in sorted(providers)
+        }
+
+
+def default_rate_limiter() -> RateLimiter | None:
+    """The rate limiter configured by `LM_RATE_LIMIT`, disabled by
+    default"""
+    if settings.LM_RATE_LIMIT == "memory":
+        return RateLimiter()
+    if settings.LM_RATE_LIMIT == "store":
+        # Shared by the API and the workers
+        return RateLimiter(buckets=StoreBuckets())
+    return None
+
+
+# The rate limiter of the process, None to disable it
+rate_limiter: RateLimiter | None = default_rate_limiter()
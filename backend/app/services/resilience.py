@@ -0,0 +1,239 @@
+"""
+Resilience of the calls to the services: the requests failing transiently
+(rate limited, overloaded upstream, dropped connection) are retried after a
+jittered exponential backoff, or the delay the provider asks for (the
+`Retry-After` or rate limit reset headers).
+Each upstream (by origin, i.e. per provider) has a circuit breaker: after
+consecutive failures it opens and the requests fail fast (instead of piling
+up on a degraded upstream) until a probe request succeeds.
+"""
+
+from typing import Any, Awaitable, Callable, Literal, Mapping
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from threading import Lock
+from time import time
+import random
+import re
+
+import anyio
+import httpx
+
+from app.core.config import settings
+
+# Retried: timeouts, conflicts, rate limits and upstream errors (529 is the
+# overloaded status of Anthropic)
+RETRY_STATUSES = frozenset({408, 409, 429, 500, 502, 503, 504, 529})
+# The upstream is degraded, the rate limits are per API key
+FAILURE_STATUSES = frozenset({500, 502, 503, 504, 529})
+# The request did not reach the upstream or the connection dropped
+RETRY_ERRORS = (
+    httpx.ConnectError,
+    httpx.ConnectTimeout,
+    httpx.RemoteProtocolError,
+)
+DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+class Unavailable(RuntimeError):
+    """The circuit of a service is open, its requests fail fast"""
+
+    def __init__(self, origin: str, retry_after: float):
+        super().__init__(
+            f"The service {origin} is unavailable,"
+            f" retry in {retry_after:.0f}s"
+        )
+        self.origin = origin
+        self.retry_after = retry_after
+
+
+def duration(value: str) -> float | None:
+    """A delay in seconds, or a duration (e.g. 1m30s or 250ms)"""
+    try:
+        return float(value)
+    except ValueError:
+        parts = DURATION.findall(value)
+        if not parts:
+            return None
+        return sum(float(number) * UNITS[unit] for number, unit in parts)
+
+
+def until(value: str) -> float | None:
+    """The delay until a date (an HTTP date or RFC 3339 timestamp)"""
+    try:
+        date = datetime.fromisoformat(value)
+    except ValueError:
+        try:
+            date = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max(0.0, date.timestamp() - time())
+
+
+def retry_after(headers: Mapping[str, str]) -> float | None:
+    """The delay asked for by the provider, if any"""
+    if "retry-after-ms" in headers:
+        delay = duration(headers["retry-after-ms"])
+        if delay is not None:
+            return delay / 1000
+    if "retry-after" in headers:
+        value = headers["retry-after"]
+        delay = duration(value) if value.isdigit() else until(value)
+        if delay is not None:
+            return delay
+    # The limits exhausted reset (OpenAI with durations, Anthropic with dates)
+    delays = []
+    for limit in ["requests", "tokens"]:
+        if headers.get(f"x-ratelimit-remaining-{limit}") == "0":
+            delays.append(
+                duration(headers.get(f"x-ratelimit-reset-{limit}", ""))
+            )
+        if headers.get(f"anthropic-ratelimit-{limit}-remaining") == "0":
+            delays.append(
+                until(headers.get(f"anthropic-ratelimit-{limit}-reset", ""))
+            )
+    delays = [delay for delay in delays if delay is not None]
+    return max(delays) if delays else None
+
+
+@dataclass
+class Retry:
+    # The retries after the first attempt
+    retries: int = settings.LM_RETRIES
+    backoff: float = settings.LM_RETRY_BACKOFF
+    # Longer delays are not waited for, the failure is returned
+    max_delay: float = settings.LM_RETRY_MAX_DELAY
+
+    def delay(
+        self, attempt: int, headers: Mapping[str, str] | None = None
+    ) -> float | None:
+        """The delay before retrying the attempt, None not to retry"""
+        if attempt >= self.retries:
+            return None
+        delay = retry_after(headers or {})
+        if delay is None:
+            # Full jitter, the clients retrying do not synchronize
+            delay = random.uniform(0, self.backoff * 2**attempt)
+        return delay if delay <= self.max_delay else None
+
+
+@dataclass
+class CircuitBreaker:
+    # The consecutive failures opening the circuit
+    threshold: int = settings.LM_BREAKER_THRESHOLD
+    # The time the circuit stays open before a probe request
+    reset: float = settings.LM_BREAKER_RESET
+    state: Literal["closed", "open", "half_open"] = "closed"
+    failures: int = 0
+    opened: float = 0.0
+    counts: dict[str, int] = field(
+        default_factory=lambda: {"trips": 0, "rejected": 0}
+    )
+    # The requests run in the event loops of different threads
+    _lock: Lock = field(default_factory=Lock)
+
+    def allow(self) -> float | None:
+        """None if a request can go, else the time to wait"""
+        with self._lock:
+            if self.state == "closed":
+                return None
+            wait = self.opened + self.reset - time()
+            if self.state == "open" and wait <= 0:
+                # A single probe request goes
+                self.state = "half_open"
+                return None
+            self.counts["rejected"] += 1
+            return max(wait, 0.0)
+
+    def success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or (
+                self.state == "closed" and self.failures >= self.threshold
+            ):
+                self.state = "open"
+                self.opened = time()
+                self.counts["trips"] += 1
+
+    def abandon(self) -> None:
+        """The request ended without a response (e.g. it was cancelled): a
+        probe reopens the circuit for another cooldown"""
+        with self._lock:
+            if self.state == "half_open":
+                self.state = "open"
+                self.opened = time()
+
+    def record(self, status_code: int) -> None:
+        if status_code in FAILURE_STATUSES:
+            self.failure()
+        else:
+            self.success()
+
+    def stats(self) -> dict[str, Any]:
+        return {"state": self.state, "failures": self.failures, **self.counts}
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = Lock()
+
+
+def breaker(origin: str) -> CircuitBreaker:
+    """The circuit breaker of an upstream"""
+    with _breakers_lock:
+        if origin not in _breakers:
+            _breakers[origin] = CircuitBreaker()
+        return _breakers[origin]
+
+
+async def resilient(
+    origin: str,
+    send: Callable[[], Awaitable[httpx.Response]],
+    retry: Retry,
+) -> httpx.Response:
+    """The response of a request sent (by `send`) through the circuit
+    breaker of its upstream and retried as needed: the last response if
+    the retries are exhausted (or the delay asked for is too long)"""
+    circuit = breaker(origin)
+    attempt = 0
+    while True:
+        wait = circuit.allow()
+        if wait is not None:
+            raise Unavailable(origin, wait)
+        try:
+            response = await send()
+        except httpx.TransportError as e:
+            circuit.failure()
+            delay = retry.delay(attempt)
+            if not isinstance(e, RETRY_ERRORS) or delay is None:
+                raise
+        except BaseException:
+            # Cancelled (e.g. a hedged request lost) or failed otherwise
+            circuit.abandon()
+            raise
+        else:
+            circuit.record(response.status_code)
+            if response.status_code not in RETRY_STATUSES:
+                return response
+            delay = retry.delay(attempt, response.headers)
+            if delay is None:
+                return response
+            await response.aclose()
+        await anyio.sleep(delay)
+        attempt += 1
+
+
+def stats() -> dict[str, dict[str, Any]]:
+    """The state of the circuit breakers, by upstream"""
+    with _breakers_lock:
+        return {
+            origin: circuit.stats() for origin, circuit in _breakers.items()
+        }
@@ -0,0 +1,85 @@
+"""
+The routing of the models to their providers, built once: the known models
+in a dict, the model families (e.g. dated versions) in a trie of their
+prefixes, and aliases (e.g. `fast` or `cheap`) configured with
+`LM_MODEL_ALIASES`, standing for a model of any provider.
+"""
+
+from typing import Mapping, Sequence
+from dataclasses import dataclass, field
+
+from app.core.config import settings
+from app.lm.models import openai, mistral, anthropic
+
+
+@dataclass
+class Trie:
+    """A trie of prefixes with values"""
+
+    children: dict[str, "Trie"] = field(default_factory=dict)
+    value: str | None = None
+
+    def insert(self, prefix: str, value: str) -> None:
+        node = self
+        for char in prefix:
+            node = node.children.setdefault(char, Trie())
+        node.value = value
+
+    def longest_prefix(self, key: str) -> str | None:
+        """The value of the longest prefix of the key, if any"""
+        node, value = self, self.value
+        for char in key:
+            if char not in node.children:
+                break
+            node = node.children[char]
+            if node.value is not None:
+                value = node.value
+        return value
+
+
+@dataclass
+class Routes:
+    models: dict[str, str] = field(default_factory=dict)
+    prefixes: Trie = field(default_factory=Trie)
+    aliases: dict[str, str] = field(default_factory=dict)
+
+    @classmethod
+    def build(
+        cls,
+        providers: Mapping[str, tuple[Sequence[str], Sequence[str]]],
+        aliases: Mapping[str, str] | None = None,
+    ) -> "Routes":
+        """The routes of the (models, prefixes) of the providers"""
+        routes = cls(aliases=dict(aliases or {}))
+        for provider, (models, prefixes) in providers.items():
+            for model in models:
+                routes.models[model] = provider
+            for prefix in prefixes:
+                routes.prefixes.insert(prefix, provider)
+        for alias, model in routes.aliases.items():
+            if routes.provider(model) is None:
+                raise ValueError(f"The alias {alias} stands for {model}")
+        return routes
+
+    def provider(self, model: str) -> str | None:
+        if model in self.models:
+            return self.models[model]
+        return self.prefixes.longest_prefix(model)
+
+    def route(self, model: str | None) -> tuple[str, str]:
+        """The provider and the actual model of a model (or alias)"""
+        model = self.aliases.get(model, model) if model else model
+        provider = self.provider(model) if model else None
+        if provider is None:
+            raise ValueError(model)
+        return provider, model
+
+
+routes = Routes.build(
+    {
+        "openai": (openai.MODELS, openai.PREFIXES),
+        "mistral": (mistral.MODELS, mistral.PREFIXES),
+        "anthropic": (anthropic.MODELS, anthropic.PREFIXES),
+    },
+    settings.LM_MODEL_ALIASES,
+)
@@ -0,0 +1,262 @@
+"""
+A semantic cache of the chat completion responses: a request similar enough
+to a previous one (the cosine similarity of the local embeddings of their
+prompts passes the threshold of the user) gets the response of the previous
+one, without calling the model.
+The vectors and responses are stored in an on-disk index (SQLite) shared by
+the processes, each process searching its own copy of the vectors (numpy).
+A hit may be wrong (a similar request calling for a different response): a
+sample of the would-be hits is audited, sent to the model and its response
+compared to the cached one, to measure the precision of the cache.
+"""
+
+from typing import Any
+from dataclasses import dataclass, field
+from threading import Lock
+from time import time
+import hashlib
+import json
+import random
+import sqlite3
+
+import numpy as np
+
+from app.core.config import settings
+from app.ai.simple_embedding import DIMENSION, embed
+from app.lm.models import ChatCompletionRequest, ChatCompletionResponse
+from app.services import Response
+from app.services.lm import served
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    bucket TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    response TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_bucket ON entries (bucket);
+"""
+
+
+@dataclass
+class Index:
+    """The vectors of a bucket, loaded from the entries up to `last`"""
+
+    ids: np.ndarray = field(
+        default_factory=lambda: np.zeros(0, dtype=np.int64)
+    )
+    vectors: np.ndarray = field(
+        default_factory=lambda: np.zeros((0, DIMENSION), dtype=np.float32)
+    )
+    created: np.ndarray = field(default_factory=lambda: np.zeros(0))
+    last: int = 0
+
+    def add(
+        self, ids: list[int], vectors: list[bytes], created: list[float]
+    ) -> None:
+        self.ids = np.concatenate([self.ids, ids])
+        self.vectors = np.concatenate(
+            [self.vectors]
+            + [
+                np.frombuffer(vector, dtype=np.float32).reshape(1, -1)
+                for vector in vectors
+            ]
+        )
+        self.created = np.concatenate([self.created, created])
+        self.last = max([self.last, *ids])
+
+    def keep(self, mask: np.ndarray) -> None:
+        self.ids = self.ids[mask]
+        self.vectors = self.vectors[mask]
+        self.created = self.created[mask]
+
+    def nearest(self, vector: np.ndarray) -> tuple[int, float] | None:
+        """The id and similarity of the nearest neighbor"""
+        if not len(self.ids):
+            return None
+        similarities = self.vectors @ vector
+        i = int(np.argmax(similarities))
+        return int(self.ids[i]), float(similarities[i])
+
+
+@dataclass
+class SemanticCache:
+    path: str = settings.SEMANTIC_CACHE_PATH
+    ttl: float = settings.SEMANTIC_CACHE_TTL
+    size: int = settings.SEMANTIC_CACHE_SIZE
+    # The share of the would-be hits audited
+    audit_rate: float = settings.SEMANTIC_CACHE_AUDIT_RATE
+    # The similarity of two responses to the same request deemed equivalent
+    agreement: float = 0.8
+    counts: dict[str, int] = field(
+        default_factory=lambda: dict.fromkeys(
+            ["lookups", "hits", "audits", "compared", "agreed"], 0
+        )
+    )
+    _connection: sqlite3.Connection | None = None
+    _indices: dict[str, Index] = field(default_factory=dict)
+    # The ops calling the cache run in threads
+    _lock: Lock = field(default_factory=Lock)
+
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(
+                self.path, check_same_thread=False, isolation_level=None
+            )
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    @staticmethod
+    def bucket(scope: str, request: ChatCompletionRequest) -> str | None:
+        """The requests compared are those of the same user, with the same
+        parameters. None if the request cannot be cached (non-text contents
+        or tool calls)."""
+        if any(
+            not isinstance(message.content, str) or message.tool_calls
+            for message in request.messages
+        ):
+            return None
+        parameters = request.model_dump(
+            mode="json",
+            exclude_none=True,
+            exclude={"messages", "lm_config", "stream"},
+        )
+        canonical = json.dumps(parameters, sort_keys=True)
+        return hashlib.sha256(f"{scope}\n{canonical}".encode()).hexdigest()
+
+    @staticmethod
+    def prompt(request: ChatCompletionRequest) -> str:
+        return "\n".join(
+            f"{message.role}: {message.content}"
+            for message in request.messages
+        )
+
+    def index(self, bucket: str) -> Index:
+        """The index of the bucket, with the entries added by any process
+        and without the expired ones"""
+        index = self._indices.setdefault(bucket, Index())
+        rows = self.connection().execute(
+            "SELECT id, vector, created FROM entries"
+            " WHERE bucket = ? AND id > ? ORDER BY id",
+            (bucket, index.last),
+        )
+        ids, vectors, created = [], [], []
+        for row in rows:
+            ids.append(row[0])
+            vectors.append(row[1])
+            created.append(row[2])
+        if ids:
+            index.add(ids, vectors, created)
+        index.keep(index.created > time() - self.ttl)
+        return index
+
+    def neighbor(
+        self, bucket: str, vector: np.ndarray, threshold: float
+    ) -> ChatCompletionResponse | None:
+        """The response of the nearest neighbor, if similar enough"""
+        nearest = self.index(bucket).nearest(vector)
+        if nearest is None or nearest[1] < threshold:
+            return None
+        row = (
+            self.connection()
+            .execute("SELECT response FROM entries WHERE id = ?", nearest[:1])
+            .fetchone()
+        )
+        # The entry may have been evicted by another process
+        if row is None:
+            return None
+        return ChatCompletionResponse.model_validate_json(row[0])
+
+    def lookup(
+        self, scope: str, threshold: float, request: ChatCompletionRequest
+    ) -> Response[ChatCompletionResponse] | None:
+        bucket = self.bucket(scope, request)
+        if bucket is None:
+            return None
+        vector = embed(self.prompt(request))
+        with self._lock:
+            self.counts["lookups"] += 1
+            response = self.neighbor(bucket, vector, threshold)
+            if response is None:
+                return None
+            if random.random() < self.audit_rate:
+                # The request is sent to the model, the responses are
+                # compared when it is stored
+                self.counts["audits"] += 1
+                return None
+            self.counts["hits"] += 1
+        return served(Response(status_code=200, content=response))
+
+    def store(
+        self,
+        scope: str,
+        threshold: float,
+        request: ChatCompletionRequest,
+        response: Response[ChatCompletionResponse],
+    ) -> None:
+        bucket = self.bucket(scope, request)
+        if bucket is None or response.status_code != 200 or response.cached:
+            return
+        content = response.content
+        vector = embed(self.prompt(request))
+        with self._lock:
+            # A neighbor passing the threshold would have been served (the
+            # request was audited or raced with a similar one)
+            neighbor = self.neighbor(bucket, vector, threshold)
+            if neighbor is not None:
+                self.counts["compared"] += 1
+                if self.agree(neighbor, content):
+                    self.counts["agreed"] += 1
+            connection = self.connection()
+            connection.execute(
+                "INSERT INTO entries (bucket, vector, response, created)"
+                " VALUES (?, ?, ?, ?)",
+                (bucket, vector.tobytes(), content.model_dump_json(), time()),
+            )
+            self.evict(connection)
+
+    def agree(
+        self, a: ChatCompletionResponse, b: ChatCompletionResponse
+    ) -> bool:
+        texts = [
+            "\n".join(str(choice.message.content) for choice in r.choices)
+            for r in (a, b)
+        ]
+        return float(embed(texts[0]) @ embed(texts[1])) >= self.agreement
+
+    def evict(self, connection: sqlite3.Connection) -> None:
+        """Remove the expired entries and the oldest beyond the size"""
+        connection.execute(
+            "DELETE FROM entries WHERE created <= ? OR id <= ("
+            "SELECT id FROM entries ORDER BY id DESC LIMIT 1 OFFSET ?)",
+            (time() - self.ttl, self.size),
+        )
+        oldest = connection.execute("SELECT min(id) FROM entries").fetchone()
+        for index in self._indices.values():
+            index.keep(index.ids >= (oldest[0] or index.last + 1))
+
+    def stats(self) -> dict[str, Any]:
+        counts = self.counts
+        return {
+            **counts,
+            "entries": sum(len(i.ids) for i in self._indices.values()),
+            "hit_rate": counts["hits"] / counts["lookups"]
+            if counts["lookups"]
+            else None,
+            "precision": counts["agreed"] / counts["compared"]
+            if counts["compared"]
+            else None,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+            self._indices.clear()
+
+
+# The semantic cache of the process, used by the users setting a threshold
+semantic_cache = SemanticCache()
@@ -1,10 +1,14 @@
-from typing import Any, TypeVar, Generic
+from typing import Any, AsyncIterator, TypeVar, Generic
 from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
+from contextlib import aclosing
+import json
 
 from pydantic import BaseModel
 import httpx
 
+from app.core.config import settings
+from app.services import clients, resilience, sse
 from app.services.models import Request, Response
 
 
@@ -15,8 +19,9 @@ Res = TypeVar("Res", bound=BaseModel)
 @dataclass
 class Service(ABC, Generic[Req, Res]):
     timeout: httpx.Timeout = field(
-        default_factory=lambda: httpx.Timeout(30.0, read=None)
+        default_factory=lambda: httpx.Timeout(30.0, read=settings.LM_TIMEOUT)
     )
+    retry: resilience.Retry = field(default_factory=resilience.Retry)
 
     @abstractmethod
     def request(self, req: Req) -> Request[Req]:
@@ -28,24 +33,53 @@ class Service(ABC, Generic[Req, Res]):
         """Builds a service request from request content"""
         pass
 
+    async def send(
+        self, request: Request[Req], stream: bool = False
+    ) -> httpx.Response:
+        """Send a request, retried if it fails transiently, or fail fast if
+        the upstream is degraded (see app.services.resilience)"""
+        client = clients.client(request.url)
+        http_request = client.build_request(
+            method=request.method,
+            url=request.url,
+            headers=request.headers,
+            json=request.content.model_dump(exclude_none=True),
+            timeout=self.timeout,
+        )
+        return await resilience.resilient(
+            clients.origin(request.url),
+            lambda: client.send(http_request, stream=stream),
+            self.retry,
+        )
+
     async def call(self, req: Req) -> Response[Res]:
-        request = self.request(req)
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            response = await client.request(
-                method=request.method,
-                url=request.url,
-                headers=request.headers,
-                json=request.content.model_dump(exclude_none=True),
+        response = await self.send(self.request(req))
+        if response.status_code == 200:
+            return Response(
+                status_code=response.status_code,
+                headers=response.headers,
+                content=self.from_any(response.json()),
+            )
+        else:
+            return Response(
+                status_code=response.status_code,
+                headers=response.headers,
+                content=None,
             )
-            if response.status_code == 200:
-                return Response(
-                    status_code=response.status_code,
-                    headers=response.headers,
-                    content=self.from_any(response.json()),
-                )
-            else:
-                return Response(
-                    status_code=response.status_code,
-                    headers=response.headers,
-                    content=None,
-                )
+
+    async def stream(self, req: Req) -> AsyncIterator[Any]:
+        """Send a request answered with server-sent events and yield the
+        data of the events, until the `[DONE]` event if any"""
+        response = await self.send(self.request(req), stream=True)
+        try:
+            if response.status_code != 200:
+                await response.aread()
+                response.raise_for_status()
+            events = sse.events(response.aiter_lines())
+            async with aclosing(events):
+                async for event in events:
+                    if event.data == "[DONE]":
+                        break
+                    yield json.loads(event.data)
+        finally:
+            await response.aclose()
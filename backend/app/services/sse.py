@@ -0,0 +1,45 @@
+"""
+Server-sent events, as streamed by the language model providers
+https://html.spec.whatwg.org/multipage/server-sent-events.html
+"""
+
+from typing import AsyncIterable, AsyncIterator
+from dataclasses import dataclass
+
+MEDIA_TYPE = "text/event-stream"
+
+
+@dataclass
+class Event:
+    data: str
+    event: str | None = None
+
+
+async def events(lines: AsyncIterable[str]) -> AsyncIterator[Event]:
+    """The events of a stream of lines"""
+    event: str | None = None
+    data: list[str] = []
+    async for line in lines:
+        if not line:
+            if data:
+                yield Event(data="\n".join(data), event=event)
+            event, data = None, []
+        elif line.startswith(":"):
+            # A comment (e.g. a keep-alive)
+            continue
+        else:
+            field, _, value = line.partition(":")
+            value = value.removeprefix(" ")
+            if field == "data":
+                data.append(value)
+            elif field == "event":
+                event = value
+    if data:
+        yield Event(data="\n".join(data), event=event)
+
+
+def encode(data: str, event: str | None = None) -> str:
+    """An event as sent to a client"""
+    lines = [f"event: {event}"] if event is not None else []
+    lines.extend(f"data: {line}" for line in data.split("\n"))
+    return "\n".join(lines) + "\n\n"
@@ -0,0 +1,27 @@
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+
+
+def test_metrics(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    r = client.get(
+        f"{settings.API_V1_STR}/utils/metrics/",
+        headers=superuser_token_headers,
+    )
+    assert r.status_code == 200
+    metrics = r.json()
+    print(metrics)
+    assert "threads" in metrics
+    assert "processes" in metrics
+
+
+def test_metrics_normal_user(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    r = client.get(
+        f"{settings.API_V1_STR}/utils/metrics/",
+        headers=normal_user_token_headers,
+    )
+    assert r.status_code == 400
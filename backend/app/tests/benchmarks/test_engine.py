@@ -0,0 +1,188 @@
+"""
+Benchmarks of the computation engine, run with `scripts/benchmark.sh` to
+compare with the previous runs (the regular test suite only checks that they
+run).
+"""
+
+from typing import Any, Callable, ClassVar, Iterator
+import asyncio
+import base64
+
+from pytest import fixture
+
+from app.ops import Op, Computation, cst, tup
+from app.ops.computation import FlatComputations, Hashable, interning
+from app.ops.plan import Plan, placeholder
+from app.ops import binary
+
+SIZE = 256
+
+
+class Noop(Op[tuple[Any, ...], int]):
+    async def call(self, *args: Any) -> int:
+        return 0
+
+
+class Blocking(Op[tuple[int], int]):
+    blocking: ClassVar[bool] = True
+
+    async def call(self, value: int) -> int:
+        return value
+
+
+class Add(Op[tuple[int, int], int]):
+    async def call(self, a: int, b: int) -> int:
+        return a + b
+
+
+def chain(size: int = SIZE) -> Computation:
+    comp = cst(0)
+    for i in range(size):
+        comp = Add()(comp, cst(i))
+    return comp
+
+
+def fan_out(size: int = SIZE) -> Computation:
+    root = Noop()()
+    return tup(*(Noop()(root, cst(i)) for i in range(size)))
+
+
+def payload() -> Computation:
+    """A computation shaped as a request sent to the workers"""
+    image = base64.b64encode(bytes(range(256)) * 256).decode()
+    messages = [
+        {"role": "user", "content": f"data:image/png;base64,{image}"},
+        {"role": "user", "content": "Describe the image " * 32},
+    ]
+    return tup(*(Noop()(cst(messages), cst(i)) for i in range(16)))
+
+
+@fixture(scope="module")
+def runner() -> Iterator[asyncio.Runner]:
+    with asyncio.Runner() as runner:
+        yield runner
+
+
+def fresh(
+    build: Callable[[], Computation],
+) -> Callable[[], tuple[tuple[Computation], dict[str, Any]]]:
+    """The setup of a benchmark, building a graph with no cached hash"""
+
+    def setup() -> tuple[tuple[Computation], dict[str, Any]]:
+        return (build(),), {}
+
+    return setup
+
+
+def test_build_chain(benchmark) -> None:
+    benchmark(chain)
+
+
+def test_build_fan_out(benchmark) -> None:
+    benchmark(fan_out)
+
+
+def test_build_interned(benchmark) -> None:
+    def build() -> Computation:
+        with interning():
+            return fan_out()
+
+    benchmark(build)
+
+
+def test_hash_chain(benchmark) -> None:
+    benchmark.pedantic(hash, setup=fresh(chain), rounds=50)
+
+
+def test_hash_fan_out(benchmark) -> None:
+    benchmark.pedantic(hash, setup=fresh(fan_out), rounds=50)
+
+
+def test_hash_long_chain(benchmark) -> None:
+    # Linear if about 4 times test_hash_chain
+    benchmark.pedantic(hash, setup=fresh(lambda: chain(4 * SIZE)), rounds=20)
+
+
+def test_flatten_chain(benchmark) -> None:
+    benchmark.pedantic(
+        FlatComputations.from_computation, setup=fresh(chain), rounds=50
+    )
+
+
+def test_immutable_cached(benchmark) -> None:
+    comp = chain()
+    hash(comp)
+    benchmark(Hashable.to_immutable, comp)
+
+
+def test_flat_computations_round_trip(benchmark) -> None:
+    comp = fan_out()
+
+    def round_trip() -> Computation:
+        flat = FlatComputations.from_computation(comp)
+        return FlatComputations.to_computation(flat)
+
+    benchmark(round_trip)
+
+
+def test_evaluate_chain(benchmark, runner: asyncio.Runner) -> None:
+    comp = chain()
+    assert benchmark(lambda: runner.run(comp.evaluate())) == sum(range(SIZE))
+
+
+def test_evaluate_fan_out(benchmark, runner: asyncio.Runner) -> None:
+    comp = fan_out()
+    benchmark(lambda: runner.run(comp.evaluate()))
+
+
+def test_evaluate_blocking(benchmark, runner: asyncio.Runner) -> None:
+    comp = tup(*(Blocking()(cst(i)) for i in range(SIZE // 8)))
+    benchmark(lambda: runner.run(comp.evaluate()))
+
+
+def test_evaluate_single_node(benchmark, runner: asyncio.Runner) -> None:
+    comp = Noop()()
+    benchmark(lambda: runner.run(comp.evaluate()))
+
+
+def test_plan_bind(benchmark) -> None:
+    with interning():
+        plan = Plan.compile(
+            tup(*(Add()(placeholder("a"), cst(i)) for i in range(SIZE)))
+        )
+    benchmark(plan.bind, a=1)
+
+
+def test_json_encode(benchmark) -> None:
+    comp = payload()
+    benchmark(comp.to_json)
+
+
+def test_json_decode(benchmark) -> None:
+    value = payload().to_json()
+    benchmark(Computation.from_json, value)
+
+
+def test_json_decode_trusted(benchmark) -> None:
+    value = payload().to_json()
+    benchmark(Computation.from_json, value, True)
+
+
+def test_json_decode_graph(benchmark) -> None:
+    value = fan_out(8 * SIZE).to_json()
+    benchmark(Computation.from_json, value)
+
+
+def test_json_decode_graph_trusted(benchmark) -> None:
+    value = fan_out(8 * SIZE).to_json()
+    benchmark(Computation.from_json, value, True)
+
+
+def test_binary_encode(benchmark) -> None:
+    comp = payload()
+    benchmark(binary.dumps, comp)
+
+
+def test_binary_decode_trusted(benchmark) -> None:
+    value = binary.dumps(payload())
+    benchmark(binary.loads, value, True)
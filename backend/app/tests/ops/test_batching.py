@@ -0,0 +1,99 @@
+from typing import Any, ClassVar
+from asyncio import sleep
+from time import time
+from threading import get_ident
+from anyio import run
+import pytest
+
+from app.ops.computation import Op, ComputationError, ComputationTimeout
+from app.ops.utils import cst, tup
+from app.ops import batching
+
+BATCHES = []
+
+
+class Square(Op[tuple[int], int]):
+    batch_size: ClassVar[int] = 4
+
+    async def call(self, value: int) -> int:
+        return value * value
+
+    async def batch_call(self, calls: list[tuple[Op, tuple]]) -> list[int]:
+        BATCHES.append([value for _, (value,) in calls])
+        return [value * value for _, (value,) in calls]
+
+
+class Delay(Op[tuple[int], int]):
+    async def call(self, value: int) -> int:
+        await sleep(0.05)
+        return value
+
+
+class Fail(Square):
+    def batch_key(self, value: int) -> Any:
+        return Fail
+
+    async def batch_call(self, calls: list[tuple[Op, tuple]]) -> list[int]:
+        raise ValueError("The bulk call failed")
+
+
+def test_calls_are_coalesced() -> None:
+    BATCHES.clear()
+    comp = tup(*(Square()(cst(i)) for i in range(10)))
+    assert run(comp.evaluate) == tuple(i * i for i in range(10))
+    print(f"\nbatches = {BATCHES}")
+    assert [len(batch) for batch in BATCHES] == [4, 4, 2]
+    assert batching.stats()["batches"] >= 3
+
+
+def test_window() -> None:
+    BATCHES.clear()
+    # Calls made after the window are in another batch
+    comp = tup(Square()(cst(1)), Square()(Delay()(cst(2))))
+    assert run(comp.evaluate) == (1, 4)
+    assert BATCHES == [[1], [2]]
+
+
+def test_errors_are_handed_back() -> None:
+    comp = tup(*(Fail()(cst(i)) for i in range(3)))
+    with pytest.raises(ComputationError) as e:
+        run(comp.evaluate)
+    assert len(e.value.errors) == 3
+    assert all(isinstance(error, ValueError) for error in e.value.errors)
+
+
+class Slow(Square):
+    async def batch_call(self, calls: list[tuple[Op, tuple]]) -> list[int]:
+        await sleep(0.2)
+        BATCHES.append([value for _, (value,) in calls])
+        return [value * value for _, (value,) in calls]
+
+
+def test_batches_are_cancelled_with_their_callers() -> None:
+    BATCHES.clear()
+    comp = tup(*(Slow()(cst(i)) for i in range(4)))
+
+    async def evaluate() -> None:
+        with pytest.raises(ComputationTimeout):
+            await comp.evaluate(deadline=time() + 0.05)
+        await sleep(0.3)
+
+    run(evaluate)
+    assert BATCHES == []
+
+
+class BlockingIdent(Op[tuple[int], int]):
+    batch_size: ClassVar[int] = 8
+    blocking: ClassVar[bool] = True
+
+    async def call(self, a: int) -> int:
+        return get_ident()
+
+    async def batch_call(self, calls: list[tuple[Op, tuple]]) -> list[int]:
+        return [get_ident()] * len(calls)
+
+
+def test_blocking_batches_run_in_threads() -> None:
+    comp = tup(*(BlockingIdent()(cst(i)) for i in range(8)))
+    idents = run(comp.evaluate)
+    assert len(set(idents)) == 1 and get_ident() not in idents
@@ -0,0 +1,80 @@
+import base64
+import os
+
+from app.ops.computation import Computation
+from app.ops.utils import cst, tup
+from app.ops.lm import Judge
+from app.ops import binary
+from app.lm.models import (
+    LMApiKeys,
+    ChatCompletionRequest,
+    ChatCompletionResponse,
+    Message,
+)
+
+
+def judge_computation() -> Computation:
+    image = base64.b64encode(os.urandom(1 << 18)).decode()
+    url = f"data:image/png;base64,{image}"
+    request = ChatCompletionRequest(
+        model="gpt-4o",
+        messages=[
+            Message(role="system", content="You are a helpful assistant."),
+            Message(
+                role="user",
+                content=[
+                    {"type": "text", "text": "What is in this image?"},
+                    {"type": "image_url", "image_url": {"url": url}},
+                ],
+            ),
+        ],
+    )
+    response = ChatCompletionResponse.model_validate(
+        {
+            "id": "chatcmpl-1",
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": "A cat."},
+                }
+            ],
+            "created": 0,
+            "model": "gpt-4o",
+            "object": "chat.completion",
+        }
+    )
+    keys = cst(
+        LMApiKeys(openai_api_key="", mistral_api_key="", anthropic_api_key="")
+    )
+    return tup(*(Judge()(keys, cst(request), cst(response)) for _ in range(4)))
+
+
+def test_round_trip() -> None:
+    comp = judge_computation()
+    value = binary.loads(binary.dumps(comp))
+    assert isinstance(value, Computation)
+    assert value == comp
+    assert binary.loads(binary.dumps([comp, {"a": (1, b"2")}])) == [
+        comp,
+        {"a": [1, b"2"]},
+    ]
+
+
+def test_data_urls() -> None:
+    url = f"data:image/png;base64,{base64.b64encode(b'png').decode()}"
+    assert isinstance(binary.to_wire(url, {}), binary.msgpack.ExtType)
+    assert binary.loads(binary.dumps(url)) == url
+    # Non canonical base64 is kept as text
+    for text in ["data:text/plain;base64,cG5", "data:,text"]:
+        assert binary.to_wire(text, {}) == text
+
+
+def test_size() -> None:
+    comp = judge_computation()
+    for dumps, loads in [
+        (Computation.to_json, Computation.from_json),
+        (binary.dumps, binary.loads),
+    ]:
+        assert loads(dumps(comp)) == comp
+    assert len(binary.dumps(comp)) < len(comp.to_json()) * 0.8
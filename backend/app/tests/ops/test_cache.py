@@ -0,0 +1,76 @@
+from time import sleep
+from typing import ClassVar
+from anyio import run
+
+from app.ops.computation import Op
+from app.ops.utils import cst, tup
+from app.ops.cache import LRUCache, StoreCache, LocalStore
+from app.lm.models import LMConfig
+
+CALLS = []
+
+
+class Square(Op[tuple[int], int]):
+    pure: ClassVar[bool] = True
+
+    async def call(self, a: int) -> int:
+        CALLS.append(a)
+        return a * a
+
+
+def test_lru_cache() -> None:
+    cache = LRUCache(maxsize=2, ttl=0.1)
+
+    async def calls() -> None:
+        await cache.set("a", 1)
+        await cache.set("b", 2)
+        assert await cache.get("a") == (True, 1)
+        await cache.set("c", 3)
+        # "b" was the least recently used
+        assert await cache.get("b") == (False, None)
+        assert await cache.get("c") == (True, 3)
+        sleep(0.2)
+        assert await cache.get("a") == (False, None)
+
+    run(calls)
+    assert cache.stats() == {"hits": 2, "misses": 2}
+
+
+def test_store_cache() -> None:
+    store = LocalStore()
+    cache = StoreCache(store=lambda: store, ttl=10)
+
+    async def calls() -> None:
+        await cache.set("config", LMConfig(pii_removal="masking"))
+        found, value = await cache.get("config")
+        assert found
+        assert value == LMConfig(pii_removal="masking")
+        assert await cache.get("other") == (False, None)
+
+    run(calls)
+    print(store)
+
+
+def test_pure_op_memoization() -> None:
+    cache = LRUCache()
+    CALLS.clear()
+    comp = tup(Square()(cst(3)), Square()(cst(4)))
+    assert run(lambda: comp.evaluate(cache=cache)) == (9, 16)
+    comp = tup(Square()(cst(3)), Square()(cst(5)))
+    assert run(lambda: comp.evaluate(cache=cache)) == (9, 25)
+    assert sorted(CALLS) == [3, 4, 5]
+    assert cache.stats() == {"hits": 1, "misses": 3}
+    # The cache can be disabled
+    run(lambda: Square()(cst(3)).evaluate(cache=None))
+    assert sorted(CALLS) == [3, 3, 4, 5]
+
+
+def test_pure_op_memoization_in_store() -> None:
+    store = LocalStore()
+    cache = StoreCache(store=lambda: store)
+    CALLS.clear()
+    comp = Square()(cst(3))
+    assert run(lambda: comp.evaluate(cache=cache)) == 9
+    assert run(lambda: Square()(cst(3)).evaluate(cache=cache)) == 9
+    assert CALLS == [3]
+    assert cache.stats() == {"hits": 1, "misses": 1}
@@ -0,0 +1,89 @@
+from typing import ClassVar
+from anyio import run
+import pytest
+
+from app.ops.computation import Computation, Op
+from app.ops.utils import cst, tup
+from app.ops.cache import LocalStore
+from app.ops.checkpoint import Checkpoint
+
+CALLS = []
+FAILURES = []
+
+
+class Expensive(Op[tuple[int], int]):
+    checkpointed: ClassVar[bool] = True
+
+    async def call(self, value: int) -> int:
+        CALLS.append(value)
+        return 2 * value
+
+
+class Flaky(Op[tuple[int], int]):
+    async def call(self, value: int) -> int:
+        if FAILURES:
+            raise ValueError(FAILURES.pop())
+        return value + 1
+
+
+def test_retry_resumes_from_checkpoint() -> None:
+    CALLS.clear()
+    FAILURES.append("The DB write failed")
+    store = LocalStore()
+    value = tup(Flaky()(Expensive()(cst(1))), Expensive()(cst(2))).to_json()
+    # The first attempt fails after the expensive ops
+    checkpoint = Checkpoint(store=lambda: store, prefix="task:")
+    with pytest.raises(RuntimeError):
+        run(
+            lambda: Computation.from_json(value).evaluate(
+                checkpoint=checkpoint
+            )
+        )
+    assert sorted(CALLS) == [1, 2]
+    # The retry, possibly in another process, resumes
+    checkpoint = Checkpoint(store=lambda: store, prefix="task:")
+    result = run(
+        lambda: Computation.from_json(value).evaluate(checkpoint=checkpoint)
+    )
+    print(f"\nresult = {result}, calls = {CALLS}")
+    assert result == (3, 4)
+    assert sorted(CALLS) == [1, 2]
+    assert checkpoint.stats() == {"hits": 2, "misses": 0}
+
+
+def test_other_tasks_do_not_share_checkpoints() -> None:
+    CALLS.clear()
+    store = LocalStore()
+    comp = Expensive()(cst(1))
+    for name in ["task 1", "task 2"]:
+        checkpoint = Checkpoint(store=lambda: store, prefix=f"{name}:")
+        run(lambda checkpoint=checkpoint: comp.evaluate(checkpoint=checkpoint))
+    assert CALLS == [1, 1]
+
+
+def test_node_keys_are_stable() -> None:
+    comp = Expensive()(Expensive()(cst(1)))
+    copy = Computation.from_json(comp.to_json())
+    assert Checkpoint().key(comp) == Checkpoint().key(copy)
+    assert Checkpoint().key(comp) != Checkpoint().key(comp.args[0])
+
+
+class DownStore:
+    """A store that cannot be reached"""
+
+    async def get(self, name: str) -> str | None:
+        raise ConnectionError("The store is down")
+
+    async def set(self, name: str, value: str, ex: int | None = None) -> bool:
+        raise ConnectionError("The store is down")
+
+
+def test_unavailable_store_recomputes() -> None:
+    CALLS.clear()
+    store = DownStore()
+    checkpoint = Checkpoint(store=lambda: store, prefix="task:")
+    assert (
+        run(lambda: Expensive()(cst(1)).evaluate(checkpoint=checkpoint)) == 2
+    )
+    assert CALLS == [1]
+    assert checkpoint.stats() == {"hits": 0, "misses": 1}
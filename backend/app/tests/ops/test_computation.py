@@ -1,13 +1,20 @@
-from time import time
+from typing import ClassVar
+from time import time, perf_counter
 from asyncio import sleep
 from anyio import run
-from pytest import fixture
+from pytest import fixture, raises
 
 from app.ops.computation import (
     Op,
+    Const,
     Computation,
     FlatComputations,
+    Hashable,
+    ComputationError,
+    ComputationTimeout,
+    interning,
 )
+from app.ops.utils import cst, tup, rnd
 from app.ops.dot import dot
 
 T = time()
@@ -39,6 +46,18 @@ class SleepPipeMany(Op):
         return f"{'.'.join(args)}."
 
 
+class Inc(Op):
+    async def call(self, value: int) -> int:
+        return value + 1
+
+
+def chain(length: int) -> Computation:
+    comp = Const(value=0)()
+    for _ in range(length):
+        comp = Inc()(comp)
+    return comp
+
+
 @fixture
 def sleep_hello() -> SleepConst:
     return SleepConst(value="Hello")
@@ -112,3 +131,150 @@ def test_to_immutable(sleep_hello, sleep_world, sleep_pipe, sleep_pipe_many):
     print(f"comps = {[c.op.__class__.__name__ for c in comp.computations()]}")
     immutable_comp = Computation.to_immutable(comp)
     print(f"immutable_comp = {immutable_comp}")
+
+
+def test_hash_invalidation():
+    comp = Inc()(Inc()(Const(value=0)()))
+    before = hash(comp)
+    comp.args[0].args[0].op.value = 1
+    assert hash(comp) != before
+    comp.args[0].args[0].op.value = 0
+    assert hash(comp) == before
+    comp.task = None
+    assert hash(comp) == before
+
+
+def test_hash_invalidation_is_local():
+    shared = Const(value=0)()
+    comp = Inc()(shared)
+    other = Inc()(Inc()(shared))
+    unrelated = chain(10)
+    hash(comp), hash(other), hash(unrelated)
+    structure = Hashable.to_immutable(unrelated)
+    shared.op.value = 1
+    # The ancestors of the mutated node are rehashed, other nodes are not
+    assert comp._immutable is None and other._immutable is None
+    assert other.args[0]._immutable is None
+    assert Hashable.to_immutable(unrelated) is structure
+    assert comp == Inc()(Const(value=1)())
+
+
+def test_hash_is_memoized():
+    comp = chain(50)
+    hash(comp)
+    # The structure of a node is built once and shared by its parent
+    structure = dict(Hashable.to_immutable(comp)[1:])
+    assert structure["args"][0] is Hashable.to_immutable(comp.args[0])
+    assert len(FlatComputations.from_computation(comp).flat_computation_list)
+
+
+def test_deep_graphs_do_not_recurse():
+    import sys
+
+    comp = chain(4 * sys.getrecursionlimit())
+    assert len(comp.order()) == 4 * sys.getrecursionlimit() + 1
+    hash(comp)
+    other = chain(4 * sys.getrecursionlimit())
+    assert comp == other and comp != chain(4 * sys.getrecursionlimit() - 1)
+    assert len(FlatComputations.from_computation(comp).flat_computation_list)
+    assert run(comp.evaluate) == 4 * sys.getrecursionlimit()
+    assert comp.task is None and comp.args[0].task is None
+
+
+def test_order_is_reused():
+    shared = Inc()(cst(0))
+    comp = tup(shared, Inc()(shared), Inc()(cst(0)))
+    order = comp.order()
+    assert order[-1] is comp
+    assert all(
+        order.index(arg) < order.index(c) for c in order for arg in c.args
+    )
+    # Equal but distinct nodes are all evaluated
+    assert len(order) == 6 and len(comp.computation_set()) == 4
+    assert run(comp.evaluate) == (1, 2, 1)
+    assert comp.order() is order
+    comp.args[0].args[0].op.value = 1
+    assert comp.order() is not order
+    assert run(comp.evaluate) == (2, 3, 1)
+
+
+class Count(Op):
+    interned: ClassVar[bool] = True
+    calls: ClassVar[list[int]] = []
+
+    async def call(self, value: int) -> int:
+        self.calls.append(value)
+        return value
+
+
+def test_interning():
+    with interning():
+        first = Count()(cst(1))
+        second = Count()(cst(1))
+        other = Count()(cst(2))
+        comp = tup(first.real, second.real, other)
+        # Random ops are not interned
+        randoms = tup(rnd(), rnd())
+    assert first is second
+    assert first is not other
+    assert comp.args[0] is comp.args[1]
+    # Outside of the scope, nothing is interned
+    assert Count()(cst(1)) is not first
+    Count.calls.clear()
+    assert run(comp.evaluate) == (1, 1, 2)
+    assert sorted(Count.calls) == [1, 2]
+    a, b = run(randoms.evaluate)
+    assert a != b
+
+
+class Hang(Op):
+    timeout: ClassVar[float] = 0.05
+
+    async def call(self, value: int) -> int:
+        await sleep(10)
+        return value
+
+
+class Wait(Op):
+    cancelled: ClassVar[list[float]] = []
+
+    async def call(self, delay: float) -> float:
+        try:
+            await sleep(delay)
+        except BaseException:
+            self.cancelled.append(delay)
+            raise
+        return delay
+
+
+def test_op_timeout():
+    comp = tup(Inc()(Hang()(cst(0))), Wait()(cst(5)))
+    start = perf_counter()
+    with raises(ComputationTimeout) as info:
+        run(comp.evaluate)
+    assert perf_counter() - start < 1
+    # The node at fault, its siblings are cancelled
+    assert [type(node.op) for node in info.value.nodes] == [Hang]
+    assert isinstance(info.value.errors[0], TimeoutError)
+    assert Wait.cancelled == [5]
+    assert comp.task is None
+
+
+def test_deadline():
+    comp = Inc()(tup(Wait()(cst(5)), Wait()(cst(0))))
+    start = perf_counter()
+    with raises(ComputationTimeout) as info:
+        run(lambda: comp.evaluate(deadline=time() + 0.05))
+    assert perf_counter() - start < 1
+    # The node still running at the deadline
+    assert [node.args[0].op.value for node in info.value.nodes] == [5]
+    assert info.value.to_dict()["nodes"] == ["Wait"]
+
+
+def test_failure():
+    comp = tup(Inc()(cst("a")), cst(1))
+    with raises(ComputationError) as info:
+        run(comp.evaluate)
+    assert not isinstance(info.value, TimeoutError)
+    assert [type(node.op) for node in info.value.nodes] == [Inc]
+    assert isinstance(info.value.__cause__, TypeError)
@@ -0,0 +1,83 @@
+from typing import ClassVar
+
+from anyio import run
+
+from app.ops import cst, tup, Op
+from app.ops.control import If, Map, cond, switch, fmap
+
+CALLS: list[str] = []
+
+
+class Record(Op[tuple[str], str]):
+    async def call(self, name: str) -> str:
+        CALLS.append(name)
+        return name
+
+
+class Interned(Record):
+    interned: ClassVar[bool] = True
+
+
+class Fail(Op[tuple[()], str]):
+    async def call(self) -> str:
+        raise ValueError("Should not be evaluated")
+
+
+class Add(Op[tuple[int, int], int]):
+    async def call(self, a: int, b: int) -> int:
+        return a + b
+
+
+def test_if_evaluates_one_branch():
+    CALLS.clear()
+    comp = tup(
+        cond(cst(True), Record()(cst("then")), Fail()()),
+        cond(cst(0), Fail()(), Record()(cst("otherwise"))),
+    )
+    assert run(comp.evaluate) == ("then", "otherwise")
+    assert sorted(CALLS) == ["otherwise", "then"]
+    # The graph can be evaluated again
+    assert run(comp.evaluate) == ("then", "otherwise")
+
+
+def test_if_shares_nodes():
+    CALLS.clear()
+    shared = Record()(cst("shared"))
+    comp = tup(shared, If()(cst(True), shared, cst(None)))
+    assert run(comp.evaluate) == ("shared", "shared")
+    assert CALLS == ["shared"]
+
+
+def test_switch():
+    CALLS.clear()
+    value = Record()(cst("b"))
+    comp = switch(
+        value,
+        {"a": Fail()(), "b": Record()(cst("branch b"))},
+        Fail()(),
+    )
+    assert run(comp.evaluate) == "branch b"
+    comp = switch(cst("c"), {"a": Fail()()}, cst("default"))
+    assert run(comp.evaluate) == "default"
+
+
+def test_map():
+    comp = fmap(Add(), Record()(cst([1, 2, 3])), 10)
+    assert run(comp.evaluate) == [11, 12, 13]
+    assert run(Map(op=Add())(cst([]), 0).evaluate) == []
+
+
+def test_map_calls_interned_ops_once_per_item():
+    CALLS.clear()
+    comp = fmap(Interned(), cst(["a", "b", "a", "a"]))
+    assert run(comp.evaluate) == ["a", "b", "a", "a"]
+    assert sorted(CALLS) == ["a", "b"]
+    CALLS.clear()
+    assert run(fmap(Record(), cst(["a", "a"])).evaluate) == ["a", "a"]
+    assert CALLS == ["a", "a"]
+
+
+def test_nested_control_flow():
+    inner = cond(cst(False), Fail()(), fmap(Add(), cst([1, 2]), 1))
+    comp = cond(cst(True), inner, Fail()())
+    assert run(comp.evaluate) == [2, 3]
@@ -1,4 +1,4 @@
-from anyio import run
+from anyio import run, create_task_group
 from sqlmodel import Session, select
 from pydantic import BaseModel
 from rich import print
@@ -7,7 +7,7 @@ from app.services import crud
 from app.models import UserCreate, Event
 from app.ops.events import LogRequest, Request, LogResponse, Response
 from app.ops.session import session as session_op, user as user_op
-from app.ops import tup
+from app.ops import tup, batching
 from app.tests.utils.utils import random_email, random_lower_string
 
 
@@ -139,3 +139,41 @@ def test_log_many_requests(db: Session) -> None:
     for event in events:
         db.delete(event)
     db.commit()
+
+
+def test_log_requests_of_sessions_together(db: Session) -> None:
+    user = crud.create_user(
+        session=db,
+        user_create=UserCreate(
+            email=random_email(), password=random_lower_string()
+        ),
+    )
+    stats = batching.stats()
+
+    async def concurrent_evals():
+        # Each evaluation has its own graph and session, as each API request
+        async def event_eval():
+            ses = session_op()
+            usr = user_op(ses, user.id)
+            req = Request(
+                method="POST", url="http://localhost", content=Text(text="hi")
+            )
+            with Session(db.get_bind()) as session:
+                await LogRequest()(ses, usr, None, req).evaluate(
+                    session=session
+                )
+
+        async with create_task_group() as tg:
+            tg.start_soon(event_eval)
+            tg.start_soon(event_eval)
+
+    run(concurrent_evals)
+    # The events of both sessions are inserted together
+    assert batching.stats()["batches"] == stats["batches"] + 1
+    assert batching.stats()["calls"] == stats["calls"] + 2
+    events = db.exec(select(Event).where(Event.owner_id == user.id)).all()
+    assert len(events) == 2
+    # Cleanup
+    for event in events:
+        db.delete(event)
+    db.commit()
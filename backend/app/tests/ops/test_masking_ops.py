@@ -17,3 +17,81 @@ def test_replace_masking(text_with_pii) -> None:
     result = synth_masking(text)
     print(f"Computation = {result}")
     print(run(result.evaluate))
+
+
+def test_with_replacements() -> None:
+    from app.services import Request
+    from app.lm.models import (
+        ChatCompletionRequest,
+        ChatCompletionResponse,
+        Message,
+    )
+    from app.ops import cst
+    from app.ops.masking import text_contents, with_replacements, replace_back
+
+    request = Request(
+        method="POST",
+        url="/chat/completions",
+        content=ChatCompletionRequest(
+            model="gpt-4o",
+            messages=[
+                Message(role="system", content="Bob"),
+                Message(role="user", content="Alice"),
+            ],
+        ),
+    )
+    replacements = [("Carl", {"Carl": "Bob"}), ("Dan", {"Dan": "Alice"})]
+    replaced = with_replacements(cst(request), cst(replacements))
+    masked_request, mapping = run(replaced.evaluate)
+    assert run(text_contents(cst(masked_request)).evaluate) == ["Carl", "Dan"]
+    assert request.content.messages[1].content == "Alice"
+    assert mapping == {"Dan": "Alice"}
+    response = ChatCompletionResponse.model_validate(
+        {
+            "id": "id",
+            "model": "gpt-4o",
+            "created": 0,
+            "object": "chat.completion",
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "Hi Dan"},
+                    "finish_reason": "stop",
+                }
+            ],
+        }
+    )
+    result = run(replace_back(cst(response), cst(mapping)).evaluate)
+    assert result.choices[0].message.content == "Hi Alice"
+    assert response.choices[0].message.content == "Hi Dan"
+
+
+def test_replace_back_stream() -> None:
+    from app.lm.models import ChatCompletionChunk, ChunkChoice, ChoiceDelta
+    from app.ops import cst
+    from app.ops.masking import replace_back_stream
+    from app.ops.streams import collect
+
+    def chunk(text: str | None, finish: str | None = None):
+        return ChatCompletionChunk(
+            id="chatcmpl-1",
+            model="gpt-4o",
+            choices=[
+                ChunkChoice(
+                    index=0,
+                    delta=ChoiceDelta(content=text),
+                    finish_reason=finish,
+                )
+            ],
+        )
+
+    async def chunks():
+        for text in ["Dear Jo", "hn Smi", "th, wri", "te to js@x.", "com"]:
+            yield chunk(text)
+        yield chunk(None, "stop")
+
+    mapping = {"John Smith": "Alice Doe", "js@x.com": "alice@y.org"}
+    result = run(collect(replace_back_stream(cst(chunks()), mapping)).evaluate)
+    text = "".join(t for c in result for t in c.texts().values())
+    assert text == "Dear Alice Doe, write to alice@y.org"
+    assert result[-1].choices[0].finish_reason == "stop"
@@ -1,6 +1,8 @@
 from dataclasses import dataclass
+from enum import Enum
 
 from anyio import run
+from pydantic import BaseModel
 
 from app.ops import Op, cst, rnd, rndi, Computation
 
@@ -104,6 +106,40 @@ def test_from_json() -> None:
     print(f"AFTER {s}")
 
 
+def test_from_json_trusted() -> None:
+    from app.ops.utils import tup
+
+    comp = tup(*(tup(cst(i), cst(f"value {i}")) for i in range(2000)))
+    value = comp.to_json()
+    validated = Computation.from_json(value)
+    trusted = Computation.from_json(value, trusted=True)
+    assert validated == trusted == comp
+    assert run(trusted.evaluate) == run(comp.evaluate)
+    # The tuple fields are serialized as lists
+    comp = cst("value").upper(1, ["a"])
+    trusted = Computation.from_json(comp.to_json(), trusted=True)
+    assert trusted == comp and trusted.op.args == (1, ["a"])
+
+
+class Color(str, Enum):
+    RED = "red"
+    BLUE = "blue"
+
+
+class Palette(BaseModel):
+    color: Color
+    names: dict[int, str]
+    tags: list[str]
+
+
+def test_from_json_trusted_coercion() -> None:
+    # The fields not decoded exactly from JSON are validated
+    palette = Palette(color=Color.BLUE, names={1: "blue"}, tags=["sky"])
+    trusted = Computation.from_json(cst(palette).to_json(), trusted=True)
+    assert trusted.op.value == palette
+    assert trusted.op.value.color is Color.BLUE
+
+
 def test_to_json() -> None:
     class Sum(Op[tuple[float, float], float]):
         name: str = "sum"
@@ -0,0 +1,72 @@
+from typing import ClassVar
+from anyio import run
+from pytest import raises
+
+from app.ops import Op, cst, tup
+from app.ops.computation import interning
+from app.ops.control import cond
+from app.ops.plan import Plan, placeholder
+
+
+class Add(Op[tuple[int, int], int]):
+    interned: ClassVar[bool] = True
+
+    async def call(self, a: int, b: int) -> int:
+        return a + b
+
+
+def template():
+    a, b = placeholder("a"), placeholder("b")
+    total = Add()(a, b)
+    return tup(total, Add()(a, b), cond(total, Add()(total, cst(1)), b))
+
+
+def test_bind():
+    with interning():
+        plan = Plan.compile(template())
+    assert plan.inputs == {"a", "b"}
+    # The shared nodes are shared in the plan
+    assert len(plan.steps) == 7
+    first = plan.bind(a=1, b=2)
+    second = plan.bind(a=-2, b=2)
+    assert first.args[0] is first.args[1]
+    assert first.op is not second.op
+    assert run(first.evaluate) == (3, 3, 4)
+    assert run(second.evaluate) == (0, 0, 2)
+    assert run(first.evaluate) == (3, 3, 4)
+
+
+async def concurrently(plan: Plan) -> list[tuple[int, ...]]:
+    from asyncio import gather
+
+    return await gather(
+        *(plan.bind(a=i, b=i).evaluate(index=i) for i in range(10))
+    )
+
+
+def test_bind_concurrently():
+    plan = Plan.compile(template())
+    results = run(concurrently, plan)
+    assert results == [
+        (2 * i, 2 * i, 2 * i + 1 if i else 0) for i in range(10)
+    ]
+
+
+def test_inputs():
+    plan = Plan.compile(template())
+    with raises(ValueError):
+        plan.bind(a=1)
+    with raises(ValueError):
+        plan.bind(a=1, b=2, c=3)
+    with raises(RuntimeError):
+        run(template().evaluate)
+
+
+def test_bind_excluded_fields():
+    from app.ops.masking import ReplaceMasking
+
+    plan = Plan.compile(ReplaceMasking()(placeholder("text")))
+    first = plan.bind(text="Alice")
+    second = plan.bind(text="Bob")
+    # The seeded fakers are not shared between concurrent evaluations
+    assert first.op.fake is not second.op.fake
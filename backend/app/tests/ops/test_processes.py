@@ -0,0 +1,42 @@
+from io import BytesIO
+import os
+from anyio import run
+
+from app.ops.computation import Op
+from app.ops import processes
+
+
+def reverse(data: bytes, stream: BytesIO) -> tuple[int, bytes, BytesIO]:
+    return os.getpid(), data[::-1], BytesIO(stream.getvalue()[::-1])
+
+
+class Stats(Op[tuple[()], dict[str, int]]):
+    async def call(self) -> dict[str, int]:
+        return processes.stats()
+
+
+def test_large_buffers_are_shared() -> None:
+    data = os.urandom(4 * processes.threshold)
+    pid, result, stream = run(processes.run_sync, reverse, data, BytesIO(data))
+    assert pid != os.getpid()
+    assert result == data[::-1]
+    assert stream.getvalue() == data[::-1]
+
+
+def test_pack() -> None:
+    data = os.urandom(2 * processes.threshold)
+    buffers = []
+    value = (b"small", [data], {"key": BytesIO(data)})
+    packed = processes.pack(value, buffers)
+    print(f"\npacked = {packed}")
+    assert len(buffers) == 2
+    assert packed[0] == b"small"
+    small, [large], stream = processes.unpack(packed)
+    assert large == data and stream["key"].getvalue() == data
+    for buffer in buffers:
+        buffer.unlink()
+
+
+def test_stats() -> None:
+    stats = run(Stats()().evaluate)
+    assert stats == {"size": processes.size, "running": 0, "waiting": 0}
@@ -0,0 +1,93 @@
+from typing import ClassVar
+from asyncio import sleep
+from anyio import run
+
+from app.ops.computation import Op
+from app.ops.utils import cst, tup
+from app.ops.scheduler import Scheduler
+
+RUNNING = []
+ORDER = []
+
+
+class Work(Op[tuple[int], int]):
+    resource: ClassVar[str] = "upstream"
+
+    async def call(self, value: int) -> int:
+        RUNNING.append(value)
+        ORDER.append(value)
+        print(f"\nrunning {RUNNING}")
+        assert len(RUNNING) <= 2
+        await sleep(0.01)
+        RUNNING.remove(value)
+        return value
+
+
+class Gate(Op[tuple[()], int]):
+    async def call(self) -> int:
+        await sleep(0.01)
+        return 0
+
+
+class GatedWork(Op[tuple[int, int], int]):
+    resource: ClassVar[str] = "upstream"
+
+    async def call(self, gate: int, value: int) -> int:
+        ORDER.append(value)
+        await sleep(0.01)
+        return value
+
+
+class UrgentGatedWork(GatedWork):
+    priority: ClassVar[int] = 1
+
+
+def test_global_limit() -> None:
+    comp = tup(*(Work()(cst(i)) for i in range(10)))
+    assert run(lambda: comp.evaluate(scheduler=Scheduler(limit=2))) == tuple(
+        range(10)
+    )
+
+
+def test_resource_limit() -> None:
+    comp = tup(*(Work()(cst(i)) for i in range(10)))
+    scheduler = Scheduler(limits={"upstream": 2})
+    assert run(lambda: comp.evaluate(scheduler=scheduler)) == tuple(range(10))
+
+
+def test_op_class_limit() -> None:
+    comp = tup(*(Work()(cst(i)) for i in range(10)))
+    scheduler = Scheduler(limits={"Work": 2})
+    assert run(lambda: comp.evaluate(scheduler=scheduler)) == tuple(range(10))
+
+
+def test_priority() -> None:
+    ORDER.clear()
+    # All the ops are ready at the same time
+    gate = Gate()()
+    comp = tup(
+        *(GatedWork()(gate, cst(i)) for i in range(5)),
+        *(UrgentGatedWork()(gate, cst(i)) for i in range(5, 10)),
+    )
+    run(lambda: comp.evaluate(scheduler=Scheduler(limit=1)))
+    # The first op takes the slot, then urgent ops go first
+    assert ORDER == [0, 5, 6, 7, 8, 9, 1, 2, 3, 4]
+
+
+class PartlyWork(Op[tuple[int], int]):
+    """Uses the resource for a part of its call only"""
+
+    async def call(self, value: int) -> int:
+        async with self.context["scheduler"].resource("upstream"):
+            RUNNING.append(value)
+            assert len(RUNNING) <= 2
+            await sleep(0.01)
+            RUNNING.remove(value)
+        return value
+
+
+def test_resource_slot() -> None:
+    comp = tup(*(PartlyWork()(cst(i)) for i in range(10)))
+    scheduler = Scheduler(limits={"upstream": 2})
+    assert run(lambda: comp.evaluate(scheduler=scheduler)) == tuple(range(10))
+    assert scheduler.semaphores["upstream"].value == 2
@@ -0,0 +1,160 @@
+from typing import AsyncIterable, AsyncIterator, ClassVar
+from asyncio import sleep
+from anyio import run
+from pytest import raises
+
+from app.ops import Op, cst, tup
+from app.ops.computation import ComputationError
+from app.ops.streams import Stream, collect, emit, emitted
+
+EVENTS: list[str] = []
+
+
+class Count(Op[tuple[int], AsyncIterator[int]]):
+    streaming: ClassVar[bool] = True
+    stream_buffer: ClassVar[int] = 2
+
+    async def call(self, n: int) -> AsyncIterator[int]:
+        for i in range(n):
+            EVENTS.append(f"produce {i}")
+            yield i
+
+
+class Double(Op[tuple[AsyncIterable[int]], AsyncIterator[int]]):
+    streaming: ClassVar[bool] = True
+
+    async def call(self, items: AsyncIterable[int]) -> AsyncIterator[int]:
+        async for item in items:
+            yield 2 * item
+
+
+class Slow(Op[tuple[AsyncIterable[int]], list[int]]):
+    async def call(self, items: AsyncIterable[int]) -> list[int]:
+        result = []
+        async for item in items:
+            EVENTS.append(f"consume {item}")
+            await sleep(0.01)
+            result.append(item)
+        return result
+
+
+class First(Op[tuple[AsyncIterable[int]], int]):
+    async def call(self, items: AsyncIterable[int]) -> int:
+        async for item in items:
+            return item
+        return -1
+
+
+class Broken(Op[tuple[()], AsyncIterator[int]]):
+    streaming: ClassVar[bool] = True
+
+    async def call(self) -> AsyncIterator[int]:
+        yield 0
+        raise ValueError("Broken stream")
+
+
+def test_stream_through_ops():
+    count = Count()(cst(5))
+    comp = tup(collect(count), collect(Double()(count)), First()(count))
+    assert run(comp.evaluate) == ([0, 1, 2, 3, 4], [0, 2, 4, 6, 8], 0)
+
+
+def test_back_pressure():
+    EVENTS.clear()
+    run(Slow()(Count()(cst(6))).evaluate)
+    # The producer is never more than 2 items ahead of the consumer
+    for i in range(2, 6):
+        assert EVENTS.index(f"produce {i}") > EVENTS.index(f"consume {i-2}")
+
+
+def test_stream_result():
+    async def read() -> list[int]:
+        stream = await Count()(cst(3)).evaluate()
+        assert isinstance(stream, Stream)
+        return [item async for item in stream] + [i async for i in stream]
+
+    assert run(read) == [0, 1, 2, 0, 1, 2]
+
+
+def test_stream_error():
+    with raises(RuntimeError):
+        run(collect(Broken()()).evaluate)
+
+
+def test_emitted():
+    async def stream() -> tuple[list[int], tuple]:
+        count = Count()(cst(4))
+        comp = tup(collect(count), emit(Double()(count)))
+
+        async def evaluate(future):
+            return await comp.evaluate(emitted=future)
+
+        items, evaluation = await emitted(evaluate)
+        # The stream is read while the evaluation goes on
+        assert not evaluation.done()
+        return [item async for item in items], await evaluation
+
+    items, (collected, _) = run(stream)
+    assert items == [0, 2, 4, 6]
+    assert collected == [0, 1, 2, 3]
+
+
+def test_emitted_failure():
+    async def fail() -> None:
+        comp = emit(collect(Broken()()))
+        await emitted(lambda future: comp.evaluate(emitted=future))
+
+    with raises(RuntimeError):
+        run(fail)
+
+
+class Kept(Op[tuple[AsyncIterable[int]], int]):
+    async def call(self, items: AsyncIterable[int]) -> int:
+        # The most items kept by the stream while reading
+        kept = 0
+        async for _ in items:
+            kept = max(kept, len(items.stream.items))
+        return kept
+
+
+def test_items_are_dropped():
+    count = Count()(cst(10))
+    comp = tup(Slow()(count), Kept()(count))
+    items, kept = run(comp.evaluate)
+    assert items == list(range(10))
+    # The items read by both readers are dropped
+    assert kept <= 3
+
+
+class Stalled(Op[tuple[()], AsyncIterator[int]]):
+    streaming: ClassVar[bool] = True
+    stream_timeout: ClassVar[float] = 0.05
+
+    async def call(self) -> AsyncIterator[int]:
+        try:
+            yield 0
+            await sleep(10)
+            yield 1
+        finally:
+            EVENTS.append("closed")
+
+
+def test_idle_timeout():
+    EVENTS.clear()
+    with raises(ComputationError) as e:
+        run(collect(Stalled()()).evaluate)
+    assert isinstance(e.value.errors[0], TimeoutError)
+    assert EVENTS == ["closed"]
+
+
+def test_source_closed():
+    EVENTS.clear()
+
+    async def first() -> int:
+        value = await First()(Stalled()()).evaluate()
+        # The source given up is closed in the background
+        await sleep(0.01)
+        return value
+
+    assert run(first) == 0
+    assert EVENTS == ["closed"]
@@ -0,0 +1,55 @@
+from typing import ClassVar
+from time import sleep
+from threading import Barrier, get_ident
+from anyio import run
+from sqlmodel import Session
+
+from app.ops.computation import Op
+from app.ops.utils import cst, tup
+from app.ops import threads
+
+RUNNING = []
+
+
+class BlockingWait(Op[tuple[Barrier], int]):
+    blocking: ClassVar[bool] = True
+
+    async def call(self, barrier: Barrier) -> int:
+        barrier.wait()
+        return get_ident()
+
+
+class BlockingQuery(Op[tuple[Session, int], int]):
+    blocking: ClassVar[bool] = True
+
+    async def call(self, session: Session, value: int) -> int:
+        RUNNING.append(value)
+        assert len(RUNNING) == 1
+        sleep(0.01)
+        RUNNING.remove(value)
+        return value
+
+
+class Stats(Op[tuple[()], dict[str, int]]):
+    async def call(self) -> dict[str, int]:
+        return threads.stats()
+
+
+def test_blocking_ops_run_in_threads() -> None:
+    # The ops only pass the barrier if they all run at the same time
+    barrier = Barrier(4, timeout=5)
+    comp = tup(*(BlockingWait()(cst(barrier)) for _ in range(4)))
+    idents = run(comp.evaluate)
+    assert get_ident() not in idents and len(set(idents)) == 4
+
+
+def test_sessions_are_not_shared_between_threads() -> None:
+    session = cst(Session())
+    comp = tup(*(BlockingQuery()(session, cst(i)) for i in range(5)))
+    assert run(comp.evaluate) == tuple(range(5))
+
+
+def test_stats() -> None:
+    stats = run(Stats()().evaluate)
+    print(f"\nstats = {stats}")
+    assert stats == {"size": threads.size, "running": 0, "waiting": 0}
@@ -0,0 +1,97 @@
+from typing import ClassVar
+from asyncio import sleep
+import json
+from anyio import run
+
+from app.ops.computation import Op
+from app.ops.utils import cst, tup
+from app.ops.dot import dot
+from app.ops.tracing import FileExporter, Tracer, traced
+
+
+class Sleep(Op[tuple[float], float]):
+    resource: ClassVar[str] = "upstream"
+
+    async def call(self, duration: float) -> float:
+        await sleep(duration)
+        return duration
+
+
+class Fail(Op[tuple[float], float]):
+    async def call(self, duration: float) -> float:
+        raise ValueError("failed")
+
+
+def spans(path) -> list[dict]:
+    with open(path) as f:
+        return [
+            span
+            for line in f
+            for resource in json.loads(line)["resourceSpans"]
+            for scope in resource["scopeSpans"]
+            for span in scope["spans"]
+        ]
+
+
+def test_spans(tmp_path) -> None:
+    path = tmp_path / "traces.json"
+    tracer = Tracer(sample_rate=1, exporters=[FileExporter(path)])
+    comp = tup(Sleep()(cst(0.01)), Sleep()(Sleep()(cst(0.02))))
+    assert run(lambda: comp.evaluate(tracer=tracer)) == (0.01, 0.02)
+    names = [span["name"] for span in spans(path)]
+    print(f"\nnames = {names}")
+    assert names.count("evaluate") == 1 and names.count("Sleep") == 3
+    sleeps = [span for span in spans(path) if span["name"] == "Sleep"]
+    assert all(span["parentSpanId"] for span in sleeps)
+    assert sum(len(span["links"]) for span in sleeps) == 3
+
+
+def test_sampling(tmp_path) -> None:
+    path = tmp_path / "traces.json"
+    tracer = Tracer(sample_rate=0, exporters=[FileExporter(path)])
+    run(lambda: cst(1).evaluate(tracer=tracer))
+    assert not path.exists()
+
+
+def test_traced_scope(tmp_path) -> None:
+    path = tmp_path / "traces.json"
+    tracer = Tracer(sample_rate=1, exporters=[FileExporter(path)])
+
+    async def request() -> None:
+        async with traced("request", tracer):
+            await cst(1).evaluate()
+            await cst(2).evaluate()
+
+    run(request)
+    names = [span["name"] for span in spans(path)]
+    assert names == ["request", "evaluate", "Const", "evaluate", "Const"]
+
+
+def test_exception(tmp_path) -> None:
+    path = tmp_path / "traces.json"
+    tracer = Tracer(sample_rate=1, exporters=[FileExporter(path)])
+    try:
+        run(lambda: Fail()(cst(0.01)).evaluate(tracer=tracer))
+    except RuntimeError:
+        pass
+    [fail] = [span for span in spans(path) if span["name"] == "Fail"]
+    assert fail["status"]["code"] == 2
+    assert fail["events"][0]["name"] == "exception"
+
+
+def test_critical_path_dot() -> None:
+    tracer = Tracer(sample_rate=1)
+
+    async def request() -> str:
+        async with traced("request", tracer) as trace:
+            slow = Sleep()(Sleep()(cst(0.02)))
+            comp = tup(Sleep()(cst(0.01)), slow)
+            await comp.evaluate()
+            inner = slow.args[0]
+            path = trace.critical_path(comp)
+            assert path == [comp, slow, inner, inner.args[0]]
+            return dot(comp, trace).to_string()
+
+    graph = run(request)
+    print(graph)
+    assert graph.count("red") == 4 and "run" in graph
@@ -0,0 +1,55 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from anyio import run
+from pytest import fixture
+
+from app.services import clients
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self) -> None:
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+@fixture(scope="module")
+def url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def test_connections_are_reused(url: str) -> None:
+    async def requests() -> dict:
+        client = clients.client(f"{url}/a")
+        assert clients.client(f"{url}/b?c=d") is client
+        for path in ["a", "b", "c"]:
+            response = await client.get(f"{url}/{path}")
+            assert response.text == "ok"
+        stats = clients.stats()
+        await clients.aclose()
+        assert clients.clients() == {}
+        return stats
+
+    stats = run(requests)
+    print(f"\n{stats}")
+    assert stats["pools"][url]["connections"] == 1
+    assert stats["pools"][url]["idle"] == 1
+
+
+def test_clients_per_event_loop(url: str) -> None:
+    async def client():
+        result = clients.client(url)
+        await clients.aclose()
+        assert result.is_closed
+        return result
+
+    assert run(client) is not run(client)
@@ -0,0 +1,79 @@
+from anyio import run, sleep
+from pytest import fixture, raises
+
+from app.services import Response, hedging
+from app.services.hedging import Latencies, race
+
+CALLS: list[str] = []
+CANCELLED: list[str] = []
+
+
+@fixture(autouse=True)
+def latencies():
+    hedging.latencies = Latencies(min_samples=5)
+    CALLS.clear()
+    CANCELLED.clear()
+    yield hedging.latencies
+    hedging.latencies = Latencies()
+
+
+def call(behaviors: dict[str, tuple[float, int]]):
+    """A call to a model answering after a delay with a status (an error if
+    the status is 0)"""
+
+    async def call(model: str) -> Response:
+        CALLS.append(model)
+        delay, status = behaviors[model]
+        try:
+            await sleep(delay)
+        except BaseException:
+            CANCELLED.append(model)
+            raise
+        if status == 0:
+            raise ConnectionError(model)
+        return Response(status_code=status, headers={"model": model})
+
+    return call
+
+
+def test_fallback() -> None:
+    behaviors = {"a": (0.01, 503), "b": (0.01, 0), "c": (0.01, 200)}
+    response = run(race, ["a", "b", "c"], call(behaviors))
+    assert response.headers["model"] == "c" and CALLS == ["a", "b", "c"]
+    # Without fallback, the failure is returned
+    CALLS.clear()
+    response = run(race, ["a", "b"], call(behaviors), None, False)
+    assert response.status_code == 503 and CALLS == ["a"]
+    # The last failure is raised
+    with raises(ConnectionError):
+        run(race, ["a", "b"], call(behaviors))
+
+
+def test_hedging(latencies: Latencies) -> None:
+    for _ in range(5):
+        latencies.record("a", 0.05)
+    # The first model is slower than usual, the second one wins
+    behaviors = {"a": (1.0, 200), "b": (0.01, 200)}
+    response = run(race, ["a", "b"], call(behaviors), 99)
+    assert response.headers["model"] == "b"
+    assert CALLS == ["a", "b"] and CANCELLED == ["a"]
+    # The first model is as fast as usual, no duplicate request
+    CALLS.clear()
+    behaviors = {"a": (0.01, 200), "b": (0.01, 200)}
+    response = run(race, ["a", "b"], call(behaviors), 99)
+    assert response.headers["model"] == "a" and CALLS == ["a"]
+    # No hedging without enough latencies
+    CALLS.clear()
+    behaviors = {"c": (0.1, 200), "b": (0.01, 200)}
+    response = run(race, ["c", "b"], call(behaviors), 99)
+    assert response.headers["model"] == "c" and CALLS == ["c"]
+    print(f"\n{hedging.stats()}")
+
+
+def test_timed(latencies: Latencies) -> None:
+    async def timed() -> None:
+        await hedging.timed("a", call({"a": (0.01, 200)})("a"))
+        await hedging.timed("a", call({"a": (0.01, 500)})("a"))
+
+    run(timed)
+    assert len(latencies.latencies["a"]) == 1
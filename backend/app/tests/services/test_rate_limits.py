@@ -0,0 +1,205 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from time import perf_counter
+import json
+from anyio import create_task_group, move_on_after, run, sleep
+from pytest import fixture, raises
+
+from app.lm.models import ChatCompletionRequest, Message
+from app.services import Response, rate_limits
+from app.services.rate_limits import LocalBuckets, RateLimiter, RateLimited
+import app.services.lm as slm
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self) -> None:
+        self.rfile.read(int(self.headers["Content-Length"]))
+        body = json.dumps(
+            {
+                "id": "chatcmpl-1",
+                "model": "gpt-4o",
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": "Hi"},
+                    }
+                ],
+                "usage": {"prompt_tokens": 5, "total_tokens": 10},
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("x-ratelimit-limit-requests", "2")
+        self.send_header("x-ratelimit-limit-tokens", "100000")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+@fixture(scope="module")
+def url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+@fixture
+def limiter():
+    # Limits per 0.2s instead of per minute
+    rate_limiter = rate_limits.rate_limiter
+    rate_limits.rate_limiter = RateLimiter(
+        limits={"openai": {"requests": 4, "tokens": 1000}},
+        period=0.2,
+        max_wait=1,
+    )
+    yield rate_limits.rate_limiter
+    rate_limits.rate_limiter = rate_limiter
+
+
+def test_buckets() -> None:
+    async def buckets() -> None:
+        buckets = LocalBuckets()
+        bucket = ("key", 2, 10, 1)
+        assert await buckets.take([bucket], 1) == 0
+        assert await buckets.take([bucket], 1) == 0
+        # The next amounts are reserved, the later ones wait longer
+        assert 0 < await buckets.take([bucket], 1) <= 0.1
+        assert 0.1 < await buckets.take([bucket], 1) <= 0.2
+        # Nothing is reserved if the wait is too long
+        other = ("other", 10, 10, 1)
+        assert await buckets.take([other, bucket], 0.1) > 0.1
+        assert buckets.levels.get("other") is None
+        # Unused tokens are given back
+        await buckets.give(("key", 2, 10, 4))
+        assert await buckets.take([bucket], 0) == 0
+
+    run(buckets)
+
+
+def test_acquire(limiter: RateLimiter) -> None:
+    async def acquire(n: int, tokens: int) -> None:
+        for _ in range(n):
+            await limiter.acquire("openai", "key", tokens)
+
+    start = perf_counter()
+    run(acquire, 4, 10)
+    assert perf_counter() - start < 0.05
+    # The next requests wait for their budget
+    run(acquire, 2, 10)
+    assert perf_counter() - start >= 0.09
+    stats = limiter.stats()["openai"]
+    print(f"\n{stats}")
+    assert stats["requests"] == 6 and stats["waited"] >= 1
+    # A request that would wait too long fails
+    limiter.max_wait = 0.01
+    with raises(RateLimited):
+        run(acquire, 1, 1000)
+    assert limiter.stats()["openai"]["rejected"] == 1
+
+
+def test_order(limiter: RateLimiter) -> None:
+    served: list[str] = []
+
+    async def request(name: str, tokens: int) -> None:
+        await limiter.acquire("openai", "key", tokens)
+        served.append(name)
+
+    async def requests() -> None:
+        # The token budget is spent, a large request queues first
+        await limiter.acquire("openai", "key", 1000)
+        async with create_task_group() as group:
+            group.start_soon(request, "large", 1000)
+            await sleep(0.01)
+            for i in range(3):
+                group.start_soon(request, f"small {i}", 10)
+
+    run(requests)
+    # The small requests do not overtake it
+    assert served[0] == "large"
+
+
+def test_release(limiter: RateLimiter) -> None:
+    async def release() -> None:
+        await limiter.acquire("openai", "key", 1000)
+        # A request cancelled while waiting gives its budget back
+        with move_on_after(0.01):
+            await limiter.acquire("openai", "key", 1000)
+        assert limiter.stats()["openai"]["waiting"] == 0
+        start = perf_counter()
+        await limiter.acquire("openai", "key", 1000)
+        return perf_counter() - start
+
+    assert run(release) < 0.3
+
+
+def test_update(limiter: RateLimiter) -> None:
+    response = Response(
+        status_code=200,
+        headers={"anthropic-ratelimit-requests-limit": "50"},
+    )
+    run(limiter.update, "openai", "key", 100, response)
+    name = limiter.name("openai", "key")
+    learned = run(limiter.buckets.limits, name)
+    assert learned == {"requests": 50}
+    assert limiter.bucket(name, learned, "requests", 1)[1] == 50
+    # The limits not learned are the defaults
+    assert limiter.bucket(name, learned, "tokens", 1)[1] == 1000
+    # The limits learned are shared by the limiters of the buckets
+    other = RateLimiter(buckets=limiter.buckets)
+    assert run(other.buckets.limits, name) == learned
+
+
+def test_stream_usage(limiter: RateLimiter) -> None:
+    used: dict[str, int] = {}
+    for data in [
+        {"type": "message_start", "message": {"usage": {"input_tokens": 10}}},
+        {"type": "content_block_delta", "index": 0},
+        {"type": "message_delta", "usage": {"output_tokens": 20}},
+    ]:
+        rate_limits.stream_usage(data, used)
+    assert rate_limits.streamed(used) == 30
+    used = {}
+    rate_limits.stream_usage(
+        {"choices": [], "usage": {"prompt_tokens": 5, "total_tokens": 12}},
+        used,
+    )
+    assert rate_limits.streamed(used) == 12
+    assert rate_limits.streamed({}) is None
+
+    async def reconcile() -> float:
+        await limiter.acquire("openai", "key", 900)
+        # The unused tokens are given back
+        await limiter.update("openai", "key", 900, used=100)
+        start = perf_counter()
+        await limiter.acquire("openai", "key", 800)
+        return perf_counter() - start
+
+    assert run(reconcile) < 0.05
+
+
+def test_disabled() -> None:
+    assert rate_limits.default_rate_limiter() is None
+
+
+def test_service(url: str, limiter: RateLimiter) -> None:
+    async def complete() -> None:
+        service = slm.OpenAI(api_key="key", url=url)
+        request = ChatCompletionRequest(
+            model="gpt-4o", messages=[Message(role="user", content="Hi")]
+        )
+        for _ in range(3):
+            await service.chat_completion(request)
+
+    start = perf_counter()
+    run(complete)
+    # The limit of the API key is learned from the first response
+    name = limiter.name("openai", "key")
+    assert run(limiter.buckets.limits, name)["requests"] == 2
+    assert perf_counter() - start >= 0.09
@@ -0,0 +1,143 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+import json
+from anyio import run
+from pytest import fixture, raises
+
+from app.lm.models import ChatCompletionRequest, Message
+from app.services import resilience
+from app.services.resilience import CircuitBreaker, Retry, Unavailable
+import app.services.lm as slm
+
+BODY = {
+    "id": "chatcmpl-1",
+    "model": "gpt-4o",
+    "choices": [
+        {
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {"role": "assistant", "content": "Hi"},
+        }
+    ],
+}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self) -> None:
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.calls += 1
+        status, headers = self.server.responses.pop(0)
+        body = json.dumps(BODY if status == 200 else {}).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+@fixture
+def server():
+    # A server per test, the circuit breakers are per origin
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.calls, server.responses = 0, []
+    Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+
+
+def complete(server, retry: Retry) -> slm.Response:
+    url = f"http://127.0.0.1:{server.server_port}"
+    service = slm.OpenAI(api_key="key", url=url, retry=retry)
+    request = ChatCompletionRequest(
+        model="gpt-4o", messages=[Message(role="user", content="Hello")]
+    )
+    return run(service.chat_completion, request)
+
+
+def test_retry_after() -> None:
+    assert resilience.retry_after({"retry-after": "2"}) == 2
+    assert resilience.retry_after({"retry-after-ms": "250"}) == 0.25
+    openai = {
+        "x-ratelimit-remaining-requests": "0",
+        "x-ratelimit-reset-requests": "1m30s",
+        "x-ratelimit-remaining-tokens": "10",
+        "x-ratelimit-reset-tokens": "20ms",
+    }
+    assert resilience.retry_after(openai) == 90
+    anthropic = {
+        "anthropic-ratelimit-tokens-remaining": "0",
+        "anthropic-ratelimit-tokens-reset": "2000-01-01T00:00:00Z",
+    }
+    assert resilience.retry_after(anthropic) == 0
+    assert resilience.retry_after({}) is None
+    retry = Retry(retries=2, backoff=1, max_delay=10)
+    assert 0 <= retry.delay(1) <= 2
+    assert retry.delay(0, {"retry-after": "60"}) is None
+    assert retry.delay(2) is None
+
+
+def test_retries(server) -> None:
+    server.responses = [
+        (429, {"retry-after": "0"}),
+        (503, {}),
+        (200, {}),
+    ]
+    response = complete(server, Retry(retries=2, backoff=0.01))
+    assert response.status_code == 200 and server.calls == 3
+    # The retries are exhausted
+    server.responses = [(529, {}), (500, {})]
+    response = complete(server, Retry(retries=1, backoff=0.01))
+    assert response.status_code == 500 and server.calls == 5
+
+
+def test_circuit_breaker(server) -> None:
+    origin = f"http://127.0.0.1:{server.server_port}"
+    resilience._breakers[origin] = CircuitBreaker(threshold=2, reset=0.2)
+    server.responses = [(503, {})] * 2 + [(200, {})]
+    assert complete(server, Retry(retries=0)).status_code == 503
+    assert complete(server, Retry(retries=0)).status_code == 503
+    # The circuit is open, the requests fail fast (without being sent)
+    with raises(Unavailable):
+        complete(server, Retry(retries=0))
+    assert server.calls == 2
+    print(f"\n{resilience.stats()[origin]}")
+    # A probe request closes it
+    run(resilience.anyio.sleep, 0.2)
+    assert complete(server, Retry(retries=0)).status_code == 200
+    assert resilience.stats()[origin] == {
+        "state": "closed",
+        "failures": 0,
+        "trips": 1,
+        "rejected": 1,
+    }
+
+
+def test_cancelled_probe() -> None:
+    origin = "http://probe"
+    circuit = resilience._breakers[origin] = CircuitBreaker(
+        threshold=1, reset=0.05
+    )
+    circuit.failure()
+
+    async def send():
+        await resilience.anyio.sleep(1)
+
+    async def probe() -> None:
+        await resilience.anyio.sleep(0.05)
+        with resilience.anyio.move_on_after(0.01):
+            await resilience.resilient(origin, send, Retry(retries=0))
+
+    run(probe)
+    # The circuit reopens for another cooldown instead of staying half open
+    assert circuit.state == "open"
+    with raises(Unavailable):
+        run(resilience.resilient, origin, send, Retry(retries=0))
+    run(resilience.anyio.sleep, 0.05)
+    assert circuit.allow() is None and circuit.state == "half_open"
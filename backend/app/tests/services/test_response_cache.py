@@ -0,0 +1,134 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from time import sleep
+import json
+from anyio import run
+from pytest import fixture
+
+from app.lm.models import ChatCompletionRequest, Message, openai
+from app.ops.cache import LRUCache, LocalStore
+import app.services.lm as slm
+
+CALLS: list[dict] = []
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self) -> None:
+        length = int(self.headers["Content-Length"])
+        CALLS.append(json.loads(self.rfile.read(length)))
+        body = json.dumps(
+            {
+                "id": f"chatcmpl-{len(CALLS)}",
+                "model": "gpt-4o",
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": "Hi"},
+                    }
+                ],
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+@fixture(scope="module")
+def url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+@fixture
+def cache():
+    response_cache = slm.response_cache
+    slm.response_cache = slm.ResponseCache(cache=LRUCache(ttl=0.2))
+    CALLS.clear()
+    yield slm.response_cache
+    slm.response_cache = response_cache
+
+
+def request(**kwargs) -> ChatCompletionRequest:
+    return ChatCompletionRequest(
+        model="gpt-4o",
+        messages=[Message(role="user", content="Hello")],
+        **kwargs,
+    )
+
+
+def complete(url: str, req: ChatCompletionRequest, **kwargs) -> list:
+    async def calls() -> list:
+        service = slm.OpenAI(api_key="key", url=url, **kwargs)
+        return [await service.chat_completion(req) for _ in range(2)]
+
+    return run(calls)
+
+
+def test_deterministic_requests(url: str, cache: slm.ResponseCache) -> None:
+    first, second = complete(url, request(temperature=0))
+    assert len(CALLS) == 1
+    assert not first.cached and second.cached
+    # The identifiers of the responses are unique
+    assert second.content.id.startswith(f"{first.content.id}-")
+    assert second.content.choices == first.content.choices
+    # The other requests are cached if the caller opts in
+    complete(url, request(temperature=0.7))
+    assert len(CALLS) == 3
+    complete(url, request(temperature=0.7), cache_opt_in=True)
+    assert len(CALLS) == 4
+    print(f"\n{cache.stats()}")
+
+
+def test_isolation_and_expiry(url: str, cache: slm.ResponseCache) -> None:
+    complete(url, request(temperature=0), cache_scope="1")
+    complete(url, request(temperature=0), cache_scope="2")
+    assert len(CALLS) == 2
+    sleep(0.3)
+    complete(url, request(temperature=0), cache_scope="1")
+    assert len(CALLS) == 3
+
+
+def test_served_copies(url: str, cache: slm.ResponseCache) -> None:
+    first, second = complete(url, request(temperature=0))
+    # Mutating a served response does not corrupt the cached one
+    second.content.choices[0].message.content = "Changed"
+    _, third = complete(url, request(temperature=0))
+    assert third.content.choices[0].message.content == "Hi"
+
+
+def test_saved_copies(url: str, cache: slm.ResponseCache) -> None:
+    async def calls() -> list:
+        service = slm.OpenAI(api_key="key", url=url)
+        req = openai.ChatCompletionRequest.from_chat_completion_request(
+            request(temperature=0)
+        )
+        first = await service.call(req)
+        # Mutating the response returned does not corrupt the cached one
+        first.content.choices[0].message.content = "Changed"
+        return await service.call(req)
+
+    assert run(calls).content.choices[0].message.content == "Hi"
+
+
+def test_disabled() -> None:
+    assert slm.default_response_cache() is None
+
+
+def test_store(url: str, cache: slm.ResponseCache) -> None:
+    store = LocalStore()
+    slm.response_cache = slm.StoreResponseCache(store=lambda: store)
+    first, second = complete(url, request(temperature=0))
+    assert len(CALLS) == 1
+    assert second.cached
+    assert second.content.choices == first.content.choices
+    assert slm.response_cache.stats() == {"hits": 1, "misses": 1}
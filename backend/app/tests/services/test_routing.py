@@ -0,0 +1,52 @@
+from pytest import raises
+
+from app.lm.models import ChatCompletionRequest, LMApiKeys, Message
+from app.lm.models import openai, mistral, anthropic
+from app.services.routing import Routes
+import app.services.lm as slm
+
+PROVIDERS = {
+    "openai": (openai.MODELS, openai.PREFIXES),
+    "mistral": (mistral.MODELS, mistral.PREFIXES),
+    "anthropic": (anthropic.MODELS, anthropic.PREFIXES),
+}
+
+
+def test_routes() -> None:
+    routes = Routes.build(PROVIDERS, {"fast": "claude-3-haiku-20240307"})
+    for provider, (models, _) in PROVIDERS.items():
+        for model in models:
+            assert routes.route(model) == (provider, model)
+    # Model families
+    assert routes.route("gpt-4o-2024-08-06") == ("openai", "gpt-4o-2024-08-06")
+    assert routes.provider("ft:gpt-4o-mini:org::id") == "openai"
+    assert routes.provider("mistral-large-2407") == "mistral"
+    assert routes.provider("claude-3-5-sonnet-20240620") == "anthropic"
+    # Aliases
+    assert routes.route("fast") == ("anthropic", "claude-3-haiku-20240307")
+    for model in ["llama-3", "gpt", "", None]:
+        with raises(ValueError):
+            routes.route(model)
+    with raises(ValueError):
+        Routes.build(PROVIDERS, {"cheap": "llama-3"})
+
+
+def test_language_models() -> None:
+    api_keys = LMApiKeys(
+        openai_api_key="o", mistral_api_key="m", anthropic_api_key="a"
+    )
+    models = slm.LanguageModels(api_keys=api_keys)
+    request = ChatCompletionRequest(
+        model="mistral-small",
+        messages=[Message(role="user", content="Hello")],
+    )
+    service, routed = models.route(request)
+    assert isinstance(service, slm.Mistral) and service.api_key == "m"
+    assert routed is request
+    assert models.request(request).url.startswith(slm.Mistral.url)
+    # The services are built once per API key
+    assert slm.LanguageModels(api_keys=api_keys).service("mistral") is service
+    assert slm.service(slm.Mistral, "m") is service
+    assert slm.service(slm.Mistral, "n") is not service
+    assert service.has_model("open-mixtral-8x22b")
+    assert not service.has_model("gpt-4o")
@@ -0,0 +1,117 @@
+from anyio import run
+from pytest import fixture
+
+from app.ai.simple_embedding import normalize, similarity
+from app.lm.models import (
+    ChatCompletionRequest,
+    ChatCompletionResponse,
+    Message,
+)
+from app.models import UserOut
+from app.ops.control import cond
+from app.ops.lm import semantic_lookup, semantic_store
+from app.services import Response
+from app.services.semantic_cache import SemanticCache
+
+PASSWORD = "How do I reset my password?"
+
+
+def request(content: str, **kwargs) -> ChatCompletionRequest:
+    return ChatCompletionRequest(
+        model="gpt-4o",
+        messages=[Message(role="user", content=content)],
+        **kwargs,
+    )
+
+
+def response(content: str) -> Response[ChatCompletionResponse]:
+    return Response(
+        status_code=200,
+        content=ChatCompletionResponse(
+            id="chatcmpl-1",
+            model="gpt-4o",
+            choices=[
+                {
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": content},
+                }
+            ],
+        ),
+    )
+
+
+@fixture
+def cache(tmp_path) -> SemanticCache:
+    cache = SemanticCache(path=str(tmp_path / "cache.sqlite"), audit_rate=0)
+    yield cache
+    cache.close()
+
+
+def test_embedding() -> None:
+    assert normalize("  How DO I\treset  ") == "how do i reset"
+    assert similarity(PASSWORD, "how do i reset my  password ?") > 0.9
+    assert similarity(PASSWORD, "What is the capital of France?") < 0.2
+
+
+def test_lookup(cache: SemanticCache) -> None:
+    assert cache.lookup("1", 0.9, request(PASSWORD)) is None
+    cache.store("1", 0.9, request(PASSWORD), response("Click on Forgot"))
+    hit = cache.lookup("1", 0.9, request("How do I reset my password ?"))
+    assert hit.cached and hit.content.id.startswith("chatcmpl-1-")
+    assert hit.content.choices[0].message.content == "Click on Forgot"
+    # Different requests, users or parameters miss
+    account = request("How do I delete my account?")
+    assert cache.lookup("1", 0.9, account) is None
+    assert cache.lookup("2", 0.9, request(PASSWORD)) is None
+    assert cache.lookup("1", 0.9, request(PASSWORD, temperature=1)) is None
+    stats = cache.stats()
+    print(f"\n{stats}")
+    assert stats["hits"] == 1 and stats["hit_rate"] == 0.2
+
+
+def test_persistence_and_eviction(cache: SemanticCache) -> None:
+    cache.size = 2
+    for i, question in enumerate(["Hi", "How are you?", "What time is it?"]):
+        cache.store("1", 0.9, request(question), response(f"Answer {i}"))
+    # Another process sees the entries
+    other = SemanticCache(path=cache.path)
+    assert other.lookup("1", 0.9, request("What time is it?")) is not None
+    assert other.lookup("1", 0.9, request("Hi")) is None
+    other.close()
+
+
+def test_audits(cache: SemanticCache) -> None:
+    cache.audit_rate = 1
+    cache.store("1", 0.9, request(PASSWORD), response("Click on Forgot"))
+    # The audited requests go to the model, the responses are compared
+    assert cache.lookup("1", 0.9, request(PASSWORD)) is None
+    cache.store("1", 0.9, request(PASSWORD), response("Click on Forgot"))
+    assert cache.lookup("1", 0.9, request(PASSWORD)) is None
+    cache.store("1", 0.9, request(PASSWORD), response("Call the support"))
+    stats = cache.stats()
+    print(f"\n{stats}")
+    assert stats["audits"] == 2 and stats["precision"] == 0.5
+
+
+def test_ops(cache: SemanticCache) -> None:
+    user = UserOut(id=1, email="user@example.com")
+    calls = []
+
+    def computation(threshold: float | None, content: str):
+        cached = semantic_lookup(user, threshold, request(content))
+        fresh = semantic_store(
+            user, threshold, request(content), response(content)
+        )
+        return cond(cached, cached, fresh)
+
+    async def evaluate(threshold: float | None, content: str):
+        result = await computation(threshold, content).evaluate(
+            semantic_cache=cache
+        )
+        calls.append(result.cached)
+        return result
+
+    for threshold in [None, None, 0.9, 0.9]:
+        run(evaluate, threshold, PASSWORD)
+    assert calls == [False, False, False, True]
@@ -23,6 +23,22 @@ def test_analyzer() -> None:
     print(f"\n{response}")
 
 
+def test_analyze_texts() -> None:
+    client = Analyzer()
+    texts = [TEXT, "Nothing here", TEXT]
+    request = AnalyzerRequest(text="", entities=["PERSON"])
+    analyses = run(client.analyze_texts, request, texts)
+    analysis = run(
+        client.analyze, AnalyzerRequest(text=TEXT, entities=["PERSON"])
+    )
+    assert len(analyses) == 3
+    assert analyses[1] == []
+    for items in (analyses[0], analyses[2]):
+        assert [TEXT[item.start : item.end] for item in items] == [
+            TEXT[item.start : item.end] for item in analysis
+        ]
+
+
 # Uses: https://raw.githubusercontent.com/microsoft/presidio-research/master/presidio_evaluator/data_generator/raw_data/templates.txt
 def test_anonymizer() -> None:
     analyzer = Analyzer()
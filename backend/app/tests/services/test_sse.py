@@ -0,0 +1,162 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+import json
+from anyio import run
+from pytest import fixture
+
+from app.lm.models import ChatCompletionRequest, Message, anthropic_models
+from app.services import sse
+from app.services.lm import OpenAI, Anthropic
+
+WORDS = ["Hello", " John", " Smith", "!"]
+
+
+def openai_events() -> list[str]:
+    chunk = {"id": "chatcmpl-1", "model": "gpt-4o", "created": 0}
+    events = [
+        {**chunk, "choices": [{"index": 0, "delta": {"role": "assistant"}}]}
+    ]
+    for word in WORDS:
+        events.append(
+            {**chunk, "choices": [{"index": 0, "delta": {"content": word}}]}
+        )
+    events.append(
+        {
+            **chunk,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 3, "total_tokens": 7},
+        }
+    )
+    return [sse.encode(json.dumps(event)) for event in events] + [
+        ": keep-alive\n\n",
+        sse.encode("[DONE]"),
+    ]
+
+
+def anthropic_events() -> list[str]:
+    message = {
+        "id": "msg_1",
+        "model": "claude-3-haiku-20240307",
+        "content": [],
+        "usage": {"input_tokens": 3, "output_tokens": 1},
+    }
+    events = [
+        {"type": "message_start", "message": message},
+        {
+            "type": "content_block_start",
+            "index": 0,
+            "content_block": {"type": "text", "text": ""},
+        },
+        {"type": "ping"},
+    ]
+    for word in WORDS:
+        events.append(
+            {
+                "type": "content_block_delta",
+                "index": 0,
+                "delta": {"type": "text_delta", "text": word},
+            }
+        )
+    events += [
+        {"type": "content_block_stop", "index": 0},
+        {
+            "type": "message_delta",
+            "delta": {"stop_reason": "end_turn"},
+            "usage": {"output_tokens": 4},
+        },
+        {"type": "message_stop"},
+    ]
+    return [
+        sse.encode(json.dumps(event), event=event["type"]) for event in events
+    ]
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_POST(self) -> None:
+        length = int(self.headers["Content-Length"])
+        assert json.loads(self.rfile.read(length))["stream"]
+        self.send_response(200)
+        self.send_header("Content-Type", sse.MEDIA_TYPE)
+        self.end_headers()
+        events = (
+            anthropic_events() if "messages" in self.path else openai_events()
+        )
+        for event in events:
+            self.wfile.write(event.encode())
+            self.wfile.flush()
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+@fixture(scope="module")
+def url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def request(model: str) -> ChatCompletionRequest:
+    return ChatCompletionRequest(
+        model=model, messages=[Message(role="user", content="Hello")]
+    )
+
+
+def test_events() -> None:
+    async def parse() -> list[sse.Event]:
+        async def lines():
+            text = "event: a\ndata: 1\ndata: 2\n\n: ping\n\ndata: 3"
+            for line in text.split("\n"):
+                yield line
+
+        return [event async for event in sse.events(lines())]
+
+    assert run(parse) == [sse.Event("1\n2", "a"), sse.Event("3")]
+
+
+def test_openai_stream(url: str) -> None:
+    async def stream() -> list:
+        service = OpenAI(api_key="key", url=url)
+        return [
+            chunk
+            async for chunk in service.chat_completion_stream(
+                request("gpt-4o")
+            )
+        ]
+
+    chunks = run(stream)
+    assert "".join(
+        "".join(chunk.texts().values()) for chunk in chunks
+    ) == "".join(WORDS)
+    response = type(chunks[0]).accumulate(chunks)
+    print(f"\n{response}")
+    assert response.choices[0].message.content == "".join(WORDS)
+    assert response.choices[0].finish_reason == "stop"
+    assert response.usage.total_tokens == 7
+
+
+def test_anthropic_stream(url: str) -> None:
+    async def stream() -> tuple[list, list]:
+        service = Anthropic(api_key="key", url=url)
+        unified = request("claude-3-haiku-20240307")
+        native = anthropic_models.ChatCompletionRequest
+        events = [
+            event
+            async for event in service.anthropic_chat_completion_stream(
+                native.from_chat_completion_request(unified)
+            )
+        ]
+        chunks = [
+            chunk async for chunk in service.chat_completion_stream(unified)
+        ]
+        return events, chunks
+
+    events, chunks = run(stream)
+    message = type(events[0]).accumulate(events)
+    print(f"\n{message}")
+    assert message.content[0].text == "".join(WORDS)
+    assert message.usage.output_tokens == 4
+    response = type(chunks[0]).accumulate(chunks)
+    assert response.choices[0].message.content == "".join(WORDS)
+    assert response.usage.total_tokens == 7
@@ -1,32 +1,46 @@
 import json
+import asyncio
 from sqlmodel import Session
 from pydantic import BaseModel
-from anyio import run
 from kombu.utils.json import register_type
+from kombu.serialization import register
 from celery import Celery
+from celery.signals import worker_process_shutdown, worker_shutdown
 from app.core.config import settings
 from app.core.db import engine
 from app.ops import Computation
 from app.ops.computation import JsonSerializable
+from app.ops import binary
+from app.ops.checkpoint import Checkpoint
+from app.services import clients
 
 # Register Computations
 register_type(
     Computation,
     "computation",
     lambda o: o.to_json(),
-    lambda o: Computation.from_json(o),
+    lambda o: Computation.from_json(o, trusted=True),
 )
 register_type(
     JsonSerializable,
     "json_serializable",
     lambda o: o.to_json(),
-    lambda o: JsonSerializable.from_json(o),
+    lambda o: JsonSerializable.from_json(o, trusted=True),
 )
 register_type(
     BaseModel,
     "base_model",
     lambda o: json.dumps(JsonSerializable.to_json_dict(o)),
-    lambda o: JsonSerializable.from_json(o),
+    lambda o: JsonSerializable.from_json(o, trusted=True),
+)
+
+# Register the compact binary format
+register(
+    "arena-msgpack",
+    binary.dumps,
+    lambda data: binary.loads(data, trusted=True),
+    content_type=binary.CONTENT_TYPE,
+    content_encoding="binary",
 )
 
 # Modify computation to avoid infinite loops
@@ -36,21 +50,54 @@ app = Celery(
     __name__,
     broker=str(settings.CELERY_STORE_URI),
     result_backend=str(settings.CELERY_STORE_URI),
-    serializer="json",
-    accept_content=["application/json"],
+    task_serializer=settings.CELERY_SERIALIZER,
+    result_serializer=settings.CELERY_SERIALIZER,
+    accept_content=["application/json", binary.CONTENT_TYPE],
 )
 
+# The event loop of the worker process, kept between tasks so that they reuse
+# the pooled connections to the services (see app.services.clients)
+_runner: asyncio.Runner | None = None
+
+
+def runner() -> asyncio.Runner:
+    global _runner
+    if _runner is None:
+        _runner = asyncio.Runner()
+    return _runner
 
-@app.task(autoretry_for=(Exception,), max_retries=3, retry_backoff=True)
-def evaluate(computation: Computation):
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def close_clients(**kwargs) -> None:
+    global _runner
+    if _runner is not None:
+        _runner.run(clients.aclose())
+        _runner.close()
+        _runner = None
+
+
+@app.task(
+    bind=True, autoretry_for=(Exception,), max_retries=3, retry_backoff=True
+)
+def evaluate(self, computation: Computation):
+    # The retries of a task resume from its checkpoint, kept in the broker
+    # store (with the async client of the event loop of the worker)
+    checkpoint = (
+        Checkpoint(prefix=f"arena:checkpoint:{self.request.id}:")
+        if self.request.id
+        else None
+    )
     try:
         with Session(engine) as session:
             #  Define the evaluation method
             async def evaluate_with_context():
-                return await computation.evaluate(session=session)
+                return await computation.evaluate(
+                    session=session, checkpoint=checkpoint
+                )
 
             # Run the evaluation
-            result = run(evaluate_with_context)
+            result = runner().run(evaluate_with_context())
         return result
     except Exception as e:
         raise e
@@ -0,0 +1,12 @@
+#!/usr/bin/env bash
+
+set -e
+set -x
+
+# Run the benchmarks of the engine, save the results (in .benchmarks) and
+# fail if the mean of a benchmark regressed by more than 25% from the last
+# saved run
+if ls .benchmarks/*/*.json > /dev/null 2>&1; then
+    compare="--benchmark-compare --benchmark-compare-fail=mean:25%"
+fi
+python -m pytest app/tests/benchmarks --benchmark-only --benchmark-autosave $compare "$@"
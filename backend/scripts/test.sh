@@ -3,6 +3,7 @@
 set -e
 set -x
 
-coverage run --source=app -m pytest
+# The benchmarks are only checked to run (see scripts/benchmark.sh)
+coverage run --source=app -m pytest --benchmark-disable
 coverage report --show-missing
 coverage html --title "${@-coverage}"
@@ -7,5 +7,9 @@ export type LMConfig = {
     pii_removal?: ('masking' | 'replace' | null);
     judge_evaluation?: boolean;
     judge_with_pii?: boolean;
+    semantic_cache_threshold?: (number | null);
+    alternative_models?: Array<string>;
+    fallback?: boolean;
+    hedge_percentile?: (number | null);
 };
 
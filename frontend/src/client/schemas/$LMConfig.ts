@@ -18,5 +18,34 @@ export const $LMConfig = {
         judge_with_pii: {
             type: 'boolean',
         },
+        semantic_cache_threshold: {
+            type: 'any-of',
+            contains: [{
+                type: 'number',
+                maximum: 1,
+                minimum: 0,
+            }, {
+                type: 'null',
+            }],
+        },
+        alternative_models: {
+            type: 'array',
+            contains: {
+                type: 'string',
+            },
+        },
+        fallback: {
+            type: 'boolean',
+        },
+        hedge_percentile: {
+            type: 'any-of',
+            contains: [{
+                type: 'number',
+                exclusiveMaximum: 100,
+                exclusiveMinimum: 0,
+            }, {
+                type: 'null',
+            }],
+        },
     },
 } as const;